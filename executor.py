@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the external predictor commands (java, perl...) in a bounded pool of
+workers: at most N children at a time, each one waited for, with its exit
+code, duration and stderr recorded and an optional timeout.
+"""
+
+import json
+import time
+import logging
+import subprocess
+
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+CommandResult = namedtuple('CommandResult', ['name', 'argv', 'returncode', 'duration',
+                                             'stderr', 'timed_out'])
+
+
+def run_command(name, argv, timeout=None, stdout_file=None):
+    """
+    Runs a command (no shell) and waits for it.
+
+    :param name: name of the command (e.g. the record or chunk it runs)
+    :param argv: command line as a list of arguments
+    :param timeout: seconds after which the command is killed (None: no limit)
+    :param stdout_file: file where stdout is written (discarded if None)
+    :return: CommandResult (returncode is None if it could not be started)
+    """
+    start = time.time()
+    stdout = open(stdout_file, 'wb') if stdout_file is not None else subprocess.DEVNULL
+    try:
+        process = subprocess.Popen(argv, stdout=stdout, stderr=subprocess.PIPE)
+    except OSError as e:
+        return CommandResult(name, argv, None, time.time() - start, str(e), False)
+    finally:
+        if stdout_file is not None:
+            stdout.close()
+
+    timed_out = False
+    try:
+        _, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        _, stderr = process.communicate()
+        timed_out = True
+
+    return CommandResult(name, argv, process.returncode, time.time() - start,
+                         stderr.decode('utf-8', 'replace'), timed_out)
+
+
+@contextmanager
+def command_pool(jobs=4, timeout=None):
+    """
+    Pool of at most `jobs` commands running at once (see run_command). All
+    the commands are waited for when the block exits.
+
+        with command_pool(jobs=4, timeout=3600) as submit:
+            future = submit('chunk_1', ['java', '-jar', ...])
+
+    :param jobs: maximum number of concurrent commands
+    :param timeout: seconds after which a command is killed (None: no limit)
+    :return: yields submit(name, argv, stdout_file=None), returning a
+        concurrent.futures.Future of the CommandResult
+    """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        def submit(name, argv, stdout_file=None):
+            return pool.submit(run_command, name, argv, timeout, stdout_file)
+        yield submit
+
+
+def summarise(results, report=None):
+    """
+    Logs a summary of the commands run (and the stderr of the failures).
+
+    :param results: list of CommandResult
+    :param report: JSON file where each result is written (optional)
+    :return: summary (dict)
+    """
+    failed = [r for r in results if r.returncode != 0]
+    durations = [r.duration for r in results]
+    summary = {'commands': len(results),
+               'succeeded': len(results) - len(failed),
+               'failed': len(failed),
+               'timed_out': sum(1 for r in results if r.timed_out),
+               'seconds_total': round(sum(durations), 3),
+               'seconds_max': round(max(durations), 3) if durations else 0.0}
+
+    for r in failed:
+        logging.error("{} failed ({}) after {:.1f}s: {}".format(
+            r.name, 'timed out' if r.timed_out else 'exit code {}'.format(r.returncode),
+            r.duration, r.stderr.strip()[-1000:]))
+    logging.info("{commands} commands: {succeeded} succeeded, {failed} failed ({timed_out} timed out), "
+                 "{seconds_total}s in total, {seconds_max}s at most".format(**summary))
+
+    if report is not None:
+        with open(report, 'w') as output:
+            json.dump({'summary': summary, 'commands': [r._asdict() for r in results]},
+                      output, indent=4)
+    return summary
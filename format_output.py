@@ -5,6 +5,7 @@ import jsonmerge
 import os
 import schema
 
+from nod_results import iter_nod_results
 from pprint import pprint
 from proteofav.structures import mmCIF, get_sequence, filter_structures
 from time import localtime
@@ -172,6 +173,20 @@ def format_1433_pdb(source_mmcif, prediction_result_file):
     """
     # Load predictions
     one433_sites = json.load(open(prediction_result_file))
+    struct_time = localtime(os.path.getmtime(prediction_result_file))
+    return format_1433_sites(source_mmcif, one433_sites, struct_time)
+
+
+def format_1433_sites(source_mmcif, one433_sites, struct_time=None):
+    """
+    Format 14-3-3-Pred sites, as loaded from a 14-3-3-Pred JSON or as
+    returned in-process by prediction.predict (result['Sites']).
+
+    :param source_mmcif:
+    :param one433_sites:
+    :param struct_time: release date (defaults to now)
+    :return:
+    """
     # Create FunPDBe JSONs for each prediction
     sites_jsons = [format_1433_site(site, source_mmcif) for site in one433_sites]
     # Merge FunPDBe JSONs respecting schema
@@ -182,7 +197,8 @@ def format_1433_pdb(source_mmcif, prediction_result_file):
     top_level_json.update(pdb_id='3tpp')
     top_level_json.update(chains=[{'chain_id': 'A', 'additional_chain_annotations': {}, 'residues': []}])
     # Release date
-    struct_time = localtime(os.path.getmtime(prediction_result_file))
+    if struct_time is None:
+        struct_time = localtime()
     date_string = '/'.join([str(getattr(struct_time, attr)) for attr in ('tm_mday', 'tm_mon', 'tm_year')])
     top_level_json.update(release_date=date_string)
     # 'labels' (referenced to 'sites')
@@ -224,6 +240,44 @@ def format_1433_pdb(source_mmcif, prediction_result_file):
 
 
 def parse_nod_results(pdb_id, chain_id, prediction_results_file):
+    """
+    Format the NOD results of a PDB chain: the record named <pdb>_<chain>
+    of a NOD results file (or its record if it has only one).
+
+    :param pdb_id: PDB identifier
+    :param chain_id: chain identifier
+    :param prediction_results_file: NOD results file (see iter_nod_results)
+    :return: FunPDBe JSON (dict)
+    """
+    name = '{}_{}'.format(pdb_id, chain_id)
+    result = None
+    records = 0
+    for record in iter_nod_results(prediction_results_file):
+        records += 1
+        if record.identifier == name:
+            result = record
+            break
+        if records == 1:
+            result = record
+    else:
+        # another chain's record is never formatted under this chain's name
+        if records != 1:
+            raise ValueError('No record {} in NOD results file {} ({} records).'.format(
+                name, prediction_results_file, records))
+    struct_time = localtime(os.path.getmtime(prediction_results_file))
+    return format_nod_result(pdb_id, chain_id, result, struct_time)
+
+
+def format_nod_result(pdb_id, chain_id, result, struct_time=None):
+    """
+    Format the NOD result of a PDB chain.
+
+    :param pdb_id: PDB identifier
+    :param chain_id: chain identifier
+    :param result: NodResult (see nod_results.iter_nod_results)
+    :param struct_time: release date (defaults to now)
+    :return: FunPDBe JSON (dict)
+    """
 
     def parse_segment_to_FunPDBe_chain_json(site_id_ref, value,  mmcif_series):
         chain_id = mmcif_series['label_asym_id']
@@ -237,44 +291,10 @@ def parse_nod_results(pdb_id, chain_id, prediction_results_file):
     # Read mmcif
     source_mmcif = read_mmcif_chain(pdb_id, chain_id)
 
-    # parse NOD results file
-    with open(prediction_results_file) as results:
-        nods_sections = ['scores', 'segments', 'positions', 'number', 'sequence', 'fasta_header']
-        fasta_lines = []
-        nols_residue_scores = []
-        for line in results:
-            line = line.strip()
-            # Sequence
-            if nods_sections[-1] == 'fasta_header' and line.startswith('>'):
-                fasta_lines.append(line)
-                nods_sections.pop()
-            elif nods_sections[-1] == 'sequence' and line[:1].isalpha() and not line.startswith('NOLS_segment_number'):
-                fasta_lines.append(line)
-            # Number
-            elif nods_sections[-1] == 'sequence' and line.startswith('NOLS_segment_number'):
-                nods_sections.pop()
-            # elif nods_sections[-1] == 'number' and line.startswith('NOLS_segment_number'):
-                n_nols_seqments = int(line.split(' ')[-1])
-                nods_sections.pop()
-            # Positions
-            elif nods_sections[-1] == 'positions' and line.startswith('NOLS_segments_positions'):
-                nols_site_ranges = ''.join(line.split(' ')[1:]).split(',')
-                nods_sections.pop()
-            # Segments
-            elif nods_sections[-1] == 'segments' and line.startswith('NOLS_segments'):
-                nols_segments = ''.join(line.split(' ')[1:]).split(',')
-                nods_sections.pop()
-            elif nods_sections[-1] == 'scores' and line[:1] in ['0', '1']:
-                nols_residue_scores.append(float(line))
-            elif line == '':
-                continue
-            else:
-                raise ValueError('Could not parse NOD results file.')
-
     # Process NOLS sites
     merged_sites_json = {}
-    for site_id, (site_range, site_sequence) in enumerate(zip(nols_site_ranges, nols_segments)):
-        start, end = [int(x) for x in site_range.split('-')]
+    for site_id, ((start, end), site_sequence) in enumerate(zip(result.segment_ranges.tolist(),
+                                                                result.segments)):
         site_mmcif_start, site_mmcif_end = start-1, end-1
         site_mmcif = source_mmcif.iloc[site_mmcif_start:site_mmcif_end+1]
         site_mmcif_seq = get_sequence(site_mmcif)
@@ -307,7 +327,8 @@ def parse_nod_results(pdb_id, chain_id, prediction_results_file):
     top_level_json.update(pdb_id=pdb_id)
     top_level_json.update(chains=[{'chain_id': chain_id, 'additional_chain_annotations': {}, 'residues': []}])
     # Release date
-    struct_time = localtime(os.path.getmtime(prediction_results_file))
+    if struct_time is None:
+        struct_time = localtime()
     date_string = '/'.join([str(getattr(struct_time, attr)) for attr in ('tm_mday', 'tm_mon', 'tm_year')])
     top_level_json.update(release_date=date_string)
     # 'labels' (referenced to 'sites')
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+JPred REST API client and concurrent job scheduler: submits up to N jobs
+at once, polls all the outstanding jobs in one loop (each one backing off
+on its own while it runs), downloads the results of each job as soon as it
+finishes and keeps the job IDs in a state file so an interrupted run
+resumes polling its jobs instead of submitting them again.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+
+from collections import deque, namedtuple
+
+JPRED_URL = os.environ.get('JPRED_URL', 'http://www.compbio.dundee.ac.uk/jpred4')
+
+# IMPORTANT: the JPred API asks for at least 10 seconds between requests
+# about a job (see lib/Jpred/jpredapi)
+MIN_INTERVAL = 10
+
+# seconds after its submission at which a job still running is given up
+MAX_WAIT = 12 * 3600
+
+JobStatus = namedtuple('JobStatus', ['jobid', 'state', 'message'])
+
+
+def job_name(name):
+    """
+    Gets a JPred job name from a record identifier: JPred only takes
+    names of Latin letters, digits and '_' (see lib/Jpred/jpredapi), so
+    any other character (e.g. '|', '.' or '-') is replaced by '_'.
+
+    :param name: record identifier
+    :return: job name (str)
+    """
+    return re.sub(r'[^A-Za-z0-9_]', '_', name) or 'job'
+
+
+class JPredClient(object):
+    """
+    JPred REST API client (submit, status and results) over one HTTP
+    session, so the connection to the server is kept alive between
+    requests. Same requests as lib/Jpred/jpredapi.
+    """
+
+    def __init__(self, url=JPRED_URL, email='funpdbe@dundee.ac.uk', timeout=60, retries=3):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.rest_url = '{}/cgi-bin/rest'.format(url)
+        self.results_url = '{}/results'.format(url)
+        self.email = email
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # unknown job ids (just submitted jobs may not be queued yet)
+        self.unknown = {}
+
+    def submit(self, input_seq, name, skip_pdb='on'):
+        """
+        Submits a sequence (single mode).
+
+        :param input_seq: FASTA file
+        :param name: record identifier (sent as its job_name)
+        :param skip_pdb: skip the PDB check ('on' or 'off')
+        :return: JPred job id (None if the submission failed)
+        """
+        with open(input_seq, 'r') as infile:
+            fasta = infile.read()
+        delimiter = '\u00a3\u20ac\u00a3\u20ac'
+        params = ['email={}'.format(self.email), 'name={}'.format(job_name(name)),
+                  'skipPDB={}'.format(skip_pdb), 'format=seq']
+        resource = ''.join(param + delimiter for param in params) + fasta
+
+        import requests
+
+        try:
+            r = self.session.post('{}/job'.format(self.rest_url), data=resource.encode('utf-8'),
+                                  headers={'Content-Type': 'text/txt'}, timeout=self.timeout,
+                                  allow_redirects=False)
+        except requests.RequestException as e:
+            logging.error("Jpred job submission failed for {}: {}".format(name, e))
+            return None
+        location = r.headers.get('Location', '')
+        jobid = location.rsplit('/', 1)[-1]
+        if not r.ok or not jobid.startswith('jp_'):
+            logging.error("Jpred job submission failed for {} (HTTP {}): {}".format(
+                name, r.status_code, r.text.strip()[:1000]))
+            return None
+        return jobid
+
+    def status(self, jobid):
+        """
+        Checks the status of a job (once).
+
+        :param jobid: JPred job id
+        :return: JobStatus; state is 'finished', 'failed' or 'running' (also
+            if the server could not be reached)
+        """
+        import requests
+
+        try:
+            r = self.session.get('{}/job/id/{}'.format(self.rest_url, jobid), timeout=self.timeout)
+        except requests.RequestException as e:
+            return JobStatus(jobid, 'running', str(e))
+        message = r.text.strip()
+        if r.status_code >= 500:
+            return JobStatus(jobid, 'running', message)
+        if not r.ok or 'malformed' in message or 'does not exist in the queue' in message:
+            return JobStatus(jobid, 'failed', message)
+        if 'No job of that ID' in message:
+            self.unknown[jobid] = self.unknown.get(jobid, 0) + 1
+            return JobStatus(jobid, 'failed' if self.unknown[jobid] > 2 else 'running', message)
+        if 'finished' in message:
+            return JobStatus(jobid, 'finished', message)
+        return JobStatus(jobid, 'running', message)
+
+    def results(self, jobid, extension, output_file):
+        """
+        Downloads a results file of a finished job.
+
+        :param jobid: JPred job id
+        :param extension: results file extension (e.g. jnet or tar.gz)
+        :param output_file: path to the output file
+        :return: True if downloaded
+        """
+        import requests
+
+        url = '{}/{}/{}.{}'.format(self.results_url, jobid, jobid, extension)
+        try:
+            r = self.session.get(url, timeout=self.timeout, stream=True)
+        except requests.RequestException as e:
+            logging.error("Could not download {}: {}".format(url, e))
+            return False
+        if not r.ok:
+            return False
+        output_tmp = '{}.{}.tmp'.format(output_file, os.getpid())
+        with open(output_tmp, 'wb') as outfile:
+            for block in r.iter_content(1 << 16):
+                outfile.write(block)
+        os.rename(output_tmp, output_file)
+        return True
+
+
+def load_jobs(state_file):
+    """
+    Loads the submitted jobs of a previous run.
+
+    :param state_file: JSON state file
+    :return: dictionary of jobs (jobid, hash and submitted) by record identifier
+    """
+    try:
+        with open(state_file, 'r') as infile:
+            return json.load(infile)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_jobs(jobs, state_file):
+    """
+    Saves the submitted jobs (renamed into place once written).
+
+    :param jobs: dictionary of jobs by record identifier
+    :param state_file: JSON state file
+    :return: None
+    """
+    state_tmp = '{}.{}.tmp'.format(state_file, os.getpid())
+    with open(state_tmp, 'w') as outfile:
+        json.dump(jobs, outfile, indent=4, sort_keys=True)
+    os.rename(state_tmp, state_file)
+
+
+def schedule_jobs(records, client, output_dir, state_file, max_jobs=5, extensions=('jnet', 'tar.gz'),
+                  min_interval=MIN_INTERVAL, max_interval=300, max_wait=MAX_WAIT, on_done=None,
+                  sleep=time.sleep, clock=time.time):
+    """
+    Runs JPred jobs concurrently: at most max_jobs are submitted and not yet
+    done at any time. Every outstanding job is polled in the same loop, at
+    first after min_interval seconds and then backing off (doubling, up to
+    max_interval) while it runs. Results are downloaded as soon as a job
+    finishes. Jobs of a previous run (same record and sequence hash in the
+    state file) are polled again rather than resubmitted. A job still
+    running (or whose status cannot be checked) max_wait seconds after its
+    submission has failed.
+
+    :param records: list of (name, input FASTA file, sequence hash)
+    :param client: JPred client (see JPredClient)
+    :param output_dir: directory where the results (<name>.<extension>) are written
+    :param state_file: JSON file where the submitted jobs are kept
+    :param max_jobs: maximum number of jobs running at once
+    :param extensions: results files downloaded per job
+    :param min_interval: seconds before a job is first polled (and minimum between polls)
+    :param max_interval: maximum seconds between polls of a job
+    :param max_wait: seconds after its submission at which a job has failed
+    :param on_done: function called as on_done(name, seq_hash, finished) when a job is done
+    :param sleep: sleep function (for testing)
+    :param clock: clock function (for testing)
+    :return: dictionary of job states ('finished', 'failed') by record name
+    """
+    jobs = load_jobs(state_file)
+    outcome = {}
+
+    # resume the jobs of a previous run first, then submit the rest
+    resumed = set(name for name, _, seq_hash in records
+                  if name in jobs and jobs[name]['hash'] == seq_hash)
+    queue = deque(record for record in records if record[0] in resumed)
+    queue.extend(record for record in records if record[0] not in resumed)
+
+    active = {}
+    while queue or active:
+        # fill the free slots
+        while queue and len(active) < max_jobs:
+            name, input_seq, seq_hash = queue.popleft()
+            job = jobs.get(name)
+            if job is None or job['hash'] != seq_hash:
+                jobid = client.submit(input_seq, name)
+                if not jobid:
+                    outcome[name] = 'failed'
+                    if on_done is not None:
+                        on_done(name, seq_hash, False)
+                    continue
+                job = {'jobid': jobid, 'hash': seq_hash, 'submitted': clock()}
+                jobs[name] = job
+                save_jobs(jobs, state_file)
+                logging.info("Submitted Jpred job {} for {}.".format(jobid, name))
+            else:
+                logging.info("Resuming Jpred job {} for {}.".format(job['jobid'], name))
+            active[name] = {'job': job, 'interval': min_interval, 'poll': clock() + min_interval}
+
+        if not active:
+            continue
+
+        # wait for the next job due to be polled
+        now = clock()
+        next_poll = min(entry['poll'] for entry in active.values())
+        if next_poll > now:
+            sleep(next_poll - now)
+            now = clock()
+
+        for name in sorted(active, key=lambda name: active[name]['poll']):
+            entry = active[name]
+            if entry['poll'] > now:
+                continue
+            jobid = entry['job']['jobid']
+            status = client.status(jobid)
+            if status.state == 'running':
+                waited = clock() - entry['job']['submitted']
+                if waited < max_wait:
+                    entry['interval'] = min(entry['interval'] * 2, max_interval)
+                    entry['poll'] = clock() + entry['interval']
+                    continue
+                # given up (and submitted again by the next run)
+                status = JobStatus(jobid, 'failed', 'still running {:.0f} seconds after its '
+                                                    'submission: {}'.format(waited, status.message))
+
+            finished = False
+            if status.state == 'finished':
+                finished = all(client.results(jobid, extension,
+                                              os.path.join(output_dir, '{}.{}'.format(name, extension)))
+                               for extension in extensions)
+                if not finished:
+                    logging.error("Jpred job {} ({}) results could not be downloaded.".format(jobid, name))
+            else:
+                logging.error("Jpred job {} ({}) has errored: {}".format(jobid, name, status.message))
+
+            outcome[name] = 'finished' if finished else 'failed'
+            if on_done is not None:
+                on_done(name, entry['job']['hash'], finished)
+            del active[name]
+            # a finished job whose results could not be downloaded is kept
+            # (polled and downloaded again by the next run)
+            if finished or status.state != 'finished':
+                del jobs[name]
+                save_jobs(jobs, state_file)
+
+    return outcome
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks the 14-3-3-Pred scoring throughput stage by stage: window
+extraction, peptide encoding, each of the ANN, PSSM and SVM methods,
+the PhosphoSitePlus lookup and output writing.
+
+    python benchmark.py --sequences 2000 --length 400 --st-density 0.15 -o bench.json
+    python benchmark.py --case 3tpp -o bench_3tpp.json
+
+Results (seconds, sites/second and the process peak RSS after each stage,
+with how much the stage raised it) are printed and saved as JSON so that
+runs can be compared between commits.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PATH)
+
+# background residue frequencies (UniProtKB/Swiss-Prot, %) without Ser/Thr
+aa_background = {"A": 8.25, "R": 5.53, "N": 4.06, "D": 5.45, "C": 1.37,
+                 "Q": 3.93, "E": 6.75, "G": 7.07, "H": 2.27, "I": 5.96,
+                 "L": 9.66, "K": 5.84, "M": 2.42, "F": 3.86, "P": 4.70,
+                 "W": 1.08, "Y": 2.92, "V": 6.87}
+
+
+def synthetic_proteome(sequences=1000, length=400, st_density=0.15, seed=0):
+    """
+    Generates a synthetic proteome: background residues with Ser/Thr at a
+    given density.
+
+    @param sequences: number of sequences
+    @param length: mean sequence length (lengths are drawn from +/- 50%)
+    @param st_density: fraction of Ser/Thr residues
+    @param seed: random seed
+    @return: returns a list of (identifier, sequence) tuples
+    """
+
+    rng = random.Random(seed)
+    residues = sorted(aa_background)
+    weights = [aa_background[aa] for aa in residues]
+    cumulative = [sum(weights[:i + 1]) for i in range(len(weights))]
+
+    def residue():
+        if rng.random() < st_density:
+            return rng.choice("ST")
+        point = rng.random() * cumulative[-1]
+        for aa, limit in zip(residues, cumulative):
+            if point < limit:
+                return aa
+        return residues[-1]
+
+    proteome = []
+    for i in range(sequences):
+        size = max(30, int(length * rng.uniform(0.5, 1.5)))
+        proteome.append(("SYN%06d" % (i + 1), "M" + "".join(residue() for _ in range(size - 1))))
+    return proteome
+
+
+def fixed_case(repeats=200):
+    """
+    Gets the fixed small case: 3tpp_A (data/input) repeated.
+
+    @param repeats: number of copies of the sequence
+    @return: returns a list of (identifier, sequence) tuples
+    """
+
+    from Bio import SeqIO
+
+    fasta = os.path.join(PATH, "..", "..", "data", "input", "3tpp_A.fasta")
+    record = SeqIO.read(fasta, "fasta")
+    return [("3tpp_A_%d" % (i + 1), str(record.seq)) for i in range(repeats)]
+
+
+def peak_rss():
+    """
+    Gets the peak resident set size of this process so far (process wide:
+    it only grows, so it is not the peak of a single stage).
+
+    @return: returns the peak RSS in MB (None if not available)
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        peak /= 1024.0
+    return round(peak / 1024.0, 1)
+
+
+def time_stage(function, count, repeat=3, unit="sites"):
+    """
+    Times a stage (best of repeat).
+
+    @param function: function running the stage
+    @param count: number of items (unit) processed by the stage
+    @param repeat: number of timed runs
+    @param unit: items processed by the stage (sites, proteins...)
+    @return: returns the stage result (dict) and the function's return value;
+        the process peak RSS is reported after the stage together with how
+        much the stage raised it
+    """
+
+    best = None
+    value = None
+    before = peak_rss()
+    try:
+        for _ in range(repeat):
+            start = time.time()
+            value = function()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        stage = {"seconds": round(best, 6), unit: count,
+                 "%s_per_second" % unit: round(count / best, 1) if count and best > 0 else None}
+    except Exception as e:
+        stage = {"error": "%s: %s" % (type(e).__name__, e)}
+        value = None
+
+    after = peak_rss()
+    stage["process_peak_rss_mb"] = after
+    stage["peak_rss_increase_mb"] = round(after - before, 1) if after is not None else None
+    return stage, value
+
+
+def git_commit():
+    """
+    Gets the current commit of the repository (if any).
+    """
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=PATH,
+                                         stderr=open(os.devnull, "w"))
+        return commit.decode("ascii").strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(proteome, repeat=3):
+    """
+    Runs every stage of the benchmark over a proteome.
+
+    @param proteome: list of (identifier, sequence) tuples
+    @param repeat: number of timed runs per stage (best is kept)
+    @return: returns the results of each stage (dict)
+    """
+
+    import methods
+    import predictor
+    from prediction import iter_batches, predict_batch, write_results, dataset_writer
+
+    # scores must always be computed (no persistent score cache)
+    methods.SCORES_DB = None
+
+    stages = dict()
+
+    # window extraction
+    def extract():
+        return [record for batch in iter_batches(proteome, batch_size=len(proteome) * 1000)
+                for record in batch]
+    stage, records = time_stage(extract, 0, repeat)
+    if "error" in stage:
+        stages["windows"] = stage
+        for name in ("encoding", "ann_load", "ann", "pssm_load", "pssm", "svm_load", "svm",
+                     "phosphosite_index", "phosphosite", "predict_batch", "write_legacy",
+                     "write_dataset_tsv", "write_dataset_parquet"):
+            stages[name] = {"error": "skipped: no windows"}
+        return stages
+    nsites = sum(len(record[3]) for record in records)
+    stage["sites"] = nsites
+    stage["sites_per_second"] = round(nsites / stage["seconds"], 1) if stage["seconds"] > 0 else None
+    stages["windows"] = stage
+    peptides = [entry[3] for record in records for entry in record[3]]
+
+    # encoding
+    stages["encoding"], encoded = time_stage(lambda: predictor.encode_peptides(peptides), nsites, repeat)
+
+    # models (trained/derived and cached the first time), then each method
+    # whose model could be loaded
+    loaded = []
+    for name, load, score in (("ann", predictor.ann_load_network, predictor.ann_prediction),
+                              ("pssm", predictor.pssm_load_matrices, predictor.pssm_prediction),
+                              ("svm", predictor.svm_load_weights, predictor.svm_prediction)):
+        stages["%s_load" % name] = time_stage(load, 0, 1)[0]
+        if "error" in stages["%s_load" % name]:
+            stages[name] = {"error": "skipped: model not loaded"}
+            continue
+        loaded.append(name)
+        stages[name] = time_stage(lambda: score(peptides, encoded=encoded), nsites, repeat)[0]
+
+    # PhosphoSitePlus lookup (the UniProt features are left out: network)
+    identifiers = [record[1] for record in records]
+    stages["phosphosite_index"] = time_stage(methods.phosphosite_index, 0, 1)[0]
+    stages["phosphosite"] = time_stage(lambda: methods.get_phosphosite_sites(identifiers),
+                                       len(identifiers), repeat, unit="proteins")[0]
+
+    # output writing (scored once with the loaded methods, written per
+    # sequence and as a dataset)
+    stages["predict_batch"], results = time_stage(
+        lambda: predict_batch(records, phosphosites=False, methods=loaded), nsites, 1)
+    if results is None:
+        for name in ("write_legacy", "write_dataset_tsv", "write_dataset_parquet"):
+            stages[name] = {"error": "skipped: scoring failed"}
+        return stages
+
+    workspace = tempfile.mkdtemp(prefix="1433pred_bench_")
+    try:
+        def legacy():
+            for result in results:
+                write_results(result, workspace, result["Identifier"],
+                              formats=["csv", "tsv", "json", "full", "fa"])
+
+        def dataset(extension):
+            with dataset_writer(os.path.join(workspace, "dataset.%s" % extension)) as write:
+                for result in results:
+                    write(result)
+
+        stages["write_legacy"] = time_stage(legacy, nsites, repeat)[0]
+        stages["write_dataset_tsv"] = time_stage(lambda: dataset("tsv"), nsites, repeat)[0]
+        stages["write_dataset_parquet"] = time_stage(lambda: dataset("parquet"), nsites, repeat)[0]
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    return stages
+
+
+def main():
+    """
+    Main option parser.
+    """
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks 14-3-3-Pred scoring throughput.')
+
+    parser.add_argument('--case', dest='case', choices=['synthetic', '3tpp'], default='synthetic',
+                        help='synthetic proteome or the fixed 3tpp_A case')
+    parser.add_argument('--sequences', dest='sequences', type=int, default=1000,
+                        help='number of sequences (synthetic)')
+    parser.add_argument('--length', dest='length', type=int, default=400,
+                        help='mean sequence length (synthetic)')
+    parser.add_argument('--st-density', dest='st_density', type=float, default=0.15,
+                        help='fraction of Ser/Thr residues (synthetic)')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='random seed (synthetic)')
+    parser.add_argument('--repeats', dest='repeats', type=int, default=200,
+                        help='number of copies of 3tpp_A (3tpp)')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='timed runs per stage (best is kept)')
+    parser.add_argument('-o', dest='output', type=str, default=None,
+                        help='output JSON file')
+
+    args = parser.parse_args()
+
+    if args.case == '3tpp':
+        proteome = fixed_case(args.repeats)
+        case = {"name": "3tpp", "repeats": args.repeats}
+    else:
+        proteome = synthetic_proteome(args.sequences, args.length, args.st_density, args.seed)
+        case = {"name": "synthetic", "sequences": args.sequences, "length": args.length,
+                "st_density": args.st_density, "seed": args.seed}
+    case["residues"] = sum(len(sequence) for _, sequence in proteome)
+
+    import numpy
+    benchmark = {"commit": git_commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "python": platform.python_version(), "numpy": numpy.__version__,
+                 "platform": platform.platform(), "case": case,
+                 "stages": run_benchmark(proteome, repeat=args.repeat)}
+
+    for name, stage in sorted(benchmark["stages"].items()):
+        if "error" in stage:
+            print("%-24s %s" % (name, stage["error"]))
+        else:
+            unit = "proteins" if "proteins" in stage else "sites"
+            print("%-24s %10.4f s %14s %s/s %8s MB process peak (+%s)"
+                  % (name, stage["seconds"], stage["%s_per_second" % unit], unit,
+                     stage["process_peak_rss_mb"], stage["peak_rss_increase_mb"]))
+
+    if args.output is not None:
+        with open(args.output, "w") as out:
+            json.dump(benchmark, out, indent=4, sort_keys=True)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
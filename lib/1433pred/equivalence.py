@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Golden-output equivalence harness: runs a reference and a candidate
+14-3-3-Pred implementation side by side over a corpus of FASTA files and
+compares their per-site scores and Three/Two/One/False classification.
+
+An implementation is either:
+    golden          the stored outputs (data/output/1433pred/<name>.json/.full)
+    <directory>     a 14-3-3-Pred tree (a lib/1433pred directory)
+    git:<revision>  the lib/1433pred tree of a git revision
+
+    python equivalence.py                              # golden vs this tree
+    python equivalence.py --reference git:HEAD~1 --tolerance 0.001
+    python equivalence.py --reference <legacy tree> --reference-python python2.7
+
+Scores are compared at their stored precision (3 decimal places): the
+deviation of a score is the number of units of the last printed decimal
+it moved by. The default --tolerance (0.001) allows one such unit, which
+is what the SVM retrained with NumPy needs against the PyML golden
+outputs; use --tolerance 0 to require identical printed scores.
+
+Exits with a non-zero status if a per-method deviation exceeds the
+tolerance, if any site is classified differently (see --max-class-changes),
+if the two implementations do not report the same sites or if an input
+has no golden output (see --allow-skipped).
+
+The golden output of 3tpp_A comes from the original (PyML) 14-3-3-Pred.
+The other golden outputs were written by the NumPy port, with their ANN
+and PSSM scores checked against the compiled ANN and the per-peptide PSSM
+of the original; their SVM scores pin the retrained SVM.
+"""
+
+import os
+import sys
+import json
+import glob
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(PATH, "..", ".."))
+GOLDEN_PATH = os.path.join(ROOT, "data", "output", "1433pred")
+
+scores = ["ANN", "PSSM", "SVM", "Consensus"]
+# decimal places of the stored scores
+decimals = 3
+
+
+def get_corpus(inputs=None):
+    """
+    Gets the corpus: FASTA files with one sequence each.
+
+    @param inputs: FASTA files (data/input/*.fasta if None)
+    @return: returns a sorted list of FASTA files
+    """
+
+    if not inputs:
+        inputs = glob.glob(os.path.join(ROOT, "data", "input", "*.fasta"))
+    return sorted(os.path.abspath(fasta) for fasta in inputs)
+
+
+def get_tree(implementation, workspace):
+    """
+    Gets the directory of an implementation (extracting git revisions).
+
+    @param implementation: 'golden', a directory or 'git:<revision>'
+    @param workspace: directory where git revisions are extracted
+    @return: returns a directory (None for golden)
+    """
+
+    if implementation == "golden":
+        return None
+
+    if implementation.startswith("git:"):
+        revision = implementation[4:]
+        archive = os.path.join(workspace, "%s.tar" % revision.replace("/", "_"))
+        with open(archive, "wb") as out:
+            subprocess.check_call(["git", "archive", revision, "lib/1433pred"], cwd=ROOT, stdout=out)
+        tree = os.path.join(workspace, revision.replace("/", "_"))
+        with tarfile.open(archive) as tar:
+            tar.extractall(tree)
+        return os.path.join(tree, "lib", "1433pred")
+
+    tree = os.path.abspath(implementation)
+    if not os.path.isfile(os.path.join(tree, "prediction.py")):
+        raise ValueError("No prediction.py in '%s'." % tree)
+    return tree
+
+
+def load_outputs(output_path, name):
+    """
+    Loads the per-site scores (json) and classification (full) of a
+    single sequence run.
+
+    @param output_path: output directory
+    @param name: output files basename
+    @return: returns a dictionary of sites (dict) by position (None if missing)
+    """
+
+    link_json = os.path.join(output_path, "%s.json" % name)
+    link_full = os.path.join(output_path, "%s.full" % name)
+    if not os.path.isfile(link_json) or not os.path.isfile(link_full):
+        return None
+
+    sites = dict()
+    with open(link_json) as inlines:
+        for site in json.load(inlines):
+            entry = {"Peptide": site["Peptide"]}
+            for score in scores:
+                entry[score] = float(site[score])
+            sites[int(site["Site"])] = entry
+
+    with open(link_full) as inlines:
+        for line in inlines:
+            line = line.rstrip("\r\n").split("\t")
+            if len(line) > 6 and int(line[0]) in sites:
+                sites[int(line[0])]["Candidate"] = line[6]
+
+    return sites
+
+
+def run_implementation(tree, fasta, output_path, python=sys.executable):
+    """
+    Runs an implementation (single sequence mode) on a FASTA file.
+
+    @param tree: directory of the implementation (None for golden)
+    @param fasta: input FASTA file
+    @param output_path: output directory (ignored for golden)
+    @param python: python interpreter used to run it
+    @return: returns the sites (see load_outputs)
+    """
+
+    name = os.path.basename(fasta).split(".")[0]
+    if tree is None:
+        return load_outputs(GOLDEN_PATH, name)
+
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+
+    # shared model cache (keyed by the training data, so safe across trees)
+    env = dict(os.environ)
+    env.setdefault("PRED1433_CACHE", os.path.join(PATH, "cache"))
+    with open(os.devnull, "w") as devnull:
+        subprocess.call([python, os.path.join(tree, "prediction.py"), "-i", fasta, "-o", output_path],
+                        cwd=tree, env=env, stdout=devnull)
+    return load_outputs(output_path, name)
+
+
+def printed_units(value):
+    """
+    Gets a score in units of its last stored decimal place (outputs are
+    printed with 3 decimal places), so that scores are compared exactly at
+    the stored precision.
+
+    @param value: score (float)
+    @return: returns an int (e.g. 457 for 0.457)
+    """
+
+    return int(round(value * 10 ** decimals))
+
+
+def compare(reference, candidate):
+    """
+    Compares the sites of a reference and a candidate run at the stored
+    precision (3 decimal places).
+
+    @param reference: reference sites (see load_outputs)
+    @param candidate: candidate sites (see load_outputs)
+    @return: returns the maximum absolute deviation per score in units of
+        the last decimal place (dict), the number of printed scores that
+        differ per score (dict), the classification changes and the sites
+        reported by only one of them
+    """
+
+    deviations = dict((score, 0) for score in scores)
+    differences = dict((score, 0) for score in scores)
+    changes = []
+    mismatches = sorted(set(reference) ^ set(candidate))
+    for position in sorted(set(reference) & set(candidate)):
+        ref, cand = reference[position], candidate[position]
+        if ref["Peptide"] != cand["Peptide"]:
+            mismatches.append(position)
+            continue
+        for score in scores:
+            deviation = abs(printed_units(ref[score]) - printed_units(cand[score]))
+            deviations[score] = max(deviations[score], deviation)
+            differences[score] += deviation > 0
+        if ref.get("Candidate") != cand.get("Candidate"):
+            changes.append({"Site": position, "Peptide": ref["Peptide"],
+                            "reference": ref.get("Candidate"), "candidate": cand.get("Candidate")})
+
+    return deviations, differences, changes, mismatches
+
+
+def run_equivalence(reference="golden", candidate=PATH, inputs=None, tolerance=0.001,
+                    max_class_changes=0, reference_python=sys.executable,
+                    candidate_python=sys.executable, allow_skipped=False):
+    """
+    Runs the reference and the candidate over the corpus and compares them.
+
+    @param reference: reference implementation (see get_tree)
+    @param candidate: candidate implementation (see get_tree)
+    @param inputs: FASTA files (see get_corpus)
+    @param tolerance: maximum absolute deviation allowed per score, at the
+        stored precision (0.001 allows one unit of the last decimal place)
+    @param max_class_changes: number of classification changes allowed
+    @param reference_python: python interpreter of the reference
+    @param candidate_python: python interpreter of the candidate
+    @param allow_skipped: pass even if some inputs have no golden output
+        (they are listed in report['skipped'] either way)
+    @return: returns the report (dict); report['passed'] is a boolean
+    """
+
+    workspace = tempfile.mkdtemp(prefix="1433pred_equivalence_")
+    try:
+        reference_tree = get_tree(reference, workspace)
+        candidate_tree = get_tree(candidate, workspace)
+
+        report = {"reference": reference, "candidate": candidate, "tolerance": tolerance,
+                  "max_class_changes": max_class_changes, "corpus": [],
+                  "max_deviation": dict((score, 0.0) for score in scores),
+                  "printed_differences": dict((score, 0) for score in scores),
+                  "class_changes": 0, "skipped": []}
+        deviation_units = dict((score, 0) for score in scores)
+        failures = []
+        for fasta in get_corpus(inputs):
+            name = os.path.basename(fasta).split(".")[0]
+            ref = run_implementation(reference_tree, fasta, os.path.join(workspace, "reference"),
+                                     reference_python)
+            if ref is None and reference_tree is None:
+                # no golden output for this input: reported, not compared
+                report["skipped"].append(os.path.relpath(fasta, ROOT))
+                continue
+            cand = run_implementation(candidate_tree, fasta, os.path.join(workspace, "candidate"),
+                                      candidate_python)
+
+            entry = {"input": os.path.relpath(fasta, ROOT)}
+            if ref is None or cand is None:
+                entry["error"] = "no output from the %s" % ("reference" if ref is None else "candidate")
+                failures.append("%s: %s" % (name, entry["error"]))
+                report["corpus"].append(entry)
+                continue
+
+            deviations, differences, changes, mismatches = compare(ref, cand)
+            entry.update({"sites": len(ref), "printed_differences": differences,
+                          "max_deviation": dict((score, float(deviations[score]) / 10 ** decimals)
+                                                for score in scores),
+                          "class_changes": changes, "site_mismatches": mismatches})
+            report["corpus"].append(entry)
+
+            for score in scores:
+                deviation_units[score] = max(deviation_units[score], deviations[score])
+                report["max_deviation"][score] = float(deviation_units[score]) / 10 ** decimals
+                report["printed_differences"][score] += differences[score]
+            report["class_changes"] += len(changes)
+            if mismatches:
+                failures.append("%s: sites differ at %s" % (name, mismatches))
+
+        for score in scores:
+            if deviation_units[score] > printed_units(tolerance):
+                failures.append("%s: max deviation %.*f > %s" % (score, decimals, report["max_deviation"][score],
+                                                                 tolerance))
+        if report["class_changes"] > max_class_changes:
+            failures.append("%d classification changes (> %d)" % (report["class_changes"],
+                                                                   max_class_changes))
+        if not report["corpus"]:
+            failures.append("empty corpus")
+        if report["skipped"] and not allow_skipped:
+            failures.append("%d inputs without a golden output" % len(report["skipped"]))
+
+        report["failures"] = failures
+        report["passed"] = not failures
+        return report
+
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def main():
+    """
+    Main option parser.
+    """
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Compares a candidate 14-3-3-Pred implementation '
+                                                 'with a reference over a corpus.')
+
+    parser.add_argument('-i', dest='inputs', type=str, nargs='*', default=None,
+                        help='input FASTA files (default: data/input/*.fasta)')
+    parser.add_argument('--reference', dest='reference', type=str, default='golden',
+                        help="reference: 'golden', a directory or 'git:<revision>'")
+    parser.add_argument('--candidate', dest='candidate', type=str, default=PATH,
+                        help="candidate: a directory or 'git:<revision>' (default: this tree)")
+    parser.add_argument('--reference-python', dest='reference_python', type=str, default=sys.executable,
+                        help='python interpreter of the reference')
+    parser.add_argument('--candidate-python', dest='candidate_python', type=str, default=sys.executable,
+                        help='python interpreter of the candidate')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.001,
+                        help='maximum absolute deviation per score at the stored precision of 3 decimal '
+                             'places (default: 0.001, one unit of the last decimal)')
+    parser.add_argument('--max-class-changes', dest='max_class_changes', type=int, default=0,
+                        help='number of Three/Two/One/False changes allowed')
+    parser.add_argument('--allow-skipped', dest='allow_skipped', action='store_true', default=False,
+                        help='do not fail on inputs that have no golden output (they are still reported)')
+    parser.add_argument('-o', dest='output', type=str, default=None,
+                        help='output JSON report')
+
+    args = parser.parse_args()
+
+    report = run_equivalence(args.reference, args.candidate, args.inputs, args.tolerance,
+                             args.max_class_changes, args.reference_python, args.candidate_python,
+                             args.allow_skipped)
+
+    for entry in report["corpus"]:
+        if "error" in entry:
+            print("%-32s %s" % (entry["input"], entry["error"]))
+        else:
+            print("%-32s %4d sites  %s  %d class changes" % (
+                entry["input"], entry["sites"],
+                "  ".join("%s %.*f (%d)" % (score, decimals, entry["max_deviation"][score],
+                                            entry["printed_differences"][score]) for score in scores),
+                len(entry["class_changes"])))
+    for skipped in report["skipped"]:
+        print("%-32s skipped: no golden output" % skipped)
+    print("max deviation (printed scores that differ): %s" % ", ".join(
+        "%s %.*f (%d)" % (score, decimals, report["max_deviation"][score], report["printed_differences"][score])
+        for score in scores))
+    for failure in report["failures"]:
+        print("FAILED: %s" % failure)
+    print("PASSED" if report["passed"] else "FAILED")
+
+    if args.output is not None:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=4, sort_keys=True)
+
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
 import os
@@ -7,18 +7,37 @@ import time
 import random
 import json
 import sqlite3
+import socket
 import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 DEV = "www1433"
 # sys.path.append("/homes/www-1433/%s/app/test/lib/python2.6/site-packages/old/" % DEV)
 
-import requests
-
 # PATH = "/homes/www-1433/%s/app/" % DEV
 PATH = os.path.dirname(__file__)
 # TMP_PATH = "/homes/www-1433/tmp/"
 TMP_PATH = tempfile.gettempdir()
 DB_PATH = "/homes/www-1433/"
+CACHE_PATH = os.environ.get("PRED1433_CACHE", os.path.join(PATH, "cache"))
+# peptide score cache (disabled if not set, see score_cache_connection)
+SCORES_DB = os.environ.get("PRED1433_SCORES_DB")
+score_cache = None
+# indexed PhosphoSitePlus sites (built from PhosphoSite.txt, see phosphosite_index)
+PHOSPHOSITE_TXT = os.path.join(PATH, "PhosphoSite.txt")
+PHOSPHOSITE_DB = os.path.join(CACHE_PATH, "PhosphoSite.db")
+phosphosite_cache = None
+# local UniProt entries (FASTA and phospho MOD_RES, see prefetch_uniprot)
+UNIPROT_URL = os.environ.get("PRED1433_UNIPROT_URL", "http://www.uniprot.org/uniprot")
+UNIPROT_DB = os.path.join(CACHE_PATH, "UniProt.db")
+# time to live of a cached entry (seconds)
+UNIPROT_TTL = float(os.environ.get("PRED1433_UNIPROT_TTL", 30 * 24 * 3600))
+uniprot_cache = None
+uniprot_session = None
+# entries whose download failed in this run (not downloaded again, see prefetch_uniprot)
+uniprot_failed = set()
+# per-stage timers of this process (see timer)
+timings = {}
 
 
 aa_common = ['A', 'C', 'D', 'E', 'F', 'G', 'H',
@@ -71,13 +90,8 @@ def validate_uniprot(identifier):
     full_sequence = ""
 
     try:
-        url = 'http://www.uniprot.org/uniprot/%s.fasta' % identifier.upper()
-        read = requests.get(url)
-        if read.status_code == 200:
-            full_sequence = read.text
-            valid = True
-        else:
-            valid = False
+        full_sequence = get_uniprot_entry(identifier)[0]
+        valid = full_sequence != ""
     except:
         valid = False
 
@@ -147,6 +161,131 @@ def validate_file(infile):
     return valid
 
 
+@contextmanager
+def atomic_write(output_file, mode="w"):
+    """
+    Opens an output file for writing under a temporary name (unique to
+    this host and process) in the same directory, renamed onto the output
+    file once it is written. Concurrent runs never interleave their lines
+    and readers never see a partial file; on error the output is left
+    untouched.
+
+    :param output_file: output file
+    :param mode: file mode ('w' or 'wb')
+    :return: yields the open temporary file
+    """
+
+    tmp_file = "%s.%s.%s.tmp" % (output_file, socket.gethostname(), os.getpid())
+    try:
+        with open(tmp_file, mode) as out:
+            yield out
+        os.rename(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+@contextmanager
+def atomic_writes(output_files, mode="w"):
+    """
+    Opens several output files with atomic_write (renamed into place only
+    if all of them are written).
+
+    :param output_files: output files
+    :param mode: file mode ('w' or 'wb')
+    :return: yields a list of open temporary files
+    """
+
+    if not output_files:
+        yield []
+    else:
+        with atomic_write(output_files[0], mode) as first:
+            with atomic_writes(output_files[1:], mode) as rest:
+                yield [first] + rest
+
+
+@contextmanager
+def timer(stage, count=0):
+    """
+    Times a stage (e.g. encoding, ann, phosphosites or writing). Calls,
+    items processed and seconds are accumulated per stage in this process
+    (see get_timings).
+
+        with timer("ann", len(peptides)):
+            ...
+
+    :param stage: name of the stage
+    :param count: number of items (sites, records...) processed
+    :return: yields the stage entry; its 'count' can still be updated
+    """
+
+    entry = {"count": count}
+    start = time.time()
+    try:
+        yield entry
+    finally:
+        elapsed = time.time() - start
+        total = timings.setdefault(stage, {"calls": 0, "count": 0, "seconds": 0.0})
+        total["calls"] += 1
+        total["count"] += entry["count"]
+        total["seconds"] += elapsed
+
+
+def get_timings(reset=False):
+    """
+    Gets the accumulated stage timers of this process.
+
+    :param reset: start the timers again from zero
+    :return: returns a dictionary of stages (calls, count and seconds)
+    """
+
+    stages = dict((stage, dict(total)) for stage, total in timings.items())
+    if reset:
+        timings.clear()
+    return stages
+
+
+def merge_timings(stages):
+    """
+    Adds stage timers (e.g. from a worker process, see get_timings) to the
+    timers of this process.
+
+    :param stages: dictionary of stages (calls, count and seconds)
+    :return: returns None
+    """
+
+    for stage, entry in stages.items():
+        total = timings.setdefault(stage, {"calls": 0, "count": 0, "seconds": 0.0})
+        for key in ("calls", "count", "seconds"):
+            total[key] += entry[key]
+
+
+def write_timings(output_file, **information):
+    """
+    Writes a JSON summary of the stage timers of this run (seconds and
+    items per second per stage).
+
+    :param output_file: output JSON file
+    :param information: extra fields of the summary (e.g. input, jobs)
+    :return: returns the summary (dict)
+    """
+
+    stages = get_timings()
+    for entry in stages.values():
+        entry["seconds"] = round(entry["seconds"], 6)
+        entry["per_second"] = (round(entry["count"] / entry["seconds"], 1)
+                               if entry["count"] and entry["seconds"] > 0 else None)
+
+    summary = dict(information)
+    summary["date"] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    summary["host"] = socket.gethostname()
+    summary["pid"] = os.getpid()
+    summary["stages"] = stages
+    with atomic_write(output_file) as out:
+        json.dump(summary, out, indent=4, sort_keys=True)
+    return summary
+
+
 def write_features(output_file, header, three, two, one, phospho):
     """
     Writes out a features file for us with JalviewLite.
@@ -163,45 +302,44 @@ def write_features(output_file, header, three, two, one, phospho):
     # create temporary files
     global TMP_PATH
 
-    out = open(os.path.join(TMP_PATH, output_file), "w")
-    out.write("""HIGH_CONFIDENCE\tCEEECE
+    with atomic_write(os.path.join(TMP_PATH, output_file)) as out:
+        out.write("""HIGH_CONFIDENCE\tCEEECE
 MEDIUM_CONFIDENCE\tC4EAF6
 LOW_CONFIDENCE\tFEF6DB
 PHOSPHORYLATED\tBB0909
 
 """)
 
-    # three
-    out.write("STARTGROUP\tPREDICTOR\n")
-    for entry in three:
-        out.write("PREDICTOR\t%s\t-1\t%s\t%s\tHIGH_CONFIDENCE\n" % (header, entry, entry))
-    out.write("ENDGROUP\tPREDICTOR\n\n")
-
-    # two
-    out.write("STARTGROUP\tPREDICTOR\n")
-    for entry in two:
-        out.write("PREDICTOR\t%s\t-1\t%s\t%s\tMEDIUM_CONFIDENCE\n" % (header, entry, entry))
-    out.write("ENDGROUP\tPREDICTOR\n\n")
-
-    # one
-    out.write("STARTGROUP\tPREDICTOR\n")
-    for entry in one:
-        out.write("PREDICTOR\t%s\t-1\t%s\t%s\tLOW_CONFIDENCE\n" % (header, entry, entry))
-    out.write("ENDGROUP\tPREDICTOR\n\n")
-
-    # phospho
-    out.write("STARTGROUP\tPHOSPHORYLATION\n")
-    for entry in phospho:
-        out.write("PHOSPHORYLATION\t%s\t-1\t%s\t%s\tPHOSPHORYLATED\n" % (header, entry, entry))
-    out.write("ENDGROUP\tPHOSPHORYLATION\n\n")
-
-    out.close()
+        # three
+        out.write("STARTGROUP\tPREDICTOR\n")
+        for entry in three:
+            out.write("PREDICTOR\t%s\t-1\t%s\t%s\tHIGH_CONFIDENCE\n" % (header, entry, entry))
+        out.write("ENDGROUP\tPREDICTOR\n\n")
+
+        # two
+        out.write("STARTGROUP\tPREDICTOR\n")
+        for entry in two:
+            out.write("PREDICTOR\t%s\t-1\t%s\t%s\tMEDIUM_CONFIDENCE\n" % (header, entry, entry))
+        out.write("ENDGROUP\tPREDICTOR\n\n")
+
+        # one
+        out.write("STARTGROUP\tPREDICTOR\n")
+        for entry in one:
+            out.write("PREDICTOR\t%s\t-1\t%s\t%s\tLOW_CONFIDENCE\n" % (header, entry, entry))
+        out.write("ENDGROUP\tPREDICTOR\n\n")
+
+        # phospho
+        out.write("STARTGROUP\tPHOSPHORYLATION\n")
+        for entry in phospho:
+            out.write("PHOSPHORYLATION\t%s\t-1\t%s\t%s\tPHOSPHORYLATED\n" % (header, entry, entry))
+        out.write("ENDGROUP\tPHOSPHORYLATION\n\n")
     return
 
 
 def get_phosphosites(identifier):
     """
-    Gets phosphorylated Sites from UniProt.
+    Gets phosphorylated Sites from UniProt (local cache, see
+    prefetch_uniprot) and PhosphoSitePlus.
 
     :param identifier: UniProt ID
     :return: returns a list of positions
@@ -211,45 +349,10 @@ def get_phosphosites(identifier):
 
     try:
         # pSer/The from UniProt
-        url = 'http://www.uniprot.org/uniprot/%s.txt' % identifier.upper()
-        try:
-            read = requests.get(url)
-        except:
-            time.sleep(1)
-            read = requests.get(url)
-
-        if read.status_code == 200:
-            for line in read.iter_lines():
-                # example lines
-                """
-                FT   MOD_RES      41     41       Phosphoserine.
-                FT   MOD_RES     104    104       Phosphoserine.
-                FT   MOD_RES     148    148       Phosphoserine.
-                FT   MOD_RES     167    167       Phosphoserine.
-                FT   MOD_RES     181    181       Phosphoserine.
-                FT   MOD_RES     187    187       Phosphothreonine.
-                FT   MOD_RES     195    195       Phosphoserine.
-                FT   MOD_RES     258    258       Phosphoserine.
-                FT   MOD_RES     267    267       Phosphoserine.
-                FT   MOD_RES     291    291       Phosphoserine.
-                """
-                if "FT   MOD_RES" in line:
-                    line = line.rstrip("\r\n")
-                    if "Phosphoserine" in line or "Phosphothreonine" in line:
-                        line = line.split()
-                        phospho = line[2]
-                        phospho_sites.append(phospho)
+        phospho_sites.extend(get_uniprot_entry(identifier)[1])
 
         # pSer/The from PhosphoSitePlus
-        read = open("PhosphoSite.txt")
-        lines = read.readlines()
-        for line in lines:
-            line = line.rstrip("\r\n")
-
-            uni = line.split("\t")[0]
-            site = line.split("\t")[1]
-            if uni == identifier:
-                phospho_sites.append(site)
+        phospho_sites.extend(get_phosphosite_sites([identifier])[identifier])
 
     except:
         pass
@@ -257,6 +360,324 @@ def get_phosphosites(identifier):
     return phospho_sites
 
 
+def parse_uniprot_phosphosites(text):
+    """
+    Parses the pSer/Thr MOD_RES features of a UniProt text entry.
+
+    :param text: UniProt entry (txt format)
+    :return: returns a list of positions (str)
+    """
+
+    # example lines
+    """
+    FT   MOD_RES      41     41       Phosphoserine.
+    FT   MOD_RES     187    187       Phosphothreonine.
+    or (current format, with the description as a qualifier)
+    FT   MOD_RES         41
+    FT                   /note="Phosphoserine"
+    """
+    phospho_sites = list()
+    position = None
+    for line in text.splitlines():
+        if not line.startswith("FT   "):
+            continue
+        if line.startswith("FT   MOD_RES"):
+            position = line.split()[2]
+        elif line[5:6] != " ":
+            # any other feature
+            position = None
+        if position is not None and ("Phosphoserine" in line or "Phosphothreonine" in line):
+            phospho_sites.append(position)
+            position = None
+
+    return phospho_sites
+
+
+def get_uniprot_session(jobs=None):
+    """
+    Gets the HTTP session used to query UniProt (pooled connections
+    and retries). One session is kept per process and number of pooled
+    connections.
+
+    :param jobs: number of pooled connections (None for the current
+        session, or 8 if there is none)
+    :return: returns a requests.Session
+    """
+
+    import requests
+
+    global uniprot_session
+
+    if uniprot_session is not None and uniprot_session[0] == os.getpid() and \
+            jobs in (None, uniprot_session[1]):
+        return uniprot_session[2]
+
+    if uniprot_session is not None and uniprot_session[0] == os.getpid():
+        uniprot_session[2].close()
+    if jobs is None:
+        jobs = 8
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs,
+                                            max_retries=3)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    uniprot_session = (os.getpid(), jobs, session)
+
+    return session
+
+
+def fetch_uniprot_entry(identifier):
+    """
+    Downloads the FASTA and the phospho MOD_RES features of a UniProt entry.
+
+    :param identifier: UniProt ID
+    :return: returns a tuple of (UniProt ID, FASTA, list of positions, HTTP
+        status); the status is 200 or 404 (an entry that does not exist), or
+        None if the download failed (network error or any other status, e.g.
+        429 or 5xx) and nothing should be cached
+    """
+
+    import requests
+
+    global UNIPROT_URL
+
+    session = get_uniprot_session()
+    try:
+        url = '%s/%s.fasta' % (UNIPROT_URL, identifier.upper())
+        read = session.get(url, timeout=60)
+        if read.status_code == 404:
+            return identifier, "", [], 404
+        if read.status_code != 200:
+            return identifier, None, None, None
+        full_sequence = read.text
+
+        url = '%s/%s.txt' % (UNIPROT_URL, identifier.upper())
+        read = session.get(url, timeout=60)
+        if read.status_code == 404:
+            return identifier, full_sequence, [], 404
+        if read.status_code != 200:
+            return identifier, None, None, None
+        return identifier, full_sequence, parse_uniprot_phosphosites(read.text), 200
+
+    except requests.RequestException:
+        return identifier, None, None, None
+
+
+def uniprot_cache_connection():
+    """
+    Gets the connection to the local UniProt cache (one per process).
+
+    :return: returns a sqlite3 connection
+    """
+
+    global UNIPROT_DB
+    global uniprot_cache
+
+    if uniprot_cache is None or uniprot_cache[0] != os.getpid():
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(UNIPROT_DB)))
+        except OSError:
+            pass
+        con = sqlite3.connect(UNIPROT_DB, timeout=60)
+        con.execute("""PRAGMA journal_mode=WAL""")
+        con.execute("""CREATE TABLE IF NOT EXISTS entries(Accession TEXT NOT NULL PRIMARY KEY,
+                                                          Fasta TEXT,
+                                                          Phospho TEXT,
+                                                          Status INTEGER,
+                                                          Updated REAL) WITHOUT ROWID""")
+        uniprot_cache = (os.getpid(), con)
+
+    return uniprot_cache[1]
+
+
+def load_uniprot_entries(identifiers, chunk=500):
+    """
+    Loads UniProt entries from the local cache.
+
+    :param identifiers: UniProt IDs
+    :param chunk: number of IDs per query
+    :return: returns a dictionary of (FASTA, list of positions, updated time)
+        by UniProt ID
+    """
+
+    entries = dict()
+    con = uniprot_cache_connection()
+    identifiers = list(set(identifiers))
+    for i in range(0, len(identifiers), chunk):
+        batch = identifiers[i:i + chunk]
+        cur = con.execute("""SELECT Accession, Fasta, Phospho, Updated FROM entries
+                             WHERE Accession IN (%s)""" % ", ".join("?" * len(batch)), batch)
+        for uni, fasta, phospho, updated in cur:
+            entries[uni] = (fasta, json.loads(phospho), updated)
+
+    return entries
+
+
+def prefetch_uniprot(identifiers, jobs=8):
+    """
+    Fills the local UniProt cache for a whole input set: only missing
+    or expired (see UNIPROT_TTL) entries are downloaded, concurrently
+    through a pooled session. Entries that do not exist (404) are cached as
+    empty so that they are not queried again until they expire; failed
+    downloads (network errors, 429, 5xx...) are not cached, but they are
+    not tried again for the rest of the run (see uniprot_failed).
+
+    :param identifiers: UniProt IDs
+    :param jobs: number of concurrent downloads
+    :return: returns the number of entries downloaded
+    """
+
+    from multiprocessing.pool import ThreadPool
+
+    global UNIPROT_TTL
+    global uniprot_failed
+
+    identifiers = set(identifier for identifier in identifiers
+                      if identifier and identifier not in uniprot_failed)
+    cached = load_uniprot_entries(identifiers)
+    expired = time.time() - UNIPROT_TTL
+    missing = sorted(identifier for identifier in identifiers
+                     if identifier not in cached or cached[identifier][2] < expired)
+    if not missing:
+        return 0
+
+    get_uniprot_session(jobs)
+    pool = ThreadPool(min(jobs, len(missing)))
+    try:
+        results = pool.map(fetch_uniprot_entry, missing)
+    finally:
+        pool.close()
+        pool.join()
+
+    # failed downloads keep any previous entry
+    uniprot_failed.update(uni for uni, _, _, status in results if status is None)
+    updated = time.time()
+    con = uniprot_cache_connection()
+    with con:
+        con.executemany("""INSERT OR REPLACE INTO entries VALUES(?, ?, ?, ?, ?)""",
+                        ((uni, fasta, json.dumps(phospho), status, updated)
+                         for uni, fasta, phospho, status in results if status is not None))
+
+    return len(results)
+
+
+def get_uniprot_entry(identifier):
+    """
+    Gets a UniProt entry from the local cache, downloading it if it
+    was not pre-fetched (see prefetch_uniprot).
+
+    :param identifier: UniProt ID
+    :return: returns a tuple of (FASTA, list of positions)
+    """
+
+    prefetch_uniprot([identifier])
+    entry = load_uniprot_entries([identifier]).get(identifier)
+    if entry is None:
+        return "", []
+    return entry[0], entry[1]
+
+
+def iter_phosphosite_txt(input_file=PHOSPHOSITE_TXT):
+    """
+    Streams the (UniProt ID, position) pairs from PhosphoSite.txt.
+    Sites are positions, with the "-p" suffix of the current MOD_RSD
+    format (e.g. 123-p) or without it (older datasets).
+
+    :param input_file: path to PhosphoSite.txt (see run)
+    :return: yields tuples of (str, int)
+    """
+
+    with open(input_file) as read:
+        for line in read:
+            line = line.rstrip("\r\n").split("\t")
+            if len(line) > 1:
+                position = line[1].split("-")[0]
+                if position.isdigit():
+                    yield line[0], int(position)
+
+
+def build_phosphosite_index(sites, output_file=PHOSPHOSITE_DB):
+    """
+    Builds the indexed PhosphoSitePlus table: (Accession, Site) is the
+    primary key of a WITHOUT ROWID table, so all the sites of an
+    accession are found with a single B-tree range lookup.
+    The database is written aside and renamed into place.
+
+    :param sites: iterable of (UniProt ID, position) pairs
+    :param output_file: path to the SQLite database
+    :return: returns the path to the database
+    """
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)))
+    except OSError:
+        pass
+
+    tmp_file = "%s.%s.tmp" % (output_file, os.getpid())
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    con = sqlite3.connect(tmp_file)
+    try:
+        with con:
+            con.execute("""CREATE TABLE phosphosites(Accession TEXT NOT NULL,
+                                                     Site INTEGER NOT NULL,
+                                                     PRIMARY KEY (Accession, Site)) WITHOUT ROWID""")
+            con.executemany("""INSERT OR IGNORE INTO phosphosites VALUES(?, ?)""", sites)
+    finally:
+        con.close()
+    os.rename(tmp_file, output_file)
+
+    return output_file
+
+
+def phosphosite_index():
+    """
+    Gets the connection to the indexed PhosphoSitePlus table, (re)building
+    it from PhosphoSite.txt once if missing or older than the text file.
+    One connection is kept per process.
+
+    :return: returns a sqlite3 connection
+    """
+
+    global PHOSPHOSITE_TXT
+    global PHOSPHOSITE_DB
+    global phosphosite_cache
+
+    if phosphosite_cache is None or phosphosite_cache[0] != os.getpid():
+        if (not os.path.isfile(PHOSPHOSITE_DB) or
+                os.path.getmtime(PHOSPHOSITE_DB) < os.path.getmtime(PHOSPHOSITE_TXT)):
+            build_phosphosite_index(iter_phosphosite_txt(PHOSPHOSITE_TXT), PHOSPHOSITE_DB)
+        con = sqlite3.connect(PHOSPHOSITE_DB, timeout=60)
+        phosphosite_cache = (os.getpid(), con)
+
+    return phosphosite_cache[1]
+
+
+def get_phosphosite_sites(identifiers, chunk=500):
+    """
+    Gets the pSer/Thr positions from PhosphoSitePlus for a batch of
+    UniProt IDs (indexed lookups, see phosphosite_index).
+
+    :param identifiers: UniProt IDs
+    :param chunk: number of IDs per query
+    :return: returns a dictionary of lists of positions (str) by UniProt ID
+    """
+
+    identifiers = list(identifiers)
+    phospho_sites = dict((identifier, []) for identifier in identifiers)
+
+    con = phosphosite_index()
+    unique = list(phospho_sites)
+    for i in range(0, len(unique), chunk):
+        batch = unique[i:i + chunk]
+        cur = con.execute("""SELECT Accession, Site FROM phosphosites WHERE Accession IN (%s)"""
+                          % ", ".join("?" * len(batch)), batch)
+        for uni, site in cur:
+            phospho_sites[uni].append(str(site))
+
+    return phospho_sites
+
+
 def get_table_results(job_id):
     """
     Parses the results to get formated results for the website.
@@ -427,25 +848,21 @@ def load_sqlite(identifier, method="ANN", unique=True):
 
     try:
         con = sqlite3.connect(os.path.join(DB_PATH, local_db),
-                              detect_types=sqlite3.PARSE_DECLTYPES or sqlite3.PARSE_COLNAMES)
+                              detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
         with con:
             con.row_factory = sqlite3.Row
             cur = con.cursor()
             # get results from the analysis
-            # try to get that entry from the DB
-            cur.execute("""SELECT * FROM snapshot""")
-            try:
-                while True:
-                    row = cur.fetchone()
-                    if row["Peptide"] == identifier:
-                        data = row["Score"]
-                        if unique:
-                            break
-                        else:
-                            data.append(row["Score"])
-            except:
+            # try to get that entry from the DB (primary key lookup)
+            cur.execute("""SELECT Score FROM snapshot WHERE Peptide=?""", (json.dumps(identifier),))
+            rows = cur.fetchall()
+            if not rows:
                 raise ValueError("No value in the db.")
                 # print("Warning: No value for %s in SQLite..." % identifier)
+            if unique:
+                data = rows[0]["Score"]
+            else:
+                data = [row["Score"] for row in rows]
 
     except sqlite3.Error as e:
         # print("Warning: Database %s not available... %s" % (method, e.args[0]))
@@ -481,7 +898,7 @@ def store_sqlite(identifier, method="ANN", information=None, save=True):
 
     try:
         con = sqlite3.connect(os.path.join(DB_PATH, local_db),
-                              detect_types=sqlite3.PARSE_DECLTYPES or sqlite3.PARSE_COLNAMES)
+                              detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
         with con:
             # flash("Connected to .NOBACK/DB/%s.db SQLite3 Database..." % method)
             con.row_factory = sqlite3.Row
@@ -493,37 +910,14 @@ def store_sqlite(identifier, method="ANN", information=None, save=True):
                     # write down json file
                     json_string = json.dumps(information, sort_keys=False, indent=4)
 
-                    # try to get that entry from the DB
+                    # insert or update that entry (primary key)
                     json_id = json.dumps(identifier)
-                    try:
-                        cur.execute("""SELECT * FROM snapshot""")
-                        while True:
-                            row = cur.fetchone()
-                            if row["Peptide"] == identifier:
-                                # update previous entry
-                                cur.execute("""UPDATE snapshot SET Score=? WHERE Peptide=?""",
-                                            (json_string, json_id))
-                                con.commit()
-                                # outlog1.write("%s\t%s\n" % (time(), identifier))
-                                # flash("Updated JSON object in .NOBACK/DB/%s.db (SQLite3) for ID %s..." % (method, identifier))
-                                break
-                    except:
-                        try:
-                            cur.execute("""CREATE TABLE snapshot(Peptide json PRIMARY KEY, Score json)""")
-                            con.commit()
-                        except:
-                            # print("Warning: Table 'snapshot' already exists...")
-                            pass
-                        try:
-                            cur.execute("""INSERT INTO snapshot VALUES(?, ?)""",
-                                        (json_id, json_string))
-                            con.commit()
-                            # outlog1.write("%s\t%s\n" % (time(), identifier))
-                            # flash("Stored JSON object in .NOBACK/DB/%s.db (SQLite3) for ID %s..." % (method, identifier))
-                        except sqlite3.Error as e:
-                            # print("%s\tError: %s\n" % (identifier, e.args[0]))
-                            # outlog2.write("%s\t%s\tError: %s\n" % (time(), identifier, e.args[0]))
-                            pass
+                    cur.execute("""CREATE TABLE IF NOT EXISTS snapshot(Peptide json PRIMARY KEY, Score json)""")
+                    cur.execute("""INSERT OR REPLACE INTO snapshot VALUES(?, ?)""",
+                                (json_id, json_string))
+                    con.commit()
+                    # outlog1.write("%s\t%s\n" % (time(), identifier))
+                    # flash("Stored JSON object in .NOBACK/DB/%s.db (SQLite3) for ID %s..." % (method, identifier))
                 else:
                     # flash("Skipping saving JSON object in .NOBACK/DB/%s.db (SQLite3) for ID %s..." % (method,
                     #                                                                                   identifier))
@@ -548,30 +942,118 @@ def store_sqlite(identifier, method="ANN", information=None, save=True):
     return
 
 
-def run():
+def score_cache_connection():
     """
-    Used to create a simple and memory friendly PhosphoSite.txt
-    used to parse the pSer/Thr.
+    Gets the connection to the peptide score cache (SQLite3, WAL mode).
+    A single connection is opened per process.
 
-    :return: updated PhosphoSite.txt
+    :return: returns a sqlite3 connection (or None if the cache is disabled)
     """
-    out = open("PhosphoSite.txt", "w")
 
-    read = open("Phosphorylation_site_dataset")
-    lines = read.readlines()
-    read.close()
-    for line in lines:
-        line = line.rstrip("\r\n")
+    global SCORES_DB
+    global score_cache
 
+    if not SCORES_DB:
+        return None
+
+    if score_cache is None or score_cache[0] != os.getpid() or score_cache[1] != SCORES_DB:
         try:
-            uni = line.split("\t")[1]
-            site = line.split("\t")[5]
-            if "S" in site or "T" in site:
-                site = (line.split("\t")[5]).lstrip("ST")
-                out.write("%s\t%s\n" % (uni, site))
-        except:
+            os.makedirs(os.path.dirname(os.path.abspath(SCORES_DB)))
+        except OSError:
             pass
-    out.close()
+        con = sqlite3.connect(SCORES_DB, timeout=60)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("""CREATE TABLE IF NOT EXISTS scores(
+                       Method TEXT NOT NULL, Model TEXT NOT NULL, Peptide TEXT NOT NULL, Score REAL,
+                       PRIMARY KEY (Method, Model, Peptide)) WITHOUT ROWID""")
+        con.commit()
+        score_cache = (os.getpid(), SCORES_DB, con)
+
+    return score_cache[2]
+
+
+def load_scores(method, model, peptides, chunk=500):
+    """
+    Bulk loads the cached scores of a batch of peptides (primary key lookups).
+
+    :param method: scoring method (e.g. ANN, PSSM or SVM)
+    :param model: model key (hash of the trained model/training data)
+    :param peptides: peptides to look up
+    :param chunk: number of peptides per query
+    :return: returns a dictionary of peptide: score for the cached peptides
+    """
+
+    con = score_cache_connection()
+    scores = dict()
+    if con is None:
+        return scores
+
+    unique = list(set(peptides))
+    for i in range(0, len(unique), chunk):
+        batch = unique[i:i + chunk]
+        cur = con.execute("""SELECT Peptide, Score FROM scores
+                             WHERE Method=? AND Model=? AND Peptide IN (%s)""" % ",".join("?" * len(batch)),
+                          [method, model] + batch)
+        scores.update(cur.fetchall())
+
+    return scores
+
+
+def store_scores(method, model, scores):
+    """
+    Stores (upserts) a batch of peptide scores in the score cache.
+
+    :param method: scoring method (e.g. ANN, PSSM or SVM)
+    :param model: model key (hash of the trained model/training data)
+    :param scores: dictionary of peptide: score
+    :return: None
+    """
+
+    con = score_cache_connection()
+    if con is None or not scores:
+        return
+
+    with con:
+        con.executemany("""INSERT OR REPLACE INTO scores VALUES(?, ?, ?, ?)""",
+                        ((method, model, peptide, score) for peptide, score in scores.items()))
+    return
+
+
+def run():
+    """
+    Used to create a simple and memory friendly PhosphoSite.txt
+    used to parse the pSer/Thr, and its indexed form (PhosphoSite.db).
+
+    :return: updated PhosphoSite.txt and PhosphoSite.db
+    """
+
+    def sites(read, out):
+        # streamed: the raw dataset is never held in memory
+        for line in read:
+            line = line.rstrip("\r\n")
+
+            try:
+                uni = line.split("\t")[1]
+                site = line.split("\t")[5]
+                if "S" in site or "T" in site:
+                    site = site.lstrip("ST")
+                    out.write("%s\t%s\n" % (uni, site))
+                    position = site.split("-")[0]
+                    if position.isdigit():
+                        yield uni, int(position)
+            except:
+                pass
+
+    out = open(PHOSPHOSITE_TXT, "w")
+    read = open("Phosphorylation_site_dataset")
+    try:
+        build_phosphosite_index(sites(read, out), PHOSPHOSITE_DB)
+    finally:
+        read.close()
+        out.close()
+    # the index is up to date with the text file just written
+    os.utime(PHOSPHOSITE_DB, None)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,725 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
 import os
 import sys
 import json
+from contextlib import contextmanager
 
 DEV = "www1433"
 sys.path.append("/homes/www-1433/%s/app/test/lib/python2.6/site-packages/" % DEV)
 sys.path.append("/homes/www-1433/%s/app/test/lib/python2.6/site-packages/old/" % DEV)
 
 
-def get_prediction_results(arg_input, arg_output, multiple=False):
+def get_windows(sequence, before=6, after=4):
+    """
+    Gets the [-6:4] window of every Ser/Thr residue in a sequence at once.
+    The sequence is gap padded once and the windows are sliced from a
+    strided view of the padded buffer.
+
+    @param sequence: protein sequence
+    @param before: residues before the site
+    @param after: residues after the site
+    @return: returns the site positions (1-based) and a (sites x window) uint8
+        array of the windows (site included)
+    """
+
+    import numpy as np
+    from numpy.lib.stride_tricks import as_strided
+
+    buffer = np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)
+    sites = np.flatnonzero((buffer == ord("S")) | (buffer == ord("T")))
+
+    padded = np.frombuffer(("-" * before + sequence + "-" * after).encode("ascii"), dtype=np.uint8)
+    width = before + 1 + after
+    windows = as_strided(padded, shape=(len(buffer), width), strides=(padded.strides[0], padded.strides[0]))
+    return sites + 1, windows[sites]
+
+
+def get_sites(sequence, before=6, after=4):
+    """
+    Gets the [-6:4] peptide of every Ser/Thr residue in a sequence
+    (gap padded at the termini).
+
+    @param sequence: protein sequence
+    @param before: residues before the site
+    @param after: residues after the site
+    @return: returns a list of [position, peptide with the site in brackets,
+        peptide with the site in lowercase, peptide without the site] for each site
+    """
+
+    import numpy as np
+
+    positions, windows = get_windows(sequence, before=before, after=after)
+    nsites = len(positions)
+    if nsites == 0:
+        return []
+
+    def rows(array):
+        joined = array.tobytes().decode("ascii")
+        width = array.shape[1]
+        return [joined[i * width:(i + 1) * width] for i in range(nsites)]
+
+    bef, site, aft = windows[:, :before], windows[:, before:before + 1], windows[:, before + 1:]
+    brackets = np.full((nsites, 1), ord("["), dtype=np.uint8), np.full((nsites, 1), ord("]"), dtype=np.uint8)
+
+    peptides = rows(np.hstack([bef, brackets[0], site, brackets[1], aft]))
+    peptides2 = rows(np.hstack([bef, site + (ord("a") - ord("A")), aft]))
+    peptides3 = rows(np.hstack([bef, aft]))
+
+    return [[position, peptide, peptide2, peptide3] for position, peptide, peptide2, peptide3
+            in zip(positions.tolist(), peptides, peptides2, peptides3)]
+
+
+def get_identifier(record):
+    """
+    Gets the identifier of a FASTA record (the accession for UniProt headers).
+
+    @param record: Biopython SeqRecord
+    @return: returns an identifier (str)
+    """
+
+    identifier = str(record.id)
+    # e.g. sp|P16188|1A30_HUMAN
+    try:
+        identifier = identifier.split("|")[1]
+    except:
+        pass
+    return identifier
+
+
+def iter_batches(records, batch_size=20000, on_error=None):
+    """
+    Groups consecutive FASTA records so that the Ser/Thr sites of many
+    sequences are scored with a single call per method.
+
+    @param records: iterable of Biopython SeqRecords (e.g. SeqIO.parse)
+        or of (identifier, sequence) tuples
+    @param batch_size: number of sites after which a batch is closed
+    @param on_error: function called as on_error(count, identifier, error)
+        for the records that cannot be read, which are then skipped (errors
+        are raised if None)
+    @return: yields lists of (count, identifier, sequence, sites) tuples
+    """
+
+    batch = []
+    nsites = 0
+    count = 0
+    for record in records:
+        count += 1
+        if isinstance(record, tuple):
+            identifier, sequence = record
+            sequence = str(sequence)
+        else:
+            sequence = str(record.seq)
+            identifier = get_identifier(record)
+
+        try:
+            # test length of sequence
+            if len(sequence) < 30:
+                raise ValueError("Inputed sequence with ID %s was too short (<30 amino acids)." % identifier)
+
+            sites = get_sites(sequence)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(count, identifier, e)
+            continue
+        batch.append((count, identifier, sequence, sites))
+        nsites += len(sites)
+        if nsites >= batch_size:
+            yield batch
+            batch = []
+            nsites = 0
+
+    if batch:
+        yield batch
+
+
+# scoring methods (the consensus needs the other three)
+all_methods = ["ann", "pssm", "svm", "consensus"]
+
+
+def get_methods(methods=None):
+    """
+    Validates a selection of methods.
+
+    @param methods: any subset of all_methods (all if None)
+    @return: returns the selected methods (list), including the ANN, PSSM
+        and SVM if the consensus is selected
+    """
+
+    if methods is None:
+        return list(all_methods)
+
+    methods = [method.strip().lower() for method in methods]
+    for method in methods:
+        if method not in all_methods:
+            raise ValueError("Unknown method '%s' (choose from %s)." % (method, ", ".join(all_methods)))
+    if "consensus" in methods:
+        methods = list(all_methods)
+    return [method for method in all_methods if method in methods]
+
+
+def score_peptides(peptides, methods=None):
+    """
+    Scores peptides with the ANN, PSSM and SVM methods. The peptides are
+    encoded once and shared by the selected methods; each method (and its
+    model) is only loaded if selected.
+
+    @param peptides: input peptides (without the Ser/Thr site)
+    @param methods: selected methods (see get_methods)
+    @return: returns the ANN, PSSM and SVM scores (None for the methods
+        not selected)
+    """
+
+    from methods import timer
+    from predictor import encode_peptides
+
+    methods = get_methods(methods)
+    with timer("encoding", len(peptides)):
+        encoded = encode_peptides(peptides)
+    ann_scores = pssm_scores = svm_scores = [None] * len(peptides)
+    if "ann" in methods:
+        from predictor import ann_prediction
+        ann_scores = ann_prediction(peptides, encoded=encoded)
+    if "pssm" in methods:
+        from predictor import pssm_prediction
+        pssm_scores = pssm_prediction(peptides, encoded=encoded)
+    if "svm" in methods:
+        from predictor import svm_prediction
+        svm_scores = svm_prediction(peptides, encoded=encoded)
+    return ann_scores, pssm_scores, svm_scores
+
+
+def get_candidate(ann, pssm, svm):
+    """
+    Gets the conditional label of a site from the scores (rounded to 3
+    decimal places) of the three methods. Methods that were not selected
+    (None) count as below their cut-off.
+
+    @param ann: ANN score
+    @param pssm: PSSM score
+    @param svm: SVM score
+    @return: returns 'Three', 'Two', 'One' or 'False' (number of methods
+        above their cut-off)
+    """
+
+    ann = round(float(ann), 3) if ann is not None else float("-inf")
+    pssm = round(float(pssm), 3) if pssm is not None else float("-inf")
+    svm = round(float(svm), 3) if svm is not None else float("-inf")
+    if ann > 0.55 and pssm > 0.80 and svm > 0.25:
+        return "Three"
+    elif (ann > 0.55 and pssm > 0.80) or (ann > 0.55 and svm > 0.25) or (svm > 0.25 and pssm > 0.80):
+        return "Two"
+    elif ann > 0.55 or pssm > 0.80 or svm > 0.25:
+        return "One"
+    else:
+        return "False"
+
+
+def predict_batch(batch, phosphosites=True, methods=None):
+    """
+    Scores a batch of records (see iter_batches) at once.
+
+    @param batch: list of (count, identifier, sequence, sites) tuples
+    @param phosphosites: annotate known pSer/Thr (UniProt and PhosphoSitePlus)
+    @param methods: selected methods (see get_methods)
+    @return: returns a list of results (dict), one per record
+    """
+
+    # score the peptides of the whole batch at once
+    peptides = [entry[3] for record in batch for entry in record[3]]
+    scores = iter(list(zip(*score_peptides(peptides, methods))))
+
+    known_sites = dict()
+    if phosphosites:
+        from methods import prefetch_uniprot, get_phosphosites, timer
+        with timer("phosphosites", len(batch)):
+            prefetch_uniprot([record[1] for record in batch])
+            for record in batch:
+                known_sites[record[1]] = get_phosphosites(record[1])
+
+    results = []
+    for count, identifier, sequence, sites in batch:
+        phospho_sites = known_sites.get(identifier, [])
+
+        information = []
+        for entry, (ann, pssm, svm) in zip(sites, scores):
+            dictionary = {}
+            dictionary["Site"] = entry[0]
+            dictionary["Peptide"] = entry[2]
+            dictionary["Window"] = entry[1]
+            dictionary["ANN"] = float(ann) if ann is not None else None
+            dictionary["PSSM"] = float(pssm) if pssm is not None else None
+            dictionary["SVM"] = float(svm) if svm is not None else None
+            if None in (ann, pssm, svm):
+                dictionary["Consensus"] = None
+            else:
+                dictionary["Consensus"] = (float(ann) + float(pssm) + float(svm)) * 1.0 / 3
+            dictionary["Candidate"] = get_candidate(ann, pssm, svm)
+            dictionary["pSer/Thr"] = "Yes" if str(entry[0]) in phospho_sites else "-"
+            information.append(dictionary)
+
+        results.append({"Count": count, "Identifier": identifier,
+                        "Sequence": sequence, "Sites": information})
+
+    return results
+
+
+def predict_batch_timed(batch, phosphosites=True, methods=None):
+    """
+    Scores a batch of records (see predict_batch) in a worker process and
+    hands its stage timers back to the parent (see methods.merge_timings).
+
+    @param batch: list of (count, identifier, sequence, sites) tuples
+    @param phosphosites: annotate known pSer/Thr (UniProt and PhosphoSitePlus)
+    @param methods: selected methods (see get_methods)
+    @return: returns the results (list) and the stage timers of the batch
+    """
+
+    from methods import get_timings
+
+    get_timings(reset=True)
+    results = predict_batch(batch, phosphosites=phosphosites, methods=methods)
+    return results, get_timings(reset=True)
+
+
+def predict_records(batch, phosphosites=True, methods=None, on_error=None):
+    """
+    Scores a batch of records (see predict_batch). If the batch fails and
+    on_error is given, its records are scored one by one and the records
+    that still fail are handed to on_error and skipped.
+
+    @param batch: list of (count, identifier, sequence, sites) tuples
+    @param phosphosites: annotate known pSer/Thr (UniProt and PhosphoSitePlus)
+    @param methods: selected methods (see get_methods)
+    @param on_error: function called as on_error(count, identifier, error)
+        (errors are raised if None)
+    @return: returns a list of results (dict), one per record scored
+    """
+
+    try:
+        return predict_batch(batch, phosphosites=phosphosites, methods=methods)
+    except Exception:
+        if on_error is None:
+            raise
+
+    results = []
+    for record in batch:
+        try:
+            results.extend(predict_batch([record], phosphosites=phosphosites, methods=methods))
+        except Exception as e:
+            on_error(record[0], record[1], e)
+    return results
+
+
+def iter_predictions(records, batch_size=20000, phosphosites=True, jobs=1, methods=None,
+                     on_error=None):
+    """
+    Scores every Ser/Thr residue of each inputed protein with the ANN, PSSM,
+    SVM and Consensus classifiers (see predict). Records are scored in
+    batches of sites and the results yielded in input order.
+
+    With jobs > 1 the batches are sharded across a process pool (models are
+    loaded once per worker). At most 2 * jobs batches are in flight and the
+    results are still yielded in input order, so the outputs match a
+    single process run.
+
+    @param records: iterable of Biopython SeqRecords or (identifier, sequence) tuples
+    @param batch_size: number of Ser/Thr sites scored at once
+    @param phosphosites: annotate known pSer/Thr (UniProt and PhosphoSitePlus)
+    @param jobs: number of worker processes
+    @param methods: selected methods (see get_methods)
+    @param on_error: function called as on_error(count, identifier, error)
+        for each record that cannot be scored; the other records are still
+        yielded (the first error is raised if None)
+    @return: yields a result (dict) per record
+    """
+
+    methods = get_methods(methods)
+    batches = iter_batches(records, batch_size=batch_size, on_error=on_error)
+
+    if jobs <= 1:
+        for batch in batches:
+            for result in predict_records(batch, phosphosites=phosphosites, methods=methods,
+                                          on_error=on_error):
+                yield result
+        return
+
+    from collections import deque
+    from multiprocessing import Pool
+    from methods import merge_timings
+    from predictor import load_models
+
+    # train/cache the models once before the workers load them
+    load_models(methods)
+    pool = Pool(jobs, initializer=load_models, initargs=(methods, ))
+    def collect(batch, pending_result):
+        try:
+            results, stages = pending_result.get()
+        except Exception:
+            if on_error is None:
+                raise
+            # scored again in this process, record by record
+            return predict_records(batch, phosphosites=phosphosites, methods=methods,
+                                   on_error=on_error)
+        merge_timings(stages)
+        return results
+
+    try:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, pool.apply_async(predict_batch_timed, (batch, phosphosites, methods))))
+            if len(pending) >= 2 * jobs:
+                for result in collect(*pending.popleft()):
+                    yield result
+        while pending:
+            for result in collect(*pending.popleft()):
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def predict(records, batch_size=20000, phosphosites=True, jobs=1, methods=None):
+    """
+    Predicts 14-3-3-binding sites in-process (models are loaded once per
+    process). Usage from Python 3:
+
+        sys.path.insert(0, "lib/1433pred")
+        from prediction import predict
+        results = predict(SeqIO.parse("input.fasta", "fasta"))
+
+    This is not streaming: every result is held in memory until they are
+    all returned. Large inputs should be iterated with iter_predictions
+    (same arguments), which yields the results batch by batch with a
+    bounded memory use.
+
+    Each result has the 'Count' (1-based input order), 'Identifier',
+    'Sequence' and 'Sites' of a record. Each site has its 'Site' (1-based),
+    'Peptide' ([-6:4], Ser/Thr in lowercase), 'Window' ([-6:4], Ser/Thr in
+    brackets), 'ANN', 'PSSM', 'SVM' and 'Consensus' scores (float, or None
+    if the method was not selected), 'Candidate' (see get_candidate) and
+    'pSer/Thr' ('Yes' or '-').
+
+    @param records: iterable of Biopython SeqRecords or (identifier, sequence) tuples
+    @param batch_size: number of Ser/Thr sites scored at once
+    @param phosphosites: annotate known pSer/Thr (UniProt and PhosphoSitePlus)
+    @param jobs: number of worker processes (see iter_predictions)
+    @param methods: any subset of all_methods (all if None)
+    @return: returns a list of results (dict), one per record
+    """
+
+    return list(iter_predictions(records, batch_size=batch_size,
+                                 phosphosites=phosphosites, jobs=jobs, methods=methods))
+
+
+def round_score(score):
+    """
+    Rounds a score to 3 decimal places for the legacy formats.
+
+    @param score: score (None if the method was not selected)
+    @return: returns a float (or '-')
+    """
+
+    return round(score, 3) if score is not None else "-"
+
+
+def format_score(score):
+    """
+    Formats a (rounded) score with 3 decimal places for the legacy formats.
+
+    @param score: score (None or '-' if the method was not selected)
+    @return: returns a str
+    """
+
+    return '{0:.3f}'.format(float(score)) if score not in (None, "-") else "-"
+
+
+# legacy per-sequence output formats (see write_results)
+legacy_formats = ["csv", "tsv", "json", "full", "fa", "feat"]
+
+
+def get_formats(formats=None):
+    """
+    Validates a selection of legacy formats.
+
+    @param formats: any subset of legacy_formats, or ["none"] (all if None)
+    @return: returns the selected formats (list, empty for none)
+    """
+
+    if formats is None:
+        return list(legacy_formats)
+
+    formats = [extension.strip().lower() for extension in formats]
+    if formats == ["none"]:
+        return []
+    for extension in formats:
+        if extension not in legacy_formats:
+            raise ValueError("Unknown format '%s' (choose from %s, or none)." % (extension,
+                                                                                ", ".join(legacy_formats)))
+    return [extension for extension in legacy_formats if extension in formats]
+
+# columns (and types) of the consolidated dataset (see dataset_writer)
+dataset_columns = [("Sequence", "int"), ("Identifier", "str"), ("Site", "int"),
+                   ("Peptide", "str"), ("ANN", "float"), ("PSSM", "float"),
+                   ("SVM", "float"), ("Consensus", "float"), ("Candidate", "str"),
+                   ("pSer/Thr", "str")]
+
+
+def write_results(result, path, filename, formats=None):
+    """
+    Writes the results of a single sequence (csv, tsv, json, full, fa and
+    the Jalview features file in TMP_PATH).
+
+    @param result: result of a record (see predict)
+    @param path: output directory
+    @param filename: output files basename
+    @param formats: formats to write out (see legacy_formats; all if None)
+    @return: prints out the result files
+    """
+
+    from methods import atomic_write, timer
+
+    formats = get_formats(formats)
+
+    with timer("writing", len(result["Sites"])):
+        identifier = result["Identifier"]
+        sequence = result["Sequence"]
+
+        csv = ["Site,Peptide_[-6:4],ANN,PSSM,SVM,Consensus,pSer/Thr\r\n"]
+        tsv = ["Site\tPeptide_[-6:4]\tANN\tPSSM\tSVM\tconsensus,pSer/Thr\r\n"]
+        full = []
+
+        rows = []
+        feat_three = []
+        feat_two = []
+        feat_one = []
+        feat_phospho = []
+        information = []
+        for site in result["Sites"]:
+            consensus = round_score(site["Consensus"])
+            ann = round_score(site["ANN"])
+            pssm = round_score(site["PSSM"])
+            svm = round_score(site["SVM"])
+            position = site["Site"]
+            peptide = site["Window"]
+            peptide2 = site["Peptide"]
+            phospho = site["pSer/Thr"]
+            if phospho == "Yes":
+                feat_phospho.append(position)
+
+            # print out the scores
+            csv.append("%s,%s,%s,%s,%s,%s,%s\r\n" % (position, peptide2, ann, pssm, svm, consensus, phospho))
+            tsv.append("%s\t%s\t%s\t%s\t%s\t%s\t%s\r\n" % (position, peptide2, ann, pssm, svm, consensus, phospho))
+            dictionary = {}
+            dictionary["Site"] = position
+            dictionary["Peptide"] = peptide2
+            dictionary["ANN"] = format_score(ann)
+            dictionary["PSSM"] = format_score(pssm)
+            dictionary["SVM"] = format_score(svm)
+            dictionary["Consensus"] = format_score(consensus)
+            dictionary["pSer/Thr"] = phospho
+            information.append(dictionary)
+
+            # get conditional labels
+            candidate = site["Candidate"]
+            if candidate == "Three":
+                feat_three.append(position)
+            elif candidate == "Two":
+                feat_two.append(position)
+            elif candidate == "One":
+                feat_one.append(position)
+
+            # cosmetics in the table view
+            if consensus != "-":
+                consensus = '{0:.3f}'.format(float((float(ann) + float(pssm) + float(svm)) * 1.0 / 3))
+            ann = format_score(ann)
+            pssm = format_score(pssm)
+            svm = format_score(svm)
+
+            if "-" not in ann:
+                ann = "&nbsp;%s" % ann
+
+            if "-" not in pssm:
+                pssm = "&nbsp;%s" % pssm
+
+            if "-" not in svm:
+                svm = "&nbsp;%s" % svm
+
+            if "-" not in consensus:
+                consensus = "&nbsp;%s" % consensus
+
+            rows.append([position, peptide, ann, pssm, svm, consensus, candidate, phospho])
+            full.append("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\r\n" % (position, peptide, ann, pssm, svm, consensus, candidate, phospho))
+
+        outputs = {"csv": csv, "tsv": tsv, "full": full,
+                   "json": [json.dumps(information, sort_keys=False)]}
+        for extension in ("csv", "tsv", "json", "full"):
+            if extension in formats:
+                with atomic_write(os.path.join(path, "%s.%s" % (filename, extension))) as out:
+                    out.writelines(outputs[extension])
+
+        # jaliew-lite
+        # import shutil
+        # shutil.copyfile(os.path.join(PATH, "static", "jalviewApplet.jar")), os.path.join(TMP_PATH, "jalviewApplet.jar"))
+        # shutil.copyfile(os.path.join(PATH, "static", "JmolApplet.jar"), os.path.join(TMP_PATH, "JmolApplet.jar"))
+        # fasta for jalview
+        fasta = "%s.fa" % filename
+        if "fa" in formats:
+            with atomic_write(os.path.join(path, fasta)) as op:
+                op.write(">%s\n%s" % (identifier, sequence))
+
+        # features and SVG
+        feature = "%s.feat" % filename
+        link_svg = "%s.svg" % filename
+
+        # generate the features file for Jalview-
+        if "feat" in formats:
+            from methods import write_features
+            write_features(feature, identifier, feat_three, feat_two, feat_one, feat_phospho)
+
+    # # generate jalview svg
+    # java = "/sw/java/latest/bin/java"
+    # jalview = "/cluster/gjb_lab/webservices/www-jpred/devel/JALVIEW"
+    # jalview_jar = "/cluster/gjb_lab/webservices/www-jpred/devel/JALVIEW/jalview.jar"
+    # jalview_props = "/cluster/gjb_lab/webservices/www-jpred/devel/JALVIEW/jvprops_noannots"
+    # cmd = "%s -Djava.ext.dirs=%s -jar %s -headless -props -%s -open %s -annotations %s -svg %s" \
+    #       % (java, jalview, jalview_jar, jalview_props, os.path.join(path, fasta), os.path.join(path, feature), os.path.join(path, link_svg))
+    # os.system(cmd)
+    #
+    # if os.path.isfile(os.path.join(path, link_svg)):
+    #     dummy = '<text x="2" y="8" style="fill: rgb(0,0,0); fill-opacity: 1.0; font-family: sans-serif; font-size: 10px; " >Right click</text></g><g transform="matrix(1,0,0,1,-3,32)"><text x="2" y="18" style="fill: rgb(0,0,0); fill-opacity: 1.0; font-family: sans-serif; font-size: 10px; " >to add annotation</text>'
+    #     op = open(os.path.join(path, link_svg), "r")
+    #     lines = op.readlines()
+    #     op.close()
+    #     op = open(os.path.join(path, link_svg), "w")
+    #     nlink_svg = ""
+    #     for line in lines:
+    #         op.write(line.replace(dummy, ""))
+    #         nlink_svg += line.replace(dummy, "") + " \n"
+    #     op.close()
+    #     # else:
+    #     #     nlink_svg = "
+    # else:
+    #     raise ValueError("SVG failed to generate.")
+
+    return
+
+
+@contextmanager
+def dataset_writer(output_file, chunk_size=100000):
+    """
+    Writes the sites of all the sequences to one columnar dataset (see
+    dataset_columns), in chunks of rows: a Parquet file (typed columns,
+    one row group per chunk; requires pyarrow) if the name ends with
+    '.parquet', otherwise a TSV file (scores written at full precision).
+    The dataset is renamed into place once complete.
+
+    @param output_file: dataset file (nothing is written if None)
+    @param chunk_size: number of rows buffered before they are written out
+    @return: yields a function that takes a result (see predict)
+    """
+
+    from methods import atomic_write, timer
+
+    if output_file is None:
+        yield lambda result: None
+        return
+
+    parquet = output_file.endswith(".parquet")
+    if parquet:
+        # optional dependency: only needed for Parquet datasets
+        import pyarrow
+        import pyarrow.parquet
+        types = {"int": pyarrow.int32(), "float": pyarrow.float64(), "str": pyarrow.string()}
+        schema = pyarrow.schema([(name, types[kind]) for name, kind in dataset_columns])
+
+    with atomic_write(output_file, "wb" if parquet else "w") as out:
+        columns = [[] for _ in dataset_columns]
+        writer = []
+
+        def flush():
+            if not columns[0]:
+                return
+            if parquet:
+                if not writer:
+                    writer.append(pyarrow.parquet.ParquetWriter(out, schema))
+                table = pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type)
+                                                   for column, field in zip(columns, schema)],
+                                                  schema=schema)
+                writer[0].write_table(table)
+            else:
+                lines = zip(*[[("" if value is None else repr(value)) if kind == "float" else str(value)
+                               for value in column]
+                              for column, (_, kind) in zip(columns, dataset_columns)])
+                out.writelines("%s\n" % "\t".join(line) for line in lines)
+            for column in columns:
+                del column[:]
+
+        def write(result):
+            with timer("dataset", len(result["Sites"])):
+                for site in result["Sites"]:
+                    columns[0].append(result["Count"])
+                    columns[1].append(result["Identifier"])
+                    for column, (name, _) in zip(columns[2:], dataset_columns[2:]):
+                        column.append(site[name])
+                if len(columns[0]) >= chunk_size:
+                    flush()
+
+        if not parquet:
+            out.write("%s\n" % "\t".join(name for name, _ in dataset_columns))
+        yield write
+        with timer("dataset"):
+            flush()
+            if parquet:
+                if not writer:
+                    writer.append(pyarrow.parquet.ParquetWriter(out, schema))
+                writer[0].close()
+
+
+def write_error_log(error, path, filename, input_name):
+    """
+    Writes the error of a failed prediction to <filename>.log.
+
+    @param error: exception raised
+    @param path: output directory
+    @param filename: name of the output files (without extension)
+    @param input_name: input file (or record) the error was raised for
+    @return: returns the path of the log (str)
+    """
+
+    from methods import ctime
+
+    log_file = os.path.join(path, "%s.log" % filename)
+    with open(log_file, "w") as log:
+        log.write(
+"""Logged error for file '%s' (%s)
+
+> Error: %s
+
+""" % (input_name, ctime(), error))
+    return log_file
+
+
+def get_prediction_results(arg_input, arg_output, multiple=False, batch_size=20000, jobs=1,
+                           formats=None, dataset=None, methods=None, timings=None):
     """
     Gets every Ser/Thr residue for each inputed protein and scores it using
-    ANN, PSSM, SVM and Consensus classifiers.
+    ANN, PSSM, SVM and Consensus classifiers (see predict).
 
     @param arg_input: name of the input file (protein sequences in FASTA)
     @param arg_output: name of the output directory
     @param multiple: multiple is True for multiple sequences
+    @param batch_size: number of Ser/Thr sites scored at once (multiple sequences)
+    @param jobs: number of worker processes (multiple sequences)
+    @param formats: legacy formats to write out (all if None; only csv, tsv
+        and json apply to multiple sequences)
+    @param dataset: consolidated dataset file (see dataset_writer)
+    @param methods: any subset of all_methods (all if None)
+    @param timings: JSON summary of the stage timers of the run (see methods.timer)
     @return: prints out both cvs and tsv result files
     """
 
@@ -27,13 +729,9 @@ def get_prediction_results(arg_input, arg_output, multiple=False):
     from Bio import SeqIO
     # from Bio.Alphabet import IUPAC
 
-    from methods import ctime
+    from methods import atomic_writes, timer, write_timings
     # from methods import load_sqlite, store_sqlite
 
-    from predictor import pssm_prediction
-    from predictor import ann_prediction
-    from predictor import svm_prediction
-
     # capturing input filename
     try:
         filename = arg_input.split("/")[-1]
@@ -42,157 +740,85 @@ def get_prediction_results(arg_input, arg_output, multiple=False):
         filename = arg_input
 
     path = arg_output
+    formats = get_formats(formats)
 
     if multiple:
-        # going through the sequences
+        # going through the sequences (streamed in batches of sites)
         try:
-            lcsv = []
-            ltsv = []
-            information = []
             count = 0
             read = SeqIO.parse(arg_input, "fasta")
-            for record in read:
-                sequence = str(record.seq)
-                identifier = str(record.id)
-                count += 1
-
-                # skip if there is more than 100 sequences
-                if count < 100:
-
-                    # e.g. sp|P16188|1A30_HUMAN
-                    try:
-                        identifier = identifier.split("|")[1]
-                    except:
-                        pass
-
-                    # test length of sequence
-                    if len(sequence) < 30:
-                         raise ValueError("Inputed sequence with ID %s was too short (<30 amino acids)." % identifier)
-
-                    # log queried IDs from the public
-                    # if identifier != "":
-                    #     try:
-                    #         counter = load_sqlite(identifier, method="LOG", unique=True)
-                    #     except:
-                    #         counter = 0
-                    #     # add one to the counter
-                    #     store_sqlite(identifier, method="LOG", information=int(counter) + 1, save=True)
-
-                    # going through each sequence
-                    full_peptides = []
-                    peptides = []
-                    position = 0
-                    for res in sequence:
-                        position += 1
-                        if res == "S" or res == "T":
-                            res = res.lower()
-                            site = position - 1
-
-                            lower = site - 6
-                            upper = site + 4 + 1
-                            lowergap = ""
-                            uppergap = ""
-                            if lower < 0:
-                                lowerdiff = abs(lower)
-                                lower = 0
-                                lowergap = "-" * lowerdiff
-                            if upper > len(sequence):
-                                upperdiff = upper - len(sequence)
-                                upper = len(sequence)
-                                uppergap = "-" * upperdiff
-
-                            bef = "".join((lowergap, sequence[lower:site]))
-                            aft = "".join((sequence[site + 1:upper], uppergap))
-                            peptide2 = bef + res + aft
-                            peptide3 = bef + aft
-
-                            full_peptides.append([position, peptide2, peptide3])
-                            peptides.append(peptide3)
-
-                    # score the peptides using the ANN, PSSM and SVM methods
-                    ann_scores = ann_prediction(peptides, filename)
-                    pssm_scores = pssm_prediction(peptides)
-                    svm_scores = svm_prediction(peptides, filename)
-
-                    information2 = []
-                    for entry, ann, pssm, svm in zip(full_peptides, ann_scores, pssm_scores, svm_scores):
-                        ann = round(float(ann), 3)
-                        pssm = round(float(pssm), 3)
-                        svm = round(float(svm), 3)
-                        consensus = round((ann + pssm + svm) * 1.0 / 3, 3)
-                        position = entry[0]
-                        peptide2 = entry[1]
-
-                        # print out the scores
-                        lcsv.append("%s,%s,%s,%s,%s,%s,%s,%s\n" % (count, identifier, position, peptide2, ann, pssm, svm, consensus))
-                        ltsv.append("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (count, identifier, position, peptide2, ann, pssm, svm, consensus))
-
-                        dictionary = {}
-                        dictionary["Identifier"] = identifier
-                        dictionary["Site"] = position
-                        dictionary["Peptide"] = peptide2
-                        dictionary["ANN"] = '{0:.3f}'.format(float(ann))
-                        dictionary["PSSM"] = '{0:.3f}'.format(float(pssm))
-                        dictionary["SVM"] = '{0:.3f}'.format(float(svm))
-                        dictionary["Consensus"] = '{0:.3f}'.format(float(consensus))
-                        information2.append(dictionary)
-
-                    information.append(information2)
-
-            if count == 0:
-                raise ValueError("No sequences in FASTA format were provided.")
-
-            # create oupput files
-            csv = "%s.csv" % filename
-            tsv = "%s.tsv" % filename
-            js = "%s.json" % filename
-            print(os.path.join(path, csv))
-            icsv = open(os.path.join(path, csv), "a")
-            itsv = open(os.path.join(path, tsv), "a")
-            ijson = open(os.path.join(path, js), "w")
-            icsv.write("Sequence,Identifier,Site,Peptide_[-6:4],ANN,PSSM,SVM,Consensus\n")
-            itsv.write("Sequence\tIdentifier\tSite\tPeptide_[-6:4]\tANN\tPSSM\tSVM\tconsensus\n")
-
-            # go trough files
-            for entry in lcsv:
-                icsv.write(entry)
-
-            for entry in ltsv:
-                itsv.write(entry)
-
-            json_lines = json.dumps(information, sort_keys=False)
-            ijson.write(json_lines)
-
-            icsv.close()
-            itsv.close()
-            ijson.close()
+
+            # create oupput files (renamed into place once complete)
+            extensions = [extension for extension in ("csv", "tsv", "json") if extension in formats]
+            if "csv" in extensions:
+                print(os.path.join(path, "%s.csv" % filename))
+            output_files = [os.path.join(path, "%s.%s" % (filename, extension)) for extension in extensions]
+            with atomic_writes(output_files) as outputs, dataset_writer(dataset) as write_dataset:
+                outputs = dict(zip(extensions, outputs))
+                icsv = outputs.get("csv")
+                itsv = outputs.get("tsv")
+                ijson = outputs.get("json")
+                if icsv:
+                    icsv.write("Sequence,Identifier,Site,Peptide_[-6:4],ANN,PSSM,SVM,Consensus\n")
+                if itsv:
+                    itsv.write("Sequence\tIdentifier\tSite\tPeptide_[-6:4]\tANN\tPSSM\tSVM\tconsensus\n")
+                if ijson:
+                    ijson.write("[")
+
+                for result in iter_predictions(read, batch_size=batch_size, phosphosites=False, jobs=jobs,
+                                               methods=methods):
+
+                    write_dataset(result)
+                    with timer("writing", len(result["Sites"])):
+                        count = result["Count"]
+                        identifier = result["Identifier"]
+                        information2 = []
+                        for site in result["Sites"]:
+                            ann = round_score(site["ANN"])
+                            pssm = round_score(site["PSSM"])
+                            svm = round_score(site["SVM"])
+                            if "-" in (ann, pssm, svm):
+                                consensus = "-"
+                            else:
+                                consensus = round((ann + pssm + svm) * 1.0 / 3, 3)
+                            position = site["Site"]
+                            peptide2 = site["Peptide"]
+
+                            # print out the scores
+                            if icsv:
+                                icsv.write("%s,%s,%s,%s,%s,%s,%s,%s\n" % (count, identifier, position, peptide2, ann, pssm, svm, consensus))
+                            if itsv:
+                                itsv.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (count, identifier, position, peptide2, ann, pssm, svm, consensus))
+
+                            dictionary = {}
+                            dictionary["Identifier"] = identifier
+                            dictionary["Site"] = position
+                            dictionary["Peptide"] = peptide2
+                            dictionary["ANN"] = format_score(ann)
+                            dictionary["PSSM"] = format_score(pssm)
+                            dictionary["SVM"] = format_score(svm)
+                            dictionary["Consensus"] = format_score(consensus)
+                            information2.append(dictionary)
+
+                        # one list of sites per sequence
+                        if ijson:
+                            if count > 1:
+                                ijson.write(", ")
+                            ijson.write(json.dumps(information2, sort_keys=False))
+
+                if count == 0:
+                    raise ValueError("No sequences in FASTA format were provided.")
+
+                if ijson:
+                    ijson.write("]")
 
         except Exception as e:
-            path = arg_output
             print(os.path.join(path, "%s.log" % filename))
-            log = open(os.path.join(path, "%s.log" % filename), "w")
-            log.write(
-"""Logged error for file '%s' (%s)
-
-> Error: %s
-
-""" % (arg_input, ctime(), e))
-            log.close()
+            write_error_log(e, path, filename, arg_input)
 
     else:
         try:
             record = SeqIO.read(arg_input, "fasta")
-            sequence = str(record.seq)
-            identifier = str(record.id)
-            # e.g. sp|P16188|1A30_HUMAN
-            try:
-                identifier = identifier.split("|")[1]
-            except:
-                pass
-
-            # test length of sequence
-            if len(sequence) < 30:
-                 raise ValueError("Inputed sequence with ID %s was too short (<30 amino acids)." % identifier)
 
             # log queried IDs from the public
             # if identifier != "":
@@ -203,191 +829,18 @@ def get_prediction_results(arg_input, arg_output, multiple=False):
             #     # add one to the counter
             #     store_sqlite(identifier, method="LOG", information=int(counter) + 1, save=True)
 
-            # going through the sequence
-            full_peptides = []
-            peptides = []
-            position = 0
-            for res in sequence:
-                position += 1
-
-                if res == "S" or res == "T":
-                    res1 = "[" + res + "]"
-                    res2 = res.lower()
-                    site = position - 1
-
-                    lower = site - 6
-                    upper = site + 4 + 1
-                    lowergap = ""
-                    uppergap = ""
-                    if lower < 0:
-                        lowerdiff = abs(lower)
-                        lower = 0
-                        lowergap = "-" * lowerdiff
-                    if upper > len(sequence):
-                        upperdiff = upper - len(sequence)
-                        upper = len(sequence)
-                        uppergap = "-" * upperdiff
-
-                    bef = "".join((lowergap, sequence[lower:site]))
-                    aft = "".join((sequence[site + 1:upper], uppergap))
-                    peptide = bef + res1 + aft
-                    peptide2 = bef + res2 + aft
-                    peptide3 = bef + aft
-
-                    full_peptides.append([position, peptide, peptide2, peptide3])
-                    peptides.append(peptide3)
-
-            # score the peptides using the ANN, PSSM and SVM methods
-            ann_scores = ann_prediction(peptides, filename)
-            pssm_scores = pssm_prediction(peptides)
-            svm_scores = svm_prediction(peptides, filename)
-
-            # try:
-            #     phospho_sites = load_sqlite(identifier, method="PhosphoSite", unique=False)
-            # except:
-            from methods import get_phosphosites
-            phospho_sites = get_phosphosites(identifier)
-
-            link_csv = "%s.csv" % filename
-            link_tsv = "%s.tsv" % filename
-            link_json = "%s.json" % filename
-            link_full = "%s.full" % filename
-
-            csv = open(os.path.join(path, link_csv), "w")
-            csv.write("Site,Peptide_[-6:4],ANN,PSSM,SVM,Consensus,pSer/Thr\r\n")
-            tsv = open(os.path.join(path, link_tsv), "w")
-            tsv.write("Site\tPeptide_[-6:4]\tANN\tPSSM\tSVM\tconsensus,pSer/Thr\r\n")
-            js = open(os.path.join(path, link_json), "w")
-            full = open(os.path.join(path, link_full), "w")
-
-            rows = []
-            feat_three = []
-            feat_two = []
-            feat_one = []
-            feat_phospho = []
-            information = []
-            count = 0
-            for entry, ann, pssm, svm in zip(full_peptides, ann_scores, pssm_scores, svm_scores):
-                count += 1
-                consensus = round((float(ann) + float(pssm) + float(svm)) * 1.0 / 3, 3)
-                ann = round(float(ann), 3)
-                pssm = round(float(pssm), 3)
-                svm = round(float(svm), 3)
-                position = entry[0]
-                peptide = entry[1]
-                peptide2 = entry[2]
-                if str(position) in phospho_sites:
-                    phospho = "Yes"
-                    feat_phospho.append(position)
-                else:
-                    phospho = "-"
-
-                # print out the scores
-                csv.write("%s,%s,%s,%s,%s,%s,%s\r\n" % (position, peptide2, ann, pssm, svm, consensus, phospho))
-                tsv.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\r\n" % (position, peptide2, ann, pssm, svm, consensus, phospho))
-                dictionary = {}
-                dictionary["Site"] = position
-                dictionary["Peptide"] = peptide2
-                dictionary["ANN"] = '{0:.3f}'.format(float(ann))
-                dictionary["PSSM"] = '{0:.3f}'.format(float(pssm))
-                dictionary["SVM"] = '{0:.3f}'.format(float(svm))
-                dictionary["Consensus"] = '{0:.3f}'.format(float(consensus))
-                dictionary["pSer/Thr"] = phospho
-                information.append(dictionary)
-
-                # get conditional labels
-                if ann > 0.55 and pssm > 0.80 and svm > 0.25:
-                    candidate = "Three"
-                    feat_three.append(position)
-                elif (ann > 0.55 and pssm > 0.80) or (ann > 0.55 and svm > 0.25) or (svm > 0.25 and pssm > 0.80):
-                    candidate = "Two"
-                    feat_two.append(position)
-                elif ann > 0.55 or pssm > 0.80 or svm > 0.25:
-                    candidate = "One"
-                    feat_one.append(position)
-                else:
-                    candidate = "False"
-
-                # cosmetics in the table view
-                consensus = '{0:.3f}'.format(float((float(ann) + float(pssm) + float(svm)) * 1.0 / 3))
-                ann = '{0:.3f}'.format(float(ann))
-                pssm = '{0:.3f}'.format(float(pssm))
-                svm = '{0:.3f}'.format(float(svm))
-
-                if "-" not in ann:
-                    ann = "&nbsp;%s" % ann
-
-                if "-" not in pssm:
-                    pssm = "&nbsp;%s" % pssm
-
-                if "-" not in svm:
-                    svm = "&nbsp;%s" % svm
-
-                if "-" not in consensus:
-                    consensus = "&nbsp;%s" % consensus
-
-                rows.append([position, peptide, ann, pssm, svm, consensus, candidate, phospho])
-                full.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\r\n" % (position, peptide, ann, pssm, svm, consensus, candidate, phospho))
-
-            json_lines = json.dumps(information, sort_keys=False)
-            js.write(json_lines)
-            csv.close()
-            tsv.close()
-            js.close()
-            full.close()
-
-            # jaliew-lite
-            # import shutil
-            # shutil.copyfile(os.path.join(PATH, "static", "jalviewApplet.jar")), os.path.join(TMP_PATH, "jalviewApplet.jar"))
-            # shutil.copyfile(os.path.join(PATH, "static", "JmolApplet.jar"), os.path.join(TMP_PATH, "JmolApplet.jar"))
-            # fasta for jalview
-            fasta = "%s.fa" % filename
-            op = open(os.path.join(path, fasta), 'w')
-            op.write(">%s\n%s" % (identifier, sequence))
-            op.close()
-
-            # features and SVG
-            feature = "%s.feat" % filename
-            link_svg = "%s.svg" % filename
-
-            # generate the features file for Jalview-
-            from methods import write_features
-            write_features(feature, identifier, feat_three, feat_two, feat_one, feat_phospho)
-
-            # # generate jalview svg
-            # java = "/sw/java/latest/bin/java"
-            # jalview = "/cluster/gjb_lab/webservices/www-jpred/devel/JALVIEW"
-            # jalview_jar = "/cluster/gjb_lab/webservices/www-jpred/devel/JALVIEW/jalview.jar"
-            # jalview_props = "/cluster/gjb_lab/webservices/www-jpred/devel/JALVIEW/jvprops_noannots"
-            # cmd = "%s -Djava.ext.dirs=%s -jar %s -headless -props -%s -open %s -annotations %s -svg %s" \
-            #       % (java, jalview, jalview_jar, jalview_props, os.path.join(path, fasta), os.path.join(path, feature), os.path.join(path, link_svg))
-            # os.system(cmd)
-            #
-            # if os.path.isfile(os.path.join(path, link_svg)):
-            #     dummy = '<text x="2" y="8" style="fill: rgb(0,0,0); fill-opacity: 1.0; font-family: sans-serif; font-size: 10px; " >Right click</text></g><g transform="matrix(1,0,0,1,-3,32)"><text x="2" y="18" style="fill: rgb(0,0,0); fill-opacity: 1.0; font-family: sans-serif; font-size: 10px; " >to add annotation</text>'
-            #     op = open(os.path.join(path, link_svg), "r")
-            #     lines = op.readlines()
-            #     op.close()
-            #     op = open(os.path.join(path, link_svg), "w")
-            #     nlink_svg = ""
-            #     for line in lines:
-            #         op.write(line.replace(dummy, ""))
-            #         nlink_svg += line.replace(dummy, "") + " \n"
-            #     op.close()
-            #     # else:
-            #     #     nlink_svg = "
-            # else:
-            #     raise ValueError("SVG failed to generate.")
+            # score the sequence using the ANN, PSSM and SVM methods
+            result = predict([record], methods=methods)[0]
+            write_results(result, path, filename, formats=formats)
+            with dataset_writer(dataset) as write_dataset:
+                write_dataset(result)
 
         except Exception as e:
-            log = open(os.path.join(path, "%s.log" % filename), "w")
-            log.write(
-"""Logged error for file '%s' (%s)
+            write_error_log(e, path, filename, arg_input)
 
-> Error: %s
-
-""" % (arg_input, ctime(), e))
-            log.close()
+    if timings is not None:
+        write_timings(timings, input=arg_input, multiple=multiple, jobs=jobs,
+                      methods=get_methods(methods))
 
     return
 
@@ -399,12 +852,14 @@ def main():
     > Uses Biopython (Python module) sequence parsers and expects
     sequences in FASTA format.
 
-    > To classify peptides using the SVM model the external PyML
-    python model is necessary.
+    > The SVM is trained once with NumPy (the cosine kernel SVM of the
+    original PyML model, collapsed to a weight vector) and cached.
+
+    > This is a thin wrapper around predict, which can also be
+    imported and called in-process by other pipelines.
 
-    > To classify peptides using the ANN model a local version of the
-    compiled C executable is necessary ("./ANN") and hopefully this
-    will run in UNIX based systems (only tested in CentOS)
+    > The ANN model is evaluated in-process (NumPy) with the weights
+    of the snns2c generated network ("ANN.c", also compiled as "./ANN").
 
     > No tests have been explicitly made to test whether the previous
     modules are available, so exception errors are expected if those
@@ -421,11 +876,37 @@ def main():
                         help='output path')
     parser.add_argument('-m', dest='multiple', default=False,
                         help='boolean', action='store_true')
+    parser.add_argument('-b', dest='batch_size', type=int, default=20000,
+                        help='number of Ser/Thr sites scored at once (with -m)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='number of worker processes (with -m)')
+    parser.add_argument('-f', '--formats', dest='formats', type=str, default=",".join(legacy_formats),
+                        help='legacy output formats, comma separated (any of %s, or none)'
+                             % ", ".join(legacy_formats))
+    parser.add_argument('-d', '--dataset', dest='dataset', type=str, default=None,
+                        help='consolidated dataset of all the sites (.parquet or .tsv)')
+    parser.add_argument('--methods', dest='methods', type=str, default=",".join(all_methods),
+                        help='methods to run, comma separated (any of %s)' % ", ".join(all_methods))
+    parser.add_argument('-c', dest='scores_db', type=str, default=None,
+                        help='peptide score cache (SQLite database path)')
+    parser.add_argument('-t', '--timings', dest='timings', type=str, default=None,
+                        help='JSON summary of the time spent in each stage')
 
     args = parser.parse_args()
+    try:
+        formats = get_formats(args.formats.split(","))
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.scores_db is not None:
+        import methods
+        methods.SCORES_DB = args.scores_db
 
     if isinstance(args.input, str):
-        get_prediction_results(args.input, args.output, multiple=args.multiple)
+        get_prediction_results(args.input, args.output, multiple=args.multiple,
+                               batch_size=args.batch_size, jobs=args.jobs,
+                               formats=formats, dataset=args.dataset,
+                               methods=args.methods.split(","), timings=args.timings)
 
     else:
         print("...No input provided! Check the program help with 'python prediction.py -h'")
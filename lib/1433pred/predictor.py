@@ -1,132 +1,337 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
 import os
-import sys
+import hashlib
 import tempfile
 
-from Bio import AlignIO
-from PyML import SequenceData, SVM
-from PyML.classifiers.svm import loadSVM
+import numpy as np
+
+from methods import timer
 
 DEV = "www1433"
 # PATH = "/homes/www-1433/%s/app/" % DEV
 PATH = os.path.dirname(__file__)
 # TMP_PATH = "/homes/www-1433/tmp/"
 TMP_PATH = tempfile.gettempdir()
+# trained models and derived matrices are cached here
+CACHE_PATH = os.environ.get("PRED1433_CACHE", os.path.join(PATH, "cache"))
 
 aa_valid = ["A", "R", "N", "D", "C", "Q", "E", "G", "H", "I",
             "L", "K", "M", "F", "P", "S", "T", "W", "Y", "V"]
 aa_valid_gap = ["A", "R", "N", "D", "C", "Q", "E", "G", "H", "I",
                 "L", "K", "M", "F", "P", "S", "T", "W", "Y", "V", "-"]
 
+# residues shared by the ANN, PSSM and SVM encodings: aa_valid, the gap and
+# the non-standard letters (any other symbol is encoded after these)
+peptide_alphabet = aa_valid_gap + ["B", "J", "O", "U", "X", "Z"]
+
+# SVM weight vectors loaded in this process (keyed by svm_model_key)
+svm_weights = dict()
+# PSSM matrices loaded in this process (keyed by training files checksums)
+pssm_matrices = dict()
+# ANN weights loaded in this process (keyed by network file)
+ann_networks = dict()
+# training files checksums computed in this process (keyed by path)
+training_checksums = dict()
+
+# stopping tolerance of the SVM solver (libsvm's default, used by PyML)
+svm_eps = 1e-3
+
+
+def file_checksum(input_file):
+    """
+    Computes the SHA1 checksum of a (training) file.
+
+    :param input_file: input file
+    :return: returns a hex digest (str)
+    """
+
+    sha1 = hashlib.sha1()
+    with open(input_file, "rb") as infile:
+        for block in iter(lambda: infile.read(65536), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cache_file(name):
+    """
+    Gets the path of a file in the model cache, creating the cache
+    directory if needed.
+
+    :param name: file name
+    :return: returns a path (str)
+    """
+
+    global CACHE_PATH
+
+    try:
+        os.makedirs(CACHE_PATH)
+    except OSError:
+        if not os.path.isdir(CACHE_PATH):
+            raise
+    return os.path.join(CACHE_PATH, name)
+
+
+def training_checksum(input_file):
+    """
+    Gets the SHA1 checksum of a training file. Checksums are remembered in
+    the model cache together with the file mtime and size, so a file is only
+    hashed again once it has been modified, and kept in memory for the rest
+    of the process (the model keys are derived from them on every call).
+
+    :param input_file: input file
+    :return: returns a hex digest (str)
+    """
+
+    import json
+
+    global training_checksums
+
+    input_file = os.path.abspath(input_file)
+    if input_file in training_checksums:
+        return training_checksums[input_file]
+
+    stat = os.stat(input_file)
+    checksums_json = cache_file("checksums.json")
+    try:
+        with open(checksums_json, "r") as infile:
+            checksums = json.load(infile)
+    except (IOError, ValueError):
+        checksums = dict()
+
+    entry = checksums.get(input_file)
+    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        training_checksums[input_file] = entry["sha1"]
+        return entry["sha1"]
+
+    checksum = file_checksum(input_file)
+    checksums[input_file] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": checksum}
+    checksums_tmp = "%s.%s.tmp" % (checksums_json, os.getpid())
+    with open(checksums_tmp, "w") as outfile:
+        json.dump(checksums, outfile, indent=4, sort_keys=True)
+    os.rename(checksums_tmp, checksums_json)
+    training_checksums[input_file] = checksum
+    return checksum
+
+
+def translation_table(alphabet):
+    """
+    Builds a bytes.translate table mapping each symbol of an alphabet to its
+    index (anything else is mapped to len(alphabet)).
+
+    :param alphabet: sequence of single character symbols
+    :return: returns a 256 byte translation table
+    """
+
+    table = bytearray([len(alphabet)]) * 256
+    for i, aa in enumerate(alphabet):
+        table[ord(aa)] = i
+    return bytes(table)
+
+
+def encode_peptides(peptides):
+    """
+    Encodes a batch of peptides of equal length as indexes of peptide_alphabet
+    (lowercase residues as their uppercase, anything else as
+    len(peptide_alphabet)). Peptides are encoded once per batch and the same
+    array is used by the ANN (one-hot), PSSM (gather) and SVM (positional one-hot).
+
+    :param peptides: input peptides
+    :return: returns a (N x peptide length) uint8 array (numpy)
+    """
+
+    if len(peptides) == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+
+    length = len(peptides[0])
+    if any(len(peptide) != length for peptide in peptides):
+        raise ValueError("Peptides must all have the same length to be encoded.")
+
+    table = bytearray(translation_table(peptide_alphabet))
+    for aa in peptide_alphabet:
+        table[ord(aa.lower())] = table[ord(aa)]
+
+    joined = "".join(peptides).encode("ascii").translate(bytes(table))
+    return np.frombuffer(joined, dtype=np.uint8).reshape(len(peptides), length)
+
+
+def cached_scores(method, model, peptides, encoded, scorer):
+    """
+    Scores peptides through the persistent peptide score cache (see
+    methods.load_scores): the scores of the whole batch are pre-fetched and
+    only the peptides missing from the cache are scored and then stored.
+
+    :param method: scoring method (e.g. ANN, PSSM or SVM)
+    :param model: model key (hash of the trained model/training data)
+    :param peptides: input peptides
+    :param encoded: peptides encoded with encode_peptides
+    :param scorer: function scoring an encoded array
+    :return: returns a list of scores
+    """
+
+    from methods import load_scores, store_scores
+
+    scores = load_scores(method, model, peptides)
+    missing = [i for i, peptide in enumerate(peptides) if peptide not in scores]
+    if missing:
+        new_scores = scorer(encoded[np.array(missing)]).tolist()
+        new_scores = dict(zip([peptides[i] for i in missing], new_scores))
+        store_scores(method, model, new_scores)
+        scores.update(new_scores)
+
+    return [scores[peptide] for peptide in peptides]
+
+
+def read_fasta_sequences(input_fasta):
+    """
+    Reads the sequences of a FASTA file as bytes (headers are dropped).
+
+    :param input_fasta: inputed fasta file
+    :return: returns a list of sequences (bytes)
+    """
+
+    sequences = []
+    current = []
+    with open(input_fasta, "rb") as infile:
+        for line in infile:
+            line = line.strip()
+            if line.startswith(b">"):
+                if current:
+                    sequences.append(b"".join(current))
+                current = []
+            elif line:
+                current.append(line)
+    if current:
+        sequences.append(b"".join(current))
+    return sequences
+
 
 def pssm_matrix_from_fasta(input_fasta):
     """
     Computes de matrix of frequencies for the PSSM method from sequence.
 
-    :param input_fasta: inputed fasta file
-    :return: returns a PSSM matrix (memory)
+    :param input_fasta: inputed fasta file (aligned motifs)
+    :return: returns a PSSM matrix (numpy, len(aa_valid_gap) x motif length)
     """
 
     global PATH
 
     # inputs the fasta file
-    motifs = []
-    align = AlignIO.read(os.path.join(PATH, input_fasta), "fasta")
-    for record in align:
-        seq = record.seq
-        motifs.append(seq)
-
-    # gets the columns
-    columns = []
-    for p in range(0, len(motifs[0])):
-        column = ""
-        for seq in motifs:
-            column += seq[p]
-        columns.append(column)
-
-    # creates a 2D matrix of amino acids and frequency scores
-    # for each amino acid
-    matrix_aa = []
-    for aa in aa_valid_gap:
-        # scores the frequency of that amino acid in that location (position or column)
-        matrix_loc = []
-        for col in columns:
-            # adds a pseudo-count of 0.5 to avoid dividing by zero
-            score = (((col.count(aa) * 1.0) + 0.5) / (len(col) + 0.5))
-            matrix_loc.append(score)
-        matrix_aa.append(matrix_loc)
-
-    return matrix_aa
-
-
-def pssm_match_score(aa, position, score_matrix):
-    """
-    Matches a score of an amino acid and its sequence position in a scoring matrix.
-
-    :param aa: amino acid
-    :param position: amino acid position
-    :param score_matrix: input scoring matrix
-    :return: returns a score based on a position indexing
-    """
-
-    alphabet = dict()
-    alphabet["A"] = 0
-    alphabet["R"] = 1
-    alphabet["N"] = 2
-    alphabet["D"] = 3
-    alphabet["C"] = 4
-    alphabet["Q"] = 5
-    alphabet["E"] = 6
-    alphabet["G"] = 7
-    alphabet["H"] = 8
-    alphabet["I"] = 9
-    alphabet["L"] = 10
-    alphabet["K"] = 11
-    alphabet["M"] = 12
-    alphabet["F"] = 13
-    alphabet["P"] = 14
-    alphabet["S"] = 15
-    alphabet["T"] = 16
-    alphabet["W"] = 17
-    alphabet["Y"] = 18
-    alphabet["V"] = 19
-    alphabet["-"] = 20
-    matched = alphabet[aa]
-    return score_matrix[matched][position]
-
-
-def pssm_scoring(peptide, positives_matrix, negatives_matrix, background_matrix):
-    """
-    Scores a peptide given matrices of positives, negatives and background.
-
-    :param peptide: input peptide
-    :param positives_matrix: frequency matrix of positive peptides
-    :param negatives_matrix: frequency matrix of negative peptides
-    :param background_matrix: frequency matrix of background peptides
-    :return: returns a PSSM score for a peptide
-    """
-
-    score = 0.0
-    position = -1
-    for aa in peptide:
-        if aa in aa_valid_gap:
-            position += 1
-            pos = pssm_match_score(aa, position, positives_matrix)
-            neg = pssm_match_score(aa, position, negatives_matrix)
-            back = pssm_match_score(aa, position, background_matrix)
-
-            # our definition of PSSM scoring
-            score += (pos - neg) * 1.0 / back
-
-    return score / len(peptide)
+    motifs = read_fasta_sequences(os.path.join(PATH, input_fasta))
+    if not motifs:
+        raise ValueError("No sequences found in %s." % input_fasta)
+    length = len(motifs[0])
+    if any(len(motif) != length for motif in motifs):
+        raise ValueError("Sequences in %s must all have the same length." % input_fasta)
+
+    # motifs x columns matrix of amino acid indexes
+    symbols = len(aa_valid_gap) + 1
+    codes = np.frombuffer(b"".join(motifs).translate(translation_table(aa_valid_gap)),
+                          dtype=np.uint8).reshape(len(motifs), length)
+
+    # counts each amino acid in each location (position or column)
+    counts = np.bincount((codes + symbols * np.arange(length)).ravel(),
+                         minlength=symbols * length).reshape(length, symbols)
+    counts = counts.T[:len(aa_valid_gap)]
+
+    # adds a pseudo-count of 0.5 to avoid dividing by zero
+    return (counts + 0.5) / (len(motifs) + 0.5)
+
+
+def pssm_model_key(positives_pssm="PSSM_POS.fasta",
+                   negatives_pssm="PSSM_NEG.fasta",
+                   background_pssm="PSSM_BACK.fasta"):
+    """
+    Derives the key of the PSSM matrices from the training files checksums.
+
+    :param positives_pssm: input positive examples used in training
+    :param negatives_pssm: input negative examples used in training
+    :param background_pssm: input background examples used in training
+    :return: returns a key (str)
+    """
+
+    global PATH
+
+    inputs = (positives_pssm, negatives_pssm, background_pssm)
+    checksums = [training_checksum(os.path.join(PATH, name)) for name in inputs]
+    return hashlib.sha1(";".join(checksums).encode("utf-8")).hexdigest()
+
+
+def pssm_load_matrices(positives_pssm="PSSM_POS.fasta",
+                       negatives_pssm="PSSM_NEG.fasta",
+                       background_pssm="PSSM_BACK.fasta"):
+    """
+    Loads the PSSM frequency matrices and the derived (pos - neg) / back
+    scoring table. These are built once, cached as a .npy file keyed by the
+    training files checksums and then memory-mapped.
+
+    :param positives_pssm: input positive examples used in training
+    :param negatives_pssm: input negative examples used in training
+    :param background_pssm: input background examples used in training
+    :return: returns a (4 x len(aa_valid_gap) x motif length) array with the
+        positives, negatives, background and scoring matrices
+    """
+
+    global pssm_matrices
+
+    key = pssm_model_key(positives_pssm, negatives_pssm, background_pssm)
+    if key in pssm_matrices:
+        return pssm_matrices[key]
+
+    matrices_pssm = cache_file("pssm_%s.npy" % key)
+    try:
+        matrices = np.load(matrices_pssm, mmap_mode="r")
+    except Exception:
+        # not cached yet (or unreadable)
+        positives = pssm_matrix_from_fasta(positives_pssm)
+        negatives = pssm_matrix_from_fasta(negatives_pssm)
+        background = pssm_matrix_from_fasta(background_pssm)
+
+        # our definition of PSSM scoring
+        scoring = (positives - negatives) * 1.0 / background
+
+        matrices_tmp = "%s.%s.tmp.npy" % (matrices_pssm[:-4], os.getpid())
+        np.save(matrices_tmp, np.array([positives, negatives, background, scoring]))
+        os.rename(matrices_tmp, matrices_pssm)
+        matrices = np.load(matrices_pssm, mmap_mode="r")
+
+    pssm_matrices[key] = matrices
+    return matrices
+
+
+def pssm_batch_scores(encoded, scoring_matrix):
+    """
+    Scores a batch of encoded peptides against the PSSM scoring table
+    ((pos - neg) / back) with a single gather and sum.
+
+    Residues outside aa_valid_gap score 0 in their own position, so the
+    following residues keep their positions, and the score is averaged
+    over the full peptide length.
+
+    :param encoded: (N x L) uint8 array from encode_peptides
+    :param scoring_matrix: (len(aa_valid_gap) x L) PSSM scoring table
+    :return: returns a PSSM score for each peptide (numpy)
+    """
+
+    if encoded.shape[0] == 0:
+        return np.zeros(0)
+
+    length = encoded.shape[1]
+    if length > scoring_matrix.shape[1]:
+        raise ValueError("Peptides are longer than the PSSM (%i > %i)." % (length, scoring_matrix.shape[1]))
+
+    # rows of zeros for non-standard residues
+    others = len(peptide_alphabet) + 1 - len(aa_valid_gap)
+    table = np.vstack([scoring_matrix[:, :length], np.zeros((others, length))])
+    return table[encoded, np.arange(length)].sum(axis=1) / length
 
 
 def pssm_prediction(peptides,
                     positives_pssm="PSSM_POS.fasta",
                     negatives_pssm="PSSM_NEG.fasta",
-                    background_pssm="PSSM_BACK.fasta"):
+                    background_pssm="PSSM_BACK.fasta",
+                    encoded=None):
     """
     Makes a final prediction based on PSSM training files.
     This code is used for prediciton of blind datasets, based on the training
@@ -136,47 +341,27 @@ def pssm_prediction(peptides,
     :param positives_pssm: input positive examples used in training
     :param negatives_pssm: input negative examples used in training
     :param background_pssm: input background examples used in training
+    :param encoded: peptides already encoded with encode_peptides (optional)
     :return: returns PSSM scores for each inputed peptide
     """
 
-    print("Begin PSSM")
-
-    # from methods import load_sqlite, store_sqlite
-
-    pssm_scores = []
-    # query the database
-    # for peptide in peptides:
-    #     try:
-    #         score = load_sqlite(peptide, method="PSSM", unique=True)
-    #         pssm_scores.append(score)
-    #     except:
-    #         pass
-
-    if len(peptides) == len(pssm_scores):
-        pass
-    else:
-
-        positives = pssm_matrix_from_fasta(positives_pssm)
-        negatives = pssm_matrix_from_fasta(negatives_pssm)
-        background = pssm_matrix_from_fasta(background_pssm)
-
-        pssm_scores = list()
-        for peptide in peptides:
-            pssm_score = pssm_scoring(peptide, positives, negatives, background)
-            pssm_scores.append(pssm_score)
+    with timer("pssm", len(peptides)):
+        if encoded is None:
+            encoded = encode_peptides(peptides)
+        scoring = pssm_load_matrices(positives_pssm, negatives_pssm, background_pssm)[3]
 
-        # save the peptides in db
-        # for peptide, score in zip(peptides, pssm_scores):
-        #     store_sqlite(peptide, method="PSSM", information=score, save=True)
+        # query the score cache, then score (and save) the missing peptides
+        model = pssm_model_key(positives_pssm, negatives_pssm, background_pssm)
+        pssm_scores = cached_scores("PSSM", model, peptides, encoded,
+                                    lambda batch: pssm_batch_scores(batch, scoring))
 
-    print("End PSSM")
     return pssm_scores
 
 
 def svm_process_header(header):
     """
     "Extract sequence ID and its label from the fasta file.
-    Used by PyML.
+    Used to read the labels of the training examples.
 
     :param header:
     :return: returns ID and label
@@ -186,263 +371,458 @@ def svm_process_header(header):
     return idd.strip(), label_token.split('=')[1]
 
 
-def svm_prediction(peptides, job_id,
-                   input_train="SVM_POS_NEG.fasta"):
+def svm_model_key(input_train="SVM_POS_NEG.fasta", cval=1, kernel="cosine"):
+    """
+    Derives the cache key of a trained SVM from the contents of the training
+    file and the training parameters, so that a model is retrained only when
+    either of them changes.
+
+    :param input_train: input positive and negative examples used in training
+    :param cval: SVM soft margin constant (C)
+    :param kernel: kernel attached to the training data
+    :return: returns a key (str)
+    """
+
+    global PATH
+
+    checksum = training_checksum(os.path.join(PATH, input_train))
+    params = ("C=%s;Cmode=classProb;kernel=%s;mink=1;maxk=1;maxShift=0;solver=libsvm;eps=%s"
+              % (cval, kernel, svm_eps))
+    return hashlib.sha1(("%s;%s" % (checksum, params)).encode("utf-8")).hexdigest()
+
+
+def svm_training_data(input_train="SVM_POS_NEG.fasta"):
+    """
+    Reads the training examples of the SVM (FASTA, "> ID label=1|-1").
+
+    :param input_train: input positive and negative examples used in training
+    :return: returns the peptides and their labels (numpy, +1 or -1)
+    """
+
+    global PATH
+
+    peptides = []
+    labels = []
+    with open(os.path.join(PATH, input_train), "r") as lines:
+        for line in lines:
+            line = line.strip()
+            if line.startswith(">"):
+                labels.append(float(svm_process_header(line[1:])[1]))
+                peptides.append("")
+            elif line:
+                peptides[-1] += line
+    return peptides, np.array(labels)
+
+
+def svm_features(encoded):
+    """
+    Positional 1-mer features of encoded peptides, as built by PyML
+    SequenceData with mink=1, maxk=1, maxShift=0: one (0/1) feature per
+    residue and position. Every peptide has L features set, so the cosine
+    kernel of two peptides is their dot product / L.
+
+    :param encoded: (N x L) uint8 array from encode_peptides
+    :return: returns a (N x L * (len(peptide_alphabet) + 1)) matrix (numpy)
+    """
+
+    symbols = len(peptide_alphabet) + 1
+    count, length = encoded.shape
+    features = np.zeros((count, length * symbols))
+    features[np.arange(count)[:, None], np.arange(length) * symbols + encoded] = 1.0
+    return features
+
+
+def svm_class_costs(labels, cval):
+    """
+    Gets the C of each class as PyML's default Cmode ('classProb') sets
+    them: each class gets C in proportion to the size of the other class
+    (C / 2 for both classes on a balanced training file).
+
+    :param labels: training labels (numpy, +1 or -1)
+    :param cval: SVM soft margin constant (C)
+    :return: returns the C of the positives and of the negatives
+    """
+
+    positives = float((labels > 0).sum())
+    return cval * (len(labels) - positives) / len(labels), cval * positives / len(labels)
+
+
+def svm_smo(kernel_matrix, labels, cpos, cneg, eps=None):
+    """
+    Solves the C-SVM dual as libsvm's Solver (which PyML trains with) does:
+    second order working set selection, keeping the last index on ties, the
+    kernel values held in single precision (libsvm's Qfloat) and the same
+    stopping rule, max(-y_i * G_i, i in I_up) - min(-y_j * G_j, j in I_low)
+    < eps. Shrinking only restricts the variables scanned between full
+    checks and does not change the solution on the training file, so it is
+    left out.
+
+    :param kernel_matrix: (N x N) kernel matrix of the training examples
+    :param labels: training labels (numpy, +1 or -1)
+    :param cpos: C of the positive examples
+    :param cneg: C of the negative examples
+    :param eps: stopping tolerance (svm_eps if None)
+    :return: returns the alphas (numpy) and the bias (b)
+    """
+
+    if eps is None:
+        eps = svm_eps
+
+    y = labels
+    q = (kernel_matrix * np.outer(y, y)).astype(np.float32).astype(np.float64)
+    diagonal = np.diag(kernel_matrix).astype(np.float64)
+    bounds = np.where(y > 0, cpos, cneg)
+    alphas = np.zeros(len(y))
+    gradient = -np.ones(len(y))
+
+    def last(values):
+        # index of the last maximum (libsvm updates its choice on >=)
+        return len(values) - 1 - int(np.argmax(values[::-1]))
+
+    while True:
+        up = np.where(y > 0, alphas < bounds, alphas > 0)
+        low = np.where(y > 0, alphas > 0, alphas < bounds)
+        violation = -y * gradient
+
+        i = last(np.where(up, violation, -np.inf))
+        gap = violation[i] - violation
+        curvature = diagonal[i] + diagonal - 2.0 * y[i] * y * q[i]
+        curvature[curvature <= 0] = 1e-12
+        decrease = np.where(low & (gap > 0), -gap * gap / curvature, np.inf)
+        if not up.any() or not (low & (gap > 0)).any() or violation[i] - violation[low].min() < eps:
+            break
+        j = last(-decrease)
+
+        # analytic update of the pair, clipped to the box as in libsvm
+        old_i, old_j = alphas[i], alphas[j]
+        if y[i] != y[j]:
+            quad = diagonal[i] + diagonal[j] + 2.0 * q[i, j]
+            delta = (-gradient[i] - gradient[j]) / (quad if quad > 0 else 1e-12)
+            diff = old_i - old_j
+            new_i, new_j = old_i + delta, old_j + delta
+            if diff > 0:
+                if new_j < 0:
+                    new_i, new_j = diff, 0.0
+            elif new_i < 0:
+                new_i, new_j = 0.0, -diff
+            if diff > bounds[i] - bounds[j]:
+                if new_i > bounds[i]:
+                    new_i, new_j = bounds[i], bounds[i] - diff
+            elif new_j > bounds[j]:
+                new_i, new_j = bounds[j] + diff, bounds[j]
+        else:
+            quad = diagonal[i] + diagonal[j] - 2.0 * q[i, j]
+            delta = (gradient[i] - gradient[j]) / (quad if quad > 0 else 1e-12)
+            total = old_i + old_j
+            new_i, new_j = old_i - delta, old_j + delta
+            if total > bounds[i]:
+                if new_i > bounds[i]:
+                    new_i, new_j = bounds[i], total - bounds[i]
+            elif new_j < 0:
+                new_i, new_j = total, 0.0
+            if total > bounds[j]:
+                if new_j > bounds[j]:
+                    new_i, new_j = total - bounds[j], bounds[j]
+            elif new_i < 0:
+                new_i, new_j = 0.0, total
+        alphas[i], alphas[j] = new_i, new_j
+        gradient += q[i] * (new_i - old_i) + q[j] * (new_j - old_j)
+
+    # rho from the free support vectors (or the middle of the feasible range)
+    signed = y * gradient
+    free = (alphas > 0) & (alphas < bounds)
+    if free.any():
+        rho = signed[free].mean()
+    else:
+        upper = (alphas >= bounds)
+        lower = ~upper & ~free
+        rho = (signed[(upper & (y < 0)) | (lower & (y > 0))].min()
+               + signed[(upper & (y > 0)) | (lower & (y < 0))].max()) / 2.0
+    return alphas, float(-rho)
+
+
+def svm_weight_vector(input_train="SVM_POS_NEG.fasta", cval=1, kernel="cosine"):
+    """
+    Trains the cosine kernel SVM as PyML's SVM(C=C) does (libsvm solver,
+    'classProb' Cmode, see svm_class_costs and svm_smo) and collapses it to
+    a weight vector.
+
+    With the positional 1-mer features (see svm_features) the cosine kernel
+    is linear, so f(x) = sum_i(alpha_i * y_i * K(x_i, x)) + b is w . x / L + b
+    with w = sum_i(alpha_i * y_i * x_i): a weight per residue and position.
+
+    :param input_train: input positive and negative examples used in training
+    :param cval: SVM soft margin constant (C)
+    :param kernel: kernel attached to the training data
+    :return: returns the (L x len(peptide_alphabet) + 1) weights and the bias
+        (numpy, float)
+    """
+
+    if kernel != "cosine":
+        raise ValueError("Only the cosine kernel collapses to a weight vector...")
+
+    peptides, labels = svm_training_data(input_train)
+    encoded = encode_peptides(peptides)
+    if (encoded == len(peptide_alphabet)).any():
+        raise ValueError("Training file %s has residues outside the peptide alphabet." % input_train)
+
+    features = svm_features(encoded)
+    cpos, cneg = svm_class_costs(labels, cval)
+    alphas, bias = svm_smo(features.dot(features.T) / encoded.shape[1], labels, cpos, cneg)
+    weights = (alphas * labels).dot(features)
+    weights = weights.reshape(encoded.shape[1], len(peptide_alphabet) + 1)
+
+    # residues outside peptide_alphabet (one slot per position) were never
+    # seen in training, so they all score 0 like any unseen PyML feature
+    assert not weights[:, len(peptide_alphabet)].any()
+    return weights, bias
+
+
+def svm_load_weights(input_train="SVM_POS_NEG.fasta", cval=1, kernel="cosine"):
+    """
+    Loads the weight vector of the trained SVM, computing and caching it
+    (in the model cache) the first time.
+
+    :param input_train: input positive and negative examples used in training
+    :param cval: SVM soft margin constant (C)
+    :param kernel: kernel attached to the training data
+    :return: returns the weights and bias (numpy, float)
+    """
+
+    global svm_weights
+
+    key = svm_model_key(input_train, cval, kernel)
+    if key in svm_weights:
+        return svm_weights[key]
+
+    weights_svm = cache_file("svm_%s.npz" % key)
+    try:
+        loaded = np.load(weights_svm)
+        weights, bias = loaded["weights"], float(loaded["bias"])
+        if list(loaded["alphabet"]) != peptide_alphabet:
+            raise ValueError("SVM weights were saved for another alphabet.")
+    except Exception:
+        # not cached yet (or unreadable)
+        weights, bias = svm_weight_vector(input_train, cval=cval, kernel=kernel)
+        weights_tmp = "%s.%s.tmp.npz" % (weights_svm[:-4], os.getpid())
+        np.savez(weights_tmp, weights=weights, bias=bias, alphabet=peptide_alphabet)
+        os.rename(weights_tmp, weights_svm)
+
+    svm_weights[key] = (weights, bias)
+    return svm_weights[key]
+
+
+def svm_decision_values(encoded, weights, bias):
+    """
+    Scores encoded peptides with the cosine kernel SVM collapsed to a weight
+    per residue and position (see svm_weight_vector).
+
+    :param encoded: (N x L) uint8 array from encode_peptides
+    :param weights: (L x len(peptide_alphabet) + 1) weights
+    :param bias: SVM bias (b)
+    :return: returns a decision value for each peptide (numpy)
+    """
+
+    if encoded.shape[0] == 0:
+        return np.zeros(0)
+
+    length = encoded.shape[1]
+    if length != weights.shape[0]:
+        raise ValueError("The SVM expects peptides of length %i (got %i)." % (weights.shape[0], length))
+    return weights[np.arange(length), encoded].sum(axis=1) / length + bias
+
+
+def svm_prediction(peptides, job_id=None,
+                   input_train="SVM_POS_NEG.fasta",
+                   encoded=None):
     """
     Makes a final prediction based on SVM training files.
     This code is used for prediciton of blind datasets, based on the training
     datasets of positives and negatives.
 
     :param peptides: input peptides
-    :param job_id: random job id assigned prior to start predicting
+    :param job_id: random job id assigned prior to start predicting (unused)
     :param input_train: input positive and negative examples used in training
+    :param encoded: peptides already encoded with encode_peptides (optional)
     :return: returns SVM scores for each inputed peptide
     """
 
-    print("Begin SVM")
+    with timer("svm", len(peptides)):
+        # cosine kernel SVM collapsed to a weight vector: scored in memory
+        if encoded is None:
+            encoded = encode_peptides(peptides)
+        weights, bias = svm_load_weights(input_train, cval=1, kernel="cosine")
 
-    # from methods import load_sqlite, store_sqlite
+        # query the score cache, then score (and save) the missing peptides
+        model = svm_model_key(input_train, cval=1, kernel="cosine")
+        svm_scores = cached_scores("SVM", model, peptides, encoded,
+                                   lambda batch: svm_decision_values(batch, weights, bias))
+
+    return svm_scores
+
+
+def ann_load_network(input_network="ANN.c"):
+    """
+    Loads the weights and biases of the snns2c generated network (the source
+    of the compiled ./ANN predictor) as dense matrices.
+
+    :param input_network: snns2c C source of the trained network
+    :return: returns the input->hidden weights (hidden x inputs), hidden biases,
+        hidden->output weights (outputs x hidden) and output biases (numpy)
+    """
+
+    import re
 
     global PATH
-    global TMP_PATH
-
-    # suppress SVM output
-    devnull = open(os.devnull, 'w')
-    sys.stdout, sys.stderr = devnull, devnull
-
-    svm_scores = []
-    # query the database
-    # for peptide in peptides:
-    #     try:
-    #         score = load_sqlite(peptide, method="SVM", unique=True)
-    #         svm_scores.append(score)
-    #     except:
-    #         pass
-
-    if len(peptides) == len(svm_scores):
-        pass
-    else:
+    global ann_networks
 
-        # generate a svm input from the peptides
-        rand = job_id
-        input_svm = "%s_svm.fasta" % rand
-        output_tmp = open(os.path.join(TMP_PATH, input_svm), "w")
-
-        count = 0
-        for peptide in peptides:
-            count += 1
-            output_tmp.write("> %i label=%s\n%s\n" % (count, 1, peptide))
-        for peptide in peptides:
-            count += 1
-            output_tmp.write("> %i label=%s\n%s\n" % (count, -1, peptide))
-        output_tmp.close()
-
-        # outputs
-        model_svm = "%s_svm_model.txt" % rand
-
-        # train data
-        train_data = SequenceData(os.path.join(PATH, input_train), mink=1, maxk=1, maxShift=0,
-                                  headerHandler=svm_process_header)
-        train_data.attachKernel('cosine')
-
-        cval = 1
-        s = SVM(C=cval)
-        s.train(train_data)
-        s.save(os.path.join(TMP_PATH, model_svm))
-
-        # load trained SVM
-        loaded_svm = loadSVM(os.path.join(TMP_PATH, model_svm), train_data)
-
-        # test data
-        test_data = SequenceData(os.path.join(TMP_PATH, input_svm), mink=1, maxk=1, maxShift=0,
-                                 headerHandler=svm_process_header)
-        test_data.attachKernel('cosine')
-        results = loaded_svm.test(test_data)
-
-        # print results out
-        output_svm = "%s_svm.txt" % rand
-        results.toFile(os.path.join(TMP_PATH, output_svm))
-
-        # load results process output (positives + negatives)
-        infile = open(os.path.join(TMP_PATH, output_svm), "r")
-        inlines = infile.readlines()
-        infile.close()
-        scores = list()
-        for line in inlines:
-            line = line.rstrip("\r\n")
-            try:
-                entry = int(line.split("\t")[0])
-                score = float(line.split("\t")[1])
-                label = int(line.split("\t")[3])
-                if label != "-1":
-                    scores.append([entry, score])
-            except:
-                pass
-
-        # order list
-        sorted_scores = sorted(scores, key=lambda scores: scores[0])
-
-        svm_scores = list()
-        for score in sorted_scores:
-            svm_score = score[1]
-            svm_scores.append(svm_score)
-
-        # remove the temporary model files and results
-        try:
-            os.remove(os.path.join(TMP_PATH, input_svm))
-            os.remove(os.path.join(TMP_PATH, model_svm))
-            os.remove(os.path.join(TMP_PATH, output_svm))
-        except:
-            pass
-
-        # save the peptides in db
-        # for peptide, score in zip(peptides, svm_scores):
-        #     store_sqlite(peptide, method="SVM", information=score, save=True)
-
-    # restore normal output
-    sys.stdout = sys.__stdout__
-    sys.stderr = sys.__stderr__
-
-    print("End SVM")
-    return svm_scores
+    if input_network in ann_networks:
+        return ann_networks[input_network]
 
+    with open(os.path.join(PATH, input_network), "r") as infile:
+        source = infile.read()
 
-def ann_encoding(aa, method="orthogonal"):
-    """
-    Encoding for ANN files: it is outputted as a csv file.
-
-    :param aa: amino acid
-    :param method: encoding method
-    :return: returns an encoding for each amino acid
-    """
-
-    aa = aa.upper()
-    if method == "orthogonal":
-        if aa in aa_valid:
-            alphabet = dict()
-            alphabet["A"] = "1 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["R"] = "0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["N"] = "0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["D"] = "0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["C"] = "0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["Q"] = "0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["E"] = "0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["G"] = "0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["H"] = "0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["I"] = "0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 "
-            alphabet["L"] = "0 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 "
-            alphabet["K"] = "0 0 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 "
-            alphabet["M"] = "0 0 0 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 "
-            alphabet["F"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 0 "
-            alphabet["P"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 1 0 0 0 0 0 "
-            alphabet["S"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 1 0 0 0 0 "
-            alphabet["T"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 1 0 0 0 "
-            alphabet["W"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 1 0 0 "
-            alphabet["Y"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 1 0 "
-            alphabet["V"] = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 1 "
-            matched = alphabet[aa]
-        else:
-            matched = "0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
-    else:
-        raise ValueError("Please choose one of the available encodings...")
-    return matched
+    def section(name):
+        start = source.index("{", source.index(name)) + 1
+        return source[start:source.index("};", start)]
+
+    sources = [int(unit) for unit in re.findall(r"Units\s*\+\s*(\d+)", section("Sources[]"))]
+    weights = [float(weight) for weight in section("Weights[]").replace(",", " ").split()]
 
+    # unit number, name, bias, number of sources and offset in Sources/Weights
+    units = re.findall(r"/\*\s*unit\s+(\d+)\s+\(([^)]*)\)\s*\*/\s*"
+                       r"([-+.\deE]+)\s*,\s*([-+.\deE]+)\s*,\s*(\d+)\s*,\s*"
+                       r"&Sources\[(\d+)\]\s*,\s*&Weights\[(\d+)\]", source)
+    inputs = [int(unit[0]) for unit in units if unit[1].startswith("Input")]
+    hidden = [unit for unit in units if unit[1].startswith("Hidden")]
+    output = [unit for unit in units if unit[1].startswith("Output")]
+    if not inputs or not hidden or not output:
+        raise ValueError("Could not parse the network in %s." % input_network)
 
-def ann_create_csv_from_peptides(peptides, output_file):
+    def layer(members, previous):
+        index = dict((unit, i) for i, unit in enumerate(previous))
+        matrix = np.zeros((len(members), len(previous)))
+        biases = np.zeros(len(members))
+        for i, (_, _, _, bias, count, source_at, weight_at) in enumerate(members):
+            biases[i] = float(bias)
+            for j in range(int(count)):
+                matrix[i, index[sources[int(source_at) + j]]] = weights[int(weight_at) + j]
+        return matrix, biases
+
+    hidden_weights, hidden_biases = layer(hidden, inputs)
+    output_weights, output_biases = layer(output, [int(unit[0]) for unit in hidden])
+
+    ann_networks[input_network] = (hidden_weights, hidden_biases, output_weights, output_biases)
+    return ann_networks[input_network]
+
+
+def ann_logistic(net):
     """
-    Creates an on the fly csv to load into the /ANN predictor
+    SNNS Act_Logistic activation (sum + bias already added).
 
-    :param peptides: list of peptides (formatted)
-    :param output_file: output file
-    :return: CSV output
+    :param net: net input (numpy)
+    :return: returns the unit activations (numpy)
     """
 
-    outfile = open(output_file, "w")
+    return np.where(net < 10000.0, 1.0 / (1.0 + np.exp(-np.minimum(net, 10000.0))), 0.0)
 
-    for peptide in peptides:
-        encoding = ""
-        for aa in peptide:
-            encoding += ann_encoding(aa, method="orthogonal")
-        outfile.write(encoding + "\n")
 
-    outfile.close()
-    return
+def ann_forward(encoded, input_network="ANN.c"):
+    """
+    Batched forward pass of the ANN (logistic hidden and output layers).
+
+    The network uses an orthogonal (one-hot) encoding with 20 inputs per
+    residue (all zeros for anything but aa_valid), so the input layer is
+    computed as a gather of the input->hidden weights on the encoded
+    residues instead of a product with the one-hot matrix.
+
+    :param encoded: (N x L) uint8 array from encode_peptides
+    :param input_network: snns2c C source of the trained network
+    :return: returns the output activation for each peptide (numpy)
+    """
+
+    hidden_weights, hidden_biases, output_weights, output_biases = ann_load_network(input_network)
+    if encoded.shape[0] == 0:
+        return np.zeros(0)
+
+    length = encoded.shape[1]
+    if length * len(aa_valid) != hidden_weights.shape[1]:
+        raise ValueError("The ANN expects %i inputs per peptide (got %i)."
+                         % (hidden_weights.shape[1], length * len(aa_valid)))
+
+    # (position x residue x hidden) weights, zeros for non aa_valid residues
+    others = len(peptide_alphabet) + 1 - len(aa_valid)
+    weights = hidden_weights.T.reshape(length, len(aa_valid), -1)
+    weights = np.concatenate([weights, np.zeros((length, others, weights.shape[2]))], axis=1)
+
+    net = np.tile(hidden_biases, (encoded.shape[0], 1))
+    for position in range(length):
+        net += weights[position][encoded[:, position]]
+    hidden = ann_logistic(net)
+    output = ann_logistic(hidden.dot(output_weights.T) + output_biases)
+    return output[:, 0]
 
 
-def ann_prediction(peptides, job_id):
+def ann_prediction(peptides, job_id=None, encoded=None):
     """
     Makes a final prediction based on ANN training files.
     This code is used for prediciton of blind datasets, based on the training
     datasets of positives and negatives.
 
     :param peptides: input peptides
-    :param job_id: random job id assigned prior to start predicting
+    :param job_id: random job id assigned prior to start predicting (unused)
+    :param encoded: peptides already encoded with encode_peptides (optional)
     :return: returns ANN scores for each inputed peptide
     """
 
-    print("Begin ANN")
+    with timer("ann", len(peptides)):
+        # [-6:4] => 10 * 20 inputs
+        if encoded is None:
+            encoded = encode_peptides(peptides)
 
-    # from methods import load_sqlite, store_sqlite
+        # query the score cache, then score (and save) the missing peptides
+        model = training_checksum(os.path.join(PATH, "ANN.c"))
+        ann_scores = cached_scores("ANN", model, peptides, encoded, ann_forward)
 
-    global TMP_PATH
+    return ann_scores
 
-    ann_scores = []
-    # query the database
-    # for peptide in peptides:
-    #     try:
-    #         score = load_sqlite(peptide, method="ANN", unique=True)
-    #         ann_scores.append(score)
-    #     except:
-    #         pass
 
-    if len(peptides) == len(ann_scores):
-        pass
-    else:
+def load_models(methods=("ann", "pssm", "svm")):
+    """
+    Loads the ANN, PSSM and SVM models in this process (trained and cached
+    the first time). Used to initialise each worker of a process pool once.
 
-        # generate a ann input from the peptides
-        rand = job_id
-        input_ann = "%s_ann.csv" % rand
-        ann_create_csv_from_peptides(peptides, os.path.join(TMP_PATH, input_ann))
-
-        # run "prediciton" for positives and negatives
-        output_ann = "%s_ann.txt" % rand
-        # [-6:4] => 10 * 20
-        len_motif = 200
-        len_peptides = len(peptides)
-        cmd = str("%s %s %s < %s > %s" % (os.path.join(PATH, "ANN"), len_motif, len_peptides,
-                                              os.path.join(TMP_PATH, input_ann),
-                                              os.path.join(TMP_PATH, output_ann)))
-        os.system(cmd)
-
-        # process output (positives + negatives)
-        infile = open(os.path.join(TMP_PATH, output_ann), "r")
-        inlines = infile.readlines()
-        infile.close()
-
-        ann_scores = list()
-        number = len(peptides)
-        count = 0
-        for line in inlines:
-            count += 1
-            if count <= number:
-                ann_score = line.rstrip("\r\n")
-                ann_scores.append(ann_score)
-
-        # remove the temporary model files and results
-        try:
-            os.remove(os.path.join(TMP_PATH, input_ann))
-            os.remove(os.path.join(TMP_PATH, output_ann))
-            pass
-        except:
-            pass
-
-        # save the peptides in db
-        # for peptide, score in zip(peptides, ann_scores):
-        #     store_sqlite(peptide, method="ANN", information=score, save=True)
-
-    print("End ANN")
-    return ann_scores
+    :param methods: methods whose models are loaded
+    :return: returns None
+    """
+
+    if "ann" in methods:
+        ann_load_network()
+    if "pssm" in methods:
+        pssm_load_matrices()
+    if "svm" in methods:
+        svm_load_weights()
+    return
+
+
+def models_version(methods=("ann", "pssm", "svm")):
+    """
+    Gets the version of the selected models: the keys of their training
+    data (e.g. stored predictions are stale once it changes).
+
+    :param methods: selected methods
+    :return: returns a version (str)
+    """
+
+    keys = []
+    if "ann" in methods:
+        keys.append("ann=%s" % training_checksum(os.path.join(PATH, "ANN.c")))
+    if "pssm" in methods:
+        keys.append("pssm=%s" % pssm_model_key())
+    if "svm" in methods:
+        keys.append("svm=%s" % svm_model_key())
+    return ";".join(keys)
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
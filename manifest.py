@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""
+Skip-if-done manifests of the predictors' outputs.
+
+A manifest (manifest.db, SQLite) is kept per tool in its output directory,
+with an entry per record: the hash of the input sequence, the version of
+the tool/models and the checksum of each output file. A record is done
+(and skipped on a rerun) only if its entry matches the sequence and the
+version and all its outputs (at least one) are present and unchanged. Entries are saved
+as soon as a record is done, so an interrupted run resumes where it
+stopped.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+
+from time import strftime
+
+
+def sequence_hash(sequence):
+    """
+    Gets the hash of an input sequence.
+
+    :param sequence: protein sequence (str or Bio.Seq)
+    :return: SHA1 hex digest of the (uppercase) sequence
+    """
+    return hashlib.sha1(str(sequence).upper().encode('ascii')).hexdigest()
+
+
+def file_checksum(filename):
+    """
+    Gets the checksum of an output file.
+
+    :param filename: path to the file
+    :return: SHA1 hex digest of the file contents (None if missing)
+    """
+    if not os.path.isfile(filename):
+        return None
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def open_manifest(output_dir, name='manifest.db'):
+    """
+    Opens (or creates) the manifest of an output directory.
+
+    :param output_dir: output directory of a tool
+    :param name: manifest filename
+    :return: SQLite connection
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    connection = sqlite3.connect(os.path.join(output_dir, name))
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS records ("
+                       "Identifier TEXT PRIMARY KEY, Hash TEXT, Version TEXT, "
+                       "Outputs TEXT, Updated TEXT) WITHOUT ROWID")
+    connection.commit()
+    return connection
+
+
+def is_done(connection, output_dir, identifier, seq_hash, version, outputs):
+    """
+    Checks whether a record's outputs are present and consistent with the
+    manifest.
+
+    :param connection: manifest (see open_manifest)
+    :param output_dir: output directory of the tool
+    :param identifier: record identifier
+    :param seq_hash: input sequence hash (see sequence_hash)
+    :param version: tool/models version
+    :param outputs: expected output filenames (relative to output_dir)
+    :return: True if the record can be skipped (never if it has no outputs
+        to check)
+    """
+    if not outputs:
+        return False
+    row = connection.execute("SELECT Hash, Version, Outputs FROM records WHERE Identifier = ?",
+                             (identifier,)).fetchone()
+    if row is None or row[0] != seq_hash or row[1] != version:
+        return False
+    checksums = json.loads(row[2])
+    for output in outputs:
+        if checksums.get(output) is None:
+            return False
+        if file_checksum(os.path.join(output_dir, output)) != checksums[output]:
+            return False
+    return True
+
+
+def record_done(connection, output_dir, identifier, seq_hash, version, outputs):
+    """
+    Records the outputs of a record in the manifest (saved immediately).
+
+    :param connection: manifest (see open_manifest)
+    :param output_dir: output directory of the tool
+    :param identifier: record identifier
+    :param seq_hash: input sequence hash (see sequence_hash)
+    :param version: tool/models version
+    :param outputs: output filenames (relative to output_dir)
+    :return: None
+    """
+    checksums = {output: file_checksum(os.path.join(output_dir, output)) for output in outputs}
+    connection.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                       (identifier, seq_hash, version, json.dumps(checksums, sort_keys=True),
+                        strftime("%Y-%m-%dT%H:%M:%S")))
+    connection.commit()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+NOD results files (COMPLETE format): one or more records, each one
+starting with the FASTA header of its sequence. Records are streamed one
+at a time, either as their raw lines (e.g. to split the output of a batch
+run into a file per record) or parsed (NodResult).
+"""
+
+import numpy as np
+
+from array import array
+from collections import namedtuple
+
+NodResult = namedtuple('NodResult', ['identifier', 'sequence', 'segment_ranges', 'segments', 'scores'])
+
+
+def iter_nod_records(prediction_results_file):
+    """
+    Stream the raw records of a NOD results file.
+
+    :param prediction_results_file: NOD results file
+    :return: yields (identifier, line number of the header, lines) per
+        record; the identifier is the first word of the FASTA header and
+        the lines (header included) keep their line endings
+    """
+    identifier = None
+    start = None
+    lines = []
+    with open(prediction_results_file) as results:
+        for number, line in enumerate(results, start=1):
+            if line.startswith('>'):
+                if identifier is not None:
+                    yield identifier, start, lines
+                identifier = line[1:].split()[0] if line[1:].strip() else ''
+                start = number
+                lines = []
+            elif identifier is None:
+                if line.strip():
+                    raise ValueError('Could not parse NOD results file: no FASTA header before '
+                                     'line {}.'.format(number))
+                continue
+            lines.append(line)
+    if identifier is not None:
+        yield identifier, start, lines
+
+
+def parse_nod_record(identifier, start, lines):
+    """
+    Parse a raw NOD record (see iter_nod_records).
+
+    A record is complete once it has its result line ("No NOLS detected" or
+    "NOLS_segment_number: <n>", the latter followed by n segment positions
+    and sequences): an empty record (header only) or a record truncated
+    before its result is rejected.
+
+    :param identifier: record identifier
+    :param start: line number of the header in the results file
+    :param lines: lines of the record (header included)
+    :return: NodResult: identifier, sequence, segment_ranges (int32 array of
+        1-based inclusive [start, end] rows), segments (sequences) and scores
+        (float32 array of per-residue scores)
+    """
+    sequence = []
+    ranges = []
+    segments = []
+    scores = array('f')
+    header = True
+    segment_number = None
+    for number, line in enumerate(lines[1:], start=start + 1):
+        line = line.strip()
+        try:
+            if line == '':
+                continue
+            elif line == 'No NOLS detected':
+                header = False
+                segment_number = 0
+            elif line.startswith('NOLS_segment_number'):
+                header = False
+                segment_number = int(line.split(':', 1)[1])
+            elif line.startswith('NOLS_segments_positions'):
+                for site_range in line.split(':', 1)[1].split(','):
+                    site_range = [int(x) for x in site_range.strip().split('-')]
+                    if len(site_range) != 2:
+                        raise ValueError(site_range)
+                    ranges.extend(site_range)
+            elif line.startswith('NOLS_segments'):
+                segments = [segment.strip() for segment in line.split(':', 1)[1].split(',')]
+            elif header and line.isalpha():
+                sequence.append(line)
+            else:
+                scores.append(float(line))
+        except ValueError:
+            raise ValueError('Could not parse NOD results file: line {} ({}).'.format(number, line))
+
+    if segment_number is None:
+        raise ValueError('Could not parse NOD results file: record {} (line {}) is empty or '
+                         'truncated.'.format(identifier, start))
+    if len(ranges) != 2 * segment_number or (segment_number and len(segments) != segment_number):
+        raise ValueError('Could not parse NOD results file: record {} (line {}) has {} segments but {} '
+                         'positions and {} sequences.'.format(identifier, start, segment_number,
+                                                              len(ranges) // 2, len(segments)))
+
+    return NodResult(identifier, ''.join(sequence), np.array(ranges, dtype=np.int32).reshape(-1, 2),
+                     segments, np.array(scores, dtype=np.float32))
+
+
+def iter_nod_results(prediction_results_file):
+    """
+    Stream the parsed records of a NOD results file (e.g. the output of a
+    batch run).
+
+    :param prediction_results_file: NOD results file
+    :return: yields a NodResult per record (see parse_nod_record)
+    """
+    for identifier, start, lines in iter_nod_records(prediction_results_file):
+        yield parse_nod_record(identifier, start, lines)
@@ -7,28 +7,91 @@
 
 
 # 14-3-3-Pred downloaded from: https://github.com/bartongroup/FM_14-3-3/www1433/app
-# python2.7 prediction.py -i ./test.fasta -o ./
+# python prediction.py -i ./test.fasta -o ./ (or in-process: prediction.predict)
 
 
 # Jpred downloaded from: http://www.compbio.dundee.ac.uk/jpred/api.shtml#download
 # perl jpredapi submit mode=single format=fasta email=funpdbe@dundee.ac.uk file=test.fasta name=test
+# (same REST requests made in-process: jpred.JPredClient)
 
 """
 
 import os
 import sys
-import time
+import shutil
 import click
 import logging
-import requests
 import textwrap
 import click_log
+import tempfile
 from Bio import SeqIO
-from subprocess import Popen
+from concurrent.futures import as_completed
+from executor import command_pool, summarise
+from jpred import JPRED_URL, MAX_WAIT, JPredClient, schedule_jobs
+from manifest import sequence_hash, open_manifest, is_done, record_done
+from nod_results import iter_nod_records, parse_nod_record
 
 nod_jar = os.path.join('lib', 'NOD', 'clinod-1.3.jar')
-pred1433_python = os.path.join('lib', '1433pred', 'prediction.py')
-jpred_perl = os.path.join('lib', 'Jpred', 'jpredapi')
+pred1433_lib = os.path.join(os.path.dirname(__file__), 'lib', '1433pred')
+
+# tool versions recorded in the manifests (outputs are redone if changed)
+nod_version = '{} -f=COMPLETE'.format(os.path.basename(nod_jar))
+jpred_version = 'jpred4'
+
+
+def write_input_sequence(record):
+    """
+    Writes a sequence per file (data/input/<id>.fasta), unless the file
+    already holds the same sequence.
+
+    :param record: Biopython SeqRecord
+    :return: path to the FASTA file
+    """
+    input_seq = os.path.join(os.path.dirname(__file__),
+                             'data', 'input', '{}.fasta'.format(record.id))
+
+    if os.path.exists(input_seq):
+        try:
+            if sequence_hash(SeqIO.read(input_seq, 'fasta').seq) == sequence_hash(record.seq):
+                return input_seq
+        except ValueError:
+            pass
+
+    # renamed into place once written
+    input_tmp = '{}.{}.tmp'.format(input_seq, os.getpid())
+    with open(input_tmp, 'w') as output:
+        seq = '\n'.join(textwrap.wrap(str(record.seq), width=60))
+        output.write(">{}\n{}\n".format(record.id, seq))
+    os.rename(input_tmp, input_seq)
+    return input_seq
+
+
+def split_nod_output(nod_file, output_dir):
+    """
+    Splits a multi-record NOD output (COMPLETE format) into a .nod file per
+    record (<id>.nod, named after the record's FASTA header). Empty or
+    truncated records (see nod_results.parse_nod_record) are logged and not
+    written, so they are not recorded as done either.
+
+    :param nod_file: NOD output of a batch of records
+    :param output_dir: output directory
+    :return: list of record identifiers written
+    """
+    identifiers = []
+    for identifier, start, lines in iter_nod_records(nod_file):
+        try:
+            parse_nod_record(identifier, start, lines)
+        except ValueError as e:
+            logging.error("Skipping the NOD output of {}: {}".format(identifier, e))
+            continue
+        # renamed into place once written
+        output_nod = os.path.join(output_dir, '{}.nod'.format(identifier))
+        output_tmp = '{}.{}.tmp'.format(output_nod, os.getpid())
+        with open(output_tmp, 'w') as output:
+            output.writelines(lines)
+        os.rename(output_tmp, output_nod)
+        identifiers.append(identifier)
+    return identifiers
 
 
 # main application
@@ -43,178 +106,260 @@ def main():
 @click.option('-l', '--log', default=sys.stderr,
               help="Path to the logfile.",
               type=click.File('wb'))
+@click.option('-c', '--chunk-size', default=100, type=int,
+              help="Number of records run by one NOD (java) process.")
+@click.option('-j', '--jobs', default=4, type=int,
+              help="Number of NOD (java) processes run at once.")
+@click.option('--timeout', default=None, type=float,
+              help="Seconds after which a NOD process is killed.")
+@click.option('--report', default=None, type=click.Path(),
+              help="JSON report of each process (exit code, duration and stderr).")
+@click.option('--force', is_flag=True, default=False,
+              help="Rerun the records already done (see manifest.db).")
 @click.argument('input',
                 type=click.File('r'), required=True)
 # @click.argument('output',
 #                 type=click.File('w'), required=False)
 @click_log.simple_verbosity_option(default="INFO")
-def nod(input, log):
+def nod(input, log, chunk_size, jobs, timeout, report, force):
     logging.basicConfig(stream=log,
                         format='%(asctime)s - %(levelname)s - %(message)s ')
 
-    # process input
-    seqs = SeqIO.parse(input, "fasta")
-    for i, record in enumerate(seqs):
-        seq = record.seq
-        pid = record.id
-        print(i + 1, pid)
+    output_dir = os.path.join(os.path.dirname(__file__), 'data', 'output', 'NOD')
+    manifest = open_manifest(output_dir)
 
-        # write a sequence per file
-        input_seq = os.path.join(os.path.dirname(__file__),
-                                 'data', 'input', '{}.fasta'.format(pid))
-        output_nod = os.path.join(os.path.dirname(__file__),
-                                  'data', 'output', 'NOD', '{}.nod'.format(pid))
+    # chunks of records are run by one java process each (multi-FASTA in,
+    # COMPLETE output split back into a .nod file per record)
+    chunks_dir = tempfile.mkdtemp(prefix='nod_')
+    chunks = []
+    running = {}
+    results = []
 
-        if not os.path.exists(input_seq):
-            output = open(input_seq, 'w')
-            seq = '\n'.join(textwrap.wrap(str(seq), width=60))
-            output.write(">{}\n{}\n".format(pid, seq))
-            output.close()
+    def run_chunk(submit):
+        chunk_fasta = os.path.join(chunks_dir, 'chunk_{}.fasta'.format(len(running) + 1))
+        chunk_nod = os.path.join(chunks_dir, 'chunk_{}.nod'.format(len(running) + 1))
+        with open(chunk_fasta, 'w') as output:
+            for record, _ in chunks:
+                seq = '\n'.join(textwrap.wrap(str(record.seq), width=60))
+                output.write(">{}\n{}\n".format(record.id, seq))
 
         cmd = ['java', '-jar', nod_jar,
-               '-in={}'.format(input_seq),
-               '-out={}'.format(output_nod),
+               '-in={}'.format(chunk_fasta),
+               '-out={}'.format(chunk_nod),
                '-f=COMPLETE']
-        Popen(cmd)
+        name = ','.join(record.id for record, _ in chunks)
+        running[submit(name, cmd)] = (list(chunks), chunk_nod)
+        del chunks[:]
+
+    try:
+        # at most `jobs` java processes at once, each one waited for
+        with command_pool(jobs=jobs, timeout=timeout) as submit:
+            # process input
+            seqs = SeqIO.parse(input, "fasta")
+            for i, record in enumerate(seqs):
+                pid = record.id
+                seq_hash = sequence_hash(record.seq)
+                outputs = ['{}.nod'.format(pid)]
+                if not force and is_done(manifest, output_dir, pid, seq_hash, nod_version, outputs):
+                    logging.info("Skipping {}: outputs are up to date.".format(pid))
+                    continue
+                print(i + 1, pid)
+
+                chunks.append((record, seq_hash))
+                if len(chunks) >= chunk_size:
+                    run_chunk(submit)
+            if chunks:
+                run_chunk(submit)
+
+            # split the outputs and record the finished records in the manifest
+            for future in as_completed(running):
+                records, chunk_nod = running[future]
+                result = future.result()
+                results.append(result)
+                done = []
+                if result.returncode == 0 and os.path.exists(chunk_nod):
+                    try:
+                        done = split_nod_output(chunk_nod, output_dir)
+                    except ValueError as e:
+                        logging.error("Could not split the NOD output of {}: {}".format(result.name, e))
+                for record, seq_hash in records:
+                    if record.id in done:
+                        record_done(manifest, output_dir, record.id, seq_hash, nod_version,
+                                    ['{}.nod'.format(record.id)])
+                    else:
+                        logging.error("NOD failed for {}.".format(record.id))
+    finally:
+        shutil.rmtree(chunks_dir, ignore_errors=True)
+
+    summarise(results, report)
 
 
 @main.command('1433pred')
 @click.option('-l', '--log', default=sys.stderr,
               help="Path to the logfile.",
               type=click.File('wb'))
+@click.option('-j', '--jobs', default=1, type=int,
+              help="Number of worker processes.")
+@click.option('-f', '--formats', default='csv,tsv,json,full,fa,feat',
+              help="Per-sequence output formats, comma separated "
+                   "(any of csv, tsv, json, full, fa, feat, or none).")
+@click.option('-d', '--dataset', default=None, type=click.Path(),
+              help="Consolidated dataset of all the sites (.parquet or .tsv).")
+@click.option('-m', '--methods', default='ann,pssm,svm,consensus',
+              help="Methods to run, comma separated (any of ann, pssm, svm, consensus).")
+@click.option('-t', '--timings', default=None, type=click.Path(),
+              help="JSON summary of the time spent in each stage.")
+@click.option('--force', is_flag=True, default=False,
+              help="Rerun the records already done (see manifest.db; "
+                   "always the case with --dataset).")
 @click.argument('input',
                 type=click.File('r'), required=True)
-@click.argument('pred1433_python_bin', type=click.Path(exists=True), default='/usr/bin/python')
+# deprecated: 14-3-3-Pred used to run as `<python> prediction.py` per record
+@click.argument('pred1433_python_bin', type=click.Path(), required=False, default=None)
 # @click.argument('output',
 #                 type=click.File('w'), required=False)
 @click_log.simple_verbosity_option(default="INFO")
-def pred1433(input, log, pred1433_python_bin):
+def pred1433(input, log, jobs, formats, dataset, methods, timings, force, pred1433_python_bin):
     logging.basicConfig(stream=log,
                         format='%(asctime)s - %(levelname)s - %(message)s ')
+    if pred1433_python_bin is not None:
+        logging.warning("Ignoring {}: the pred1433_python_bin argument is deprecated, 14-3-3-Pred now "
+                        "runs in-process.".format(pred1433_python_bin))
 
     # process input
-    seqs = SeqIO.parse(input, "fasta")
+    seqs = list(SeqIO.parse(input, "fasta"))
+
+    # 14-3-3-Pred runs in-process: models are loaded once for all the records
+    sys.path.insert(0, pred1433_lib)
+    from methods import prefetch_uniprot, timer, write_timings
+    from predictor import models_version
+    from prediction import (get_identifier, get_formats, get_methods, iter_predictions, write_results,
+                            dataset_writer, write_error_log)
+
+    output_1433pred = os.path.join(os.path.dirname(__file__),
+                                   'data', 'output', '1433pred')
+    manifest = open_manifest(output_1433pred)
+
+    # outputs depend on the models, the methods run and the formats
+    # requested (the features file is written to a temporary directory)
+    try:
+        formats = get_formats(formats.split(','))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--formats'")
+    methods = get_methods(methods.split(','))
+    version = '{};methods={};formats={}'.format(models_version(methods), ','.join(methods),
+                                                ','.join(sorted(formats)) or 'none')
+
+    records = []
+    entries = []
     for i, record in enumerate(seqs):
         seq = record.seq
         pid = record.id
-        print(i + 1, pid)
-
-        # write a sequence per file
-        input_seq = os.path.join(os.path.dirname(__file__),
-                                 'data', 'input', '{}.fasta'.format(pid))
-        output_1433pred = os.path.join(os.path.dirname(__file__),
-                                       'data', 'output', '1433pred')
 
-        if not os.path.exists(input_seq):
-            output = open(input_seq, 'w')
-            seq = '\n'.join(textwrap.wrap(str(seq), width=60))
-            output.write(">{}\n{}\n".format(pid, seq))
-            output.close()
+        if len(seq) < 30:
+            logging.warning("Skipping {}: sequence too short (<30 amino acids).".format(pid))
+            continue
+
+        # the dataset is rewritten as a whole, so every record is scored
+        seq_hash = sequence_hash(seq)
+        outputs = ['{}.{}'.format(pid, extension) for extension in formats
+                   if extension in ('csv', 'tsv', 'json', 'full', 'fa')]
+        if not force and dataset is None and \
+                is_done(manifest, output_1433pred, pid, seq_hash, version, outputs):
+            logging.info("Skipping {}: outputs are up to date.".format(pid))
+            continue
+        print(i + 1, pid)
 
-        cmd = [pred1433_python_bin, pred1433_python,
-               '-i', input_seq, '-o', output_1433pred]
-        # Popen(cmd)
-        os.system(' '.join(cmd))
+        records.append(record)
+        entries.append((seq_hash, outputs))
+
+    def on_error(count, identifier, error):
+        # logged per record (<id>.log) and the other records carry on
+        pid = records[count - 1].id
+        logging.error("14-3-3-Pred failed for {}: {}".format(pid, error))
+        write_error_log(error, output_1433pred, pid, pid)
+
+    # fill the local UniProt cache (phospho sites) for the whole input at once
+    with timer("uniprot", len(records)):
+        prefetch_uniprot([get_identifier(record) for record in records])
+
+    # results come back in input order (models are loaded once per worker);
+    # each record is checkpointed in the manifest once its outputs are written
+    with dataset_writer(dataset) as write_dataset:
+        for result in iter_predictions(records, jobs=jobs, methods=methods, on_error=on_error):
+            pid = records[result['Count'] - 1].id
+            seq_hash, outputs = entries[result['Count'] - 1]
+            try:
+                write_results(result, output_1433pred, pid, formats=formats)
+            except Exception as e:
+                on_error(result['Count'], result['Identifier'], e)
+                continue
+            write_dataset(result)
+            record_done(manifest, output_1433pred, pid, seq_hash, version, outputs)
+
+    if timings is not None:
+        write_timings(timings, input=input.name, jobs=jobs, methods=methods)
 
 
 @main.command('jpred')
 @click.option('-l', '--log', default=sys.stderr,
               help="Path to the logfile.",
               type=click.File('wb'))
+@click.option('-j', '--jobs', default=5, type=int,
+              help="Number of Jpred jobs running at once.")
+@click.option('--max-interval', default=300, type=float,
+              help="Maximum seconds between status checks of a job.")
+@click.option('--max-wait', default=MAX_WAIT, type=float,
+              help="Seconds after its submission at which a job still running has failed.")
+@click.option('--url', default=JPRED_URL,
+              help="Jpred server (e.g. a local stand-in).")
+@click.option('--timeout', default=60, type=float,
+              help="Seconds after which a request to the Jpred server is abandoned.")
+@click.option('--force', is_flag=True, default=False,
+              help="Rerun the records already done (see manifest.db).")
 @click.argument('input',
                 type=click.File('r'), required=True)
 # @click.argument('output',
 #                 type=click.File('w'), required=False)
 @click_log.simple_verbosity_option(default="INFO")
-def jpred(input, log):
+def jpred(input, log, jobs, max_interval, max_wait, url, timeout, force):
     logging.basicConfig(stream=log,
                         format='%(asctime)s - %(levelname)s - %(message)s ')
 
+    output_jpred = os.path.join(os.path.dirname(__file__),
+                                'data', 'output', 'Jpred')
+    manifest = open_manifest(output_jpred)
+
     # process input
     seqs = SeqIO.parse(input, "fasta")
+    records = []
     for i, record in enumerate(seqs):
-        seq = record.seq
         pid = record.id
+        seq_hash = sequence_hash(record.seq)
+        outputs = ['{}.jnet'.format(pid), '{}.tar.gz'.format(pid)]
+        if not force and is_done(manifest, output_jpred, pid, seq_hash, jpred_version, outputs):
+            logging.info("Skipping {}: outputs are up to date.".format(pid))
+            continue
         print(i + 1, pid)
 
         # write a sequence per file
-        input_seq = os.path.join(os.path.dirname(__file__),
-                                 'data', 'input', '{}.fasta'.format(pid))
-        output_jpred = os.path.join(os.path.dirname(__file__),
-                                    'data', 'output', 'Jpred')
-
-        output_jpred_jnet = os.path.join(os.path.dirname(__file__),
-                                         'data', 'output', 'Jpred',
-                                         '{}.jnet'.format(pid))
-
-        output_jpred_tar = os.path.join(os.path.dirname(__file__),
-                                        'data', 'output', 'Jpred',
-                                        '{}.tar.gz'.format(pid))
-
-        if not os.path.exists(input_seq):
-            output = open(input_seq, 'w')
-            seq = '\n'.join(textwrap.wrap(str(seq), width=60))
-            output.write(">{}\n{}\n".format(pid, seq))
-            output.close()
-
-        cmd = ['perl', jpred_perl, 'submit', 'mode=single', 'format=fasta',
-               'email=funpdbe@dundee.ac.uk',
-               'file={}'.format(input_seq), 'name={}'.format(pid),
-               '>', os.path.join(output_jpred, '{}.log'.format(pid))]
-        # Popen(cmd)
-        os.system(' '.join(cmd))
-
-        # parse Jpred job id
-        jobid = ""
-        with open(os.path.join(output_jpred, '{}.log'.format(pid)), 'r') as lines:
-            for line in lines:
-                if line.startswith("Created JPred job with jobid: "):
-                    jobid = line.strip().split()[-1]
-
-        finished = False
-        while not finished:
-
-            # check job status
-            cmd = ['perl', jpred_perl, 'status', 'jobid={}'.format(jobid), 'getResults=no',
-                   'checkEvery=once', 'silent', 'email=funpdbe@dundee.ac.uk',
-                   '>', os.path.join(output_jpred, '{}.status.log'.format(pid))]
-            # Popen(cmd)
-            os.system(' '.join(cmd))
-
-            # parse job status
-            jobstatus = ""
-
-            with open(os.path.join(output_jpred, '{}.status.log'.format(pid)), 'r') as lines:
-                for line in lines:
-                    if "Results available at the following URL:" in line:
-                        jobstatus = "Job finished"
-                    elif "ERROR" in line:
-                        jobstatus = "Job failed"
-
-            if jobstatus == "Job finished":
-                finished = True
-
-                # get results: jnet
-                jpred_url = "http://www.compbio.dundee.ac.uk/jpred4/results"
-                jpred_url_full = "{}/{}/{}.jnet".format(jpred_url, jobid, jobid)
-                with open(output_jpred_jnet, "wb") as outfile:
-                    r = requests.get(url=jpred_url_full)
-                    outfile.write(r.content)
-
-                # get results: tar.gz
-                jpred_url = "http://www.compbio.dundee.ac.uk/jpred4/results"
-                jpred_url_full = "{}/{}/{}.tar.gz".format(jpred_url, jobid, jobid)
-                with open(output_jpred_tar, "wb") as outfile:
-                    r = requests.get(url=jpred_url_full)
-                    outfile.write(r.content)
-
-            elif jobstatus == "Job failed":
-                finished = True
-                print("Jpred job {} has errored. See {} for more details"
-                      "".format(jobid, os.path.join(output_jpred, '{}.status.log'.format(pid))))
-
-            # sleep 30 seconds
-            time.sleep(30)
+        input_seq = write_input_sequence(record)
+        records.append((pid, input_seq, seq_hash))
+
+    def on_done(pid, seq_hash, finished):
+        if finished:
+            record_done(manifest, output_jpred, pid, seq_hash, jpred_version,
+                        ['{}.jnet'.format(pid), '{}.tar.gz'.format(pid)])
+
+    # submitted jobs are kept in jobs.json until done (resumed by the next run)
+    client = JPredClient(url=url, timeout=timeout)
+    outcome = schedule_jobs(records, client, output_jpred, os.path.join(output_jpred, 'jobs.json'),
+                            max_jobs=jobs, max_interval=max_interval, max_wait=max_wait,
+                            on_done=on_done)
+
+    finished = sum(1 for state in outcome.values() if state == 'finished')
+    logging.info("{} Jpred jobs: {} finished, {} failed".format(len(outcome), finished,
+                                                                len(outcome) - finished))
 
 
 if __name__ == "__main__":
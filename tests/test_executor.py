@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from executor import command_pool, run_command, summarise
+
+SLEEP = [sys.executable, '-c', 'import time; time.sleep(30)']
+FAIL = [sys.executable, '-c', 'import sys; sys.stderr.write("no input"); sys.exit(3)']
+ECHO = [sys.executable, '-c', 'print("done")']
+
+
+class TestRunCommand(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='executor_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_success(self):
+        stdout_file = os.path.join(self.output_dir, 'echo.out')
+        result = run_command('echo', ECHO, timeout=30, stdout_file=stdout_file)
+        self.assertEqual((result.name, result.returncode, result.timed_out), ('echo', 0, False))
+        with open(stdout_file) as infile:
+            self.assertEqual(infile.read().strip(), 'done')
+
+    def test_timeout(self):
+        start = time.time()
+        result = run_command('sleep', SLEEP, timeout=0.5)
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertTrue(0.5 <= result.duration < 10)
+        self.assertLess(time.time() - start, 10)
+
+    def test_non_zero_exit(self):
+        result = run_command('fail', FAIL, timeout=30)
+        self.assertEqual((result.returncode, result.timed_out), (3, False))
+        self.assertEqual(result.stderr, 'no input')
+
+    def test_not_started(self):
+        result = run_command('missing', [os.path.join(self.output_dir, 'missing')])
+        self.assertIsNone(result.returncode)
+        self.assertFalse(result.timed_out)
+        self.assertTrue(result.stderr)
+
+
+class TestCommandPool(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='executor_')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_summarise(self):
+        with command_pool(jobs=2, timeout=0.5) as submit:
+            futures = [submit('echo_1', ECHO), submit('sleep', SLEEP), submit('fail', FAIL),
+                       submit('echo_2', ECHO)]
+        results = [future.result() for future in futures]
+        self.assertEqual([result.name for result in results], ['echo_1', 'sleep', 'fail', 'echo_2'])
+        self.assertEqual([result.timed_out for result in results], [False, True, False, False])
+
+        report = os.path.join(self.output_dir, 'report.json')
+        with self.assertLogs(level='INFO') as logs:
+            summary = summarise(results, report)
+        self.assertEqual(dict((key, summary[key]) for key in ('commands', 'succeeded', 'failed', 'timed_out')),
+                         {'commands': 4, 'succeeded': 2, 'failed': 2, 'timed_out': 1})
+        self.assertGreaterEqual(summary['seconds_max'], 0.5)
+        self.assertGreaterEqual(summary['seconds_total'], summary['seconds_max'])
+
+        errors = [line for line in logs.output if line.startswith('ERROR')]
+        self.assertEqual(len(errors), 2)
+        self.assertIn('sleep failed (timed out)', errors[0])
+        self.assertIn('fail failed (exit code 3)', errors[1])
+        self.assertIn('no input', errors[1])
+
+        with open(report) as infile:
+            written = json.load(infile)
+        self.assertEqual(written['summary'], summary)
+        self.assertEqual([command['returncode'] for command in written['commands']],
+                         [result.returncode for result in results])
+
+    def test_summarise_nothing(self):
+        with self.assertLogs(level='INFO'):
+            summary = summarise([])
+        self.assertEqual((summary['commands'], summary['failed'], summary['seconds_max']), (0, 0, 0.0))
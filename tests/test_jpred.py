@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from jpred import JobStatus, JPredClient, job_name, save_jobs, schedule_jobs
+
+
+class FakeClock(object):
+    """
+    Clock that only moves when slept on.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeClient(object):
+    """
+    JPred client whose jobs finish after a number of polls (None: never).
+    Submissions, polls (with their time) and downloads are recorded.
+    """
+
+    def __init__(self, clock, polls=None, default_polls=2, fail_submit=()):
+        self.clock = clock
+        self.polls = polls or {}
+        self.default_polls = default_polls
+        self.fail_submit = fail_submit
+        self.submitted = []
+        self.polled = {}
+        self.names = {}
+        self.running = 0
+        self.max_running = 0
+
+    def submit(self, input_seq, name):
+        if name in self.fail_submit:
+            return None
+        jobid = 'jp_{}'.format(name)
+        self.submitted.append(name)
+        self.names[jobid] = name
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        return jobid
+
+    def status(self, jobid):
+        self.polled.setdefault(jobid, []).append(self.clock.time())
+        polls = self.polls.get(self.names.get(jobid, jobid), self.default_polls)
+        if polls is None or len(self.polled[jobid]) < polls:
+            return JobStatus(jobid, 'running', 'Job {} is running'.format(jobid))
+        self.running -= 1
+        return JobStatus(jobid, 'finished', 'Job {} finished'.format(jobid))
+
+    def results(self, jobid, extension, output_file):
+        with open(output_file, 'w') as output:
+            output.write('{}.{}\n'.format(jobid, extension))
+        return True
+
+
+class TestScheduleJobs(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='jpred_')
+        self.state_file = os.path.join(self.output_dir, 'jobs.json')
+        self.clock = FakeClock()
+        self.done = []
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def schedule(self, client, records, **kwargs):
+        return schedule_jobs(records, client, self.output_dir, self.state_file,
+                             on_done=lambda *args: self.done.append(args),
+                             sleep=self.clock.sleep, clock=self.clock.time, **kwargs)
+
+    def test_at_most_max_jobs_running(self):
+        records = [('seq{}'.format(i), 'seq{}.fasta'.format(i), 'hash{}'.format(i)) for i in range(7)]
+        client = FakeClient(self.clock, polls={'seq0': 5, 'seq3': 1})
+        outcome = self.schedule(client, records, max_jobs=3)
+
+        self.assertEqual(outcome, dict((name, 'finished') for name, _, _ in records))
+        self.assertEqual(client.max_running, 3)
+        self.assertEqual(sorted(client.submitted), [name for name, _, _ in records])
+        self.assertEqual(sorted(self.done), sorted((name, seq_hash, True) for name, _, seq_hash in records))
+        for name, _, _ in records:
+            for extension in ('jnet', 'tar.gz'):
+                self.assertTrue(os.path.isfile(os.path.join(self.output_dir, '{}.{}'.format(name, extension))))
+        with open(self.state_file) as infile:
+            self.assertEqual(json.load(infile), {})
+
+    def test_backoff(self):
+        client = FakeClient(self.clock, polls={'seq': 7})
+        self.schedule(client, [('seq', 'seq.fasta', 'hash')], min_interval=10, max_interval=50)
+
+        polled = client.polled['jp_seq']
+        intervals = [round(b - a) for a, b in zip([1000.0] + polled, polled)]
+        self.assertEqual(intervals, [10, 20, 40, 50, 50, 50, 50])
+        self.assertTrue(all(seconds >= 10 for seconds in self.clock.slept))
+
+    def test_resume_from_state_file(self):
+        save_jobs({'old': {'jobid': 'jp_old', 'hash': 'hash1', 'submitted': 900.0},
+                   'changed': {'jobid': 'jp_changed_before', 'hash': 'stale', 'submitted': 900.0}},
+                  self.state_file)
+        client = FakeClient(self.clock, polls={'jp_old': 1})
+        outcome = self.schedule(client, [('new', 'new.fasta', 'hash0'), ('old', 'old.fasta', 'hash1'),
+                                         ('changed', 'changed.fasta', 'hash2')], max_jobs=1)
+
+        self.assertEqual(outcome, {'new': 'finished', 'old': 'finished', 'changed': 'finished'})
+        # the job of the previous run is polled (first), not submitted again
+        self.assertEqual(client.submitted, ['new', 'changed'])
+        self.assertEqual(list(client.polled)[0], 'jp_old')
+        self.assertNotIn('jp_changed_before', client.polled)
+
+    def test_interrupted_run_keeps_its_jobs(self):
+        client = FakeClient(self.clock, default_polls=None)
+
+        def interrupt(seconds):
+            if self.clock.now > 1100:
+                raise KeyboardInterrupt()
+            self.clock.sleep(seconds)
+
+        with self.assertRaises(KeyboardInterrupt):
+            schedule_jobs([('seq', 'seq.fasta', 'hash')], client, self.output_dir, self.state_file,
+                          sleep=interrupt, clock=self.clock.time)
+        with open(self.state_file) as infile:
+            self.assertEqual(json.load(infile)['seq']['jobid'], 'jp_seq')
+
+    def test_max_wait(self):
+        client = FakeClient(self.clock, default_polls=None)
+        outcome = self.schedule(client, [('stuck1', 'stuck1.fasta', 'hash1'),
+                                         ('stuck2', 'stuck2.fasta', 'hash2')],
+                                max_interval=60, max_wait=600)
+
+        self.assertEqual(outcome, {'stuck1': 'failed', 'stuck2': 'failed'})
+        self.assertEqual(sorted(self.done), [('stuck1', 'hash1', False), ('stuck2', 'hash2', False)])
+        self.assertTrue(600 <= self.clock.now - 1000 <= 600 + 60)
+        with open(self.state_file) as infile:
+            self.assertEqual(json.load(infile), {})
+
+    def test_failed_submission(self):
+        client = FakeClient(self.clock, fail_submit=('bad',))
+        outcome = self.schedule(client, [('bad', 'bad.fasta', 'hash0'), ('good', 'good.fasta', 'hash1')])
+
+        self.assertEqual(outcome, {'bad': 'failed', 'good': 'finished'})
+        self.assertIn(('bad', 'hash0', False), self.done)
+
+
+class JPredStub(BaseHTTPRequestHandler):
+    """
+    Stand-in for the JPred REST API: jobs are running for their first
+    status request and finished afterwards, job names are checked as the
+    server does and jp_busy always gets a 503.
+    """
+
+    jobs = {}
+    submissions = []
+
+    def send_text(self, status, text, headers=()):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        fields = body.split(u'\u00a3\u20ac\u00a3\u20ac')
+        params = dict(field.split('=', 1) for field in fields[:-1])
+        JPredStub.submissions.append((params, fields[-1]))
+        if not params['name'].replace('_', '').isalnum():
+            self.send_text(400, 'ERROR: name parameter could only be built from Latin characters, '
+                                'numbers, and \'_\' symbol.')
+            return
+        jobid = 'jp_{}'.format(len(JPredStub.submissions))
+        JPredStub.jobs[jobid] = 0
+        self.send_text(202, 'created', [('Location', 'http://{}:{}/cgi-bin/rest/job/id/{}'.format(
+            self.server.server_address[0], self.server.server_address[1], jobid))])
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts[:4] == ['cgi-bin', 'rest', 'job', 'id']:
+            jobid = parts[4]
+            if jobid == 'jp_busy':
+                self.send_text(503, 'Service Unavailable')
+            elif jobid not in JPredStub.jobs:
+                self.send_text(200, 'No job of that ID ({})'.format(jobid))
+            else:
+                JPredStub.jobs[jobid] += 1
+                state = 'running' if JPredStub.jobs[jobid] < 2 else 'finished'
+                self.send_text(200, 'Job {} {}. Results available at the following URL: ...'.format(jobid, state))
+        elif parts[0] == 'results' and parts[1] in JPredStub.jobs and JPredStub.jobs[parts[1]] >= 2:
+            self.send_text(200, '{} results\n'.format(parts[2]))
+        else:
+            self.send_text(404, 'Not Found')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestJPredClient(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), JPredStub)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        JPredStub.jobs = {}
+        JPredStub.submissions = []
+
+        self.output_dir = tempfile.mkdtemp(prefix='jpred_')
+        self.input_seq = os.path.join(self.output_dir, 'input.fasta')
+        with open(self.input_seq, 'w') as output:
+            output.write('>sp|P31946|1433B_HUMAN\nMTMDKSELVQKAKLAEQAERYDDMAA\n')
+        self.client = JPredClient(url='http://127.0.0.1:{}'.format(self.server.server_address[1]),
+                                  timeout=10, retries=0)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def test_job_name(self):
+        self.assertEqual(job_name('sp|P31946|1433B_HUMAN'), 'sp_P31946_1433B_HUMAN')
+        self.assertEqual(job_name('3tpp_A.1-2'), '3tpp_A_1_2')
+        self.assertEqual(job_name('3tpp_A'), '3tpp_A')
+
+    def test_submit(self):
+        jobid = self.client.submit(self.input_seq, 'sp|P31946|1433B_HUMAN')
+
+        self.assertEqual(jobid, 'jp_1')
+        params, fasta = JPredStub.submissions[0]
+        self.assertEqual(params, {'email': 'funpdbe@dundee.ac.uk', 'name': 'sp_P31946_1433B_HUMAN',
+                                  'skipPDB': 'on', 'format': 'seq'})
+        self.assertEqual(fasta, '>sp|P31946|1433B_HUMAN\nMTMDKSELVQKAKLAEQAERYDDMAA\n')
+
+    def test_status(self):
+        jobid = self.client.submit(self.input_seq, 'P31946')
+
+        self.assertEqual(self.client.status(jobid).state, 'running')
+        self.assertEqual(self.client.status(jobid).state, 'finished')
+        # server errors are retried later, unknown jobs fail on the third check
+        self.assertEqual(self.client.status('jp_busy').state, 'running')
+        self.assertEqual([self.client.status('jp_unknown').state for _ in range(3)],
+                         ['running', 'running', 'failed'])
+
+    def test_results(self):
+        jobid = self.client.submit(self.input_seq, 'P31946')
+        output_file = os.path.join(self.output_dir, 'P31946.jnet')
+
+        self.assertFalse(self.client.results(jobid, 'jnet', output_file))
+        self.assertFalse(os.path.exists(output_file))
+        self.client.status(jobid)
+        self.client.status(jobid)
+        self.assertTrue(self.client.results(jobid, 'jnet', output_file))
+        with open(output_file) as infile:
+            self.assertEqual(infile.read(), '{}.jnet results\n'.format(jobid))
+
+    def test_schedule_jobs(self):
+        records = [('sp|P31946|1433B_HUMAN', self.input_seq, 'hash0'), ('3tpp_A.1', self.input_seq, 'hash1')]
+        outcome = schedule_jobs(records, self.client, self.output_dir,
+                                os.path.join(self.output_dir, 'jobs.json'), min_interval=0,
+                                sleep=lambda seconds: None)
+
+        self.assertEqual(outcome, {'sp|P31946|1433B_HUMAN': 'finished', '3tpp_A.1': 'finished'})
+        self.assertEqual(sorted(params['name'] for params, _ in JPredStub.submissions),
+                         ['3tpp_A_1', 'sp_P31946_1433B_HUMAN'])
+        for name, _, _ in records:
+            for extension in ('jnet', 'tar.gz'):
+                self.assertTrue(os.path.isfile(os.path.join(self.output_dir, '{}.{}'.format(name, extension))))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from manifest import is_done, open_manifest, record_done, sequence_hash
+
+RECORDS = {'3tpp_A': 'RGSFVEMTVGSPPQTDNLRGKSGQGYYVEM',
+           '4kju_C': 'AMYSEEARLKSFQNWPDYAHLTPRELASAG'}
+VERSION = 'models=1'
+
+
+class TestManifest(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='manifest_')
+        self.manifest = open_manifest(self.output_dir)
+
+    def tearDown(self):
+        self.manifest.close()
+        shutil.rmtree(self.output_dir)
+
+    def run_tool(self, records, version=VERSION):
+        """
+        Runs a fake tool over records: each record not done is "predicted"
+        (an output named after it) and recorded.
+
+        :return: returns the identifiers run
+        """
+
+        run = []
+        for identifier, sequence in sorted(records.items()):
+            outputs = ['{}.out'.format(identifier)]
+            if is_done(self.manifest, self.output_dir, identifier, sequence_hash(sequence), version, outputs):
+                continue
+            with open(os.path.join(self.output_dir, outputs[0]), 'w') as output:
+                output.write('{} {}\n'.format(sequence, version))
+            record_done(self.manifest, self.output_dir, identifier, sequence_hash(sequence), version, outputs)
+            run.append(identifier)
+        return run
+
+    def test_rerun_skips_everything(self):
+        self.assertEqual(self.run_tool(RECORDS), ['3tpp_A', '4kju_C'])
+        self.assertEqual(self.run_tool(RECORDS), [])
+
+        # and so does a new connection (e.g. the next run)
+        self.manifest.close()
+        self.manifest = open_manifest(self.output_dir)
+        self.assertEqual(self.run_tool(RECORDS), [])
+
+    def test_changed_sequence_is_rerun(self):
+        self.run_tool(RECORDS)
+        changed = dict(RECORDS, **{'4kju_C': RECORDS['4kju_C'].replace('SEE', 'SQE')})
+        self.assertNotEqual(sequence_hash(changed['4kju_C']), sequence_hash(RECORDS['4kju_C']))
+        self.assertEqual(self.run_tool(changed), ['4kju_C'])
+        self.assertEqual(self.run_tool(changed), [])
+
+        # the case of the sequence is not a change
+        self.assertEqual(self.run_tool(dict((key, value.lower()) for key, value in changed.items())), [])
+
+    def test_changed_version_is_rerun(self):
+        self.run_tool(RECORDS)
+        self.assertEqual(self.run_tool(RECORDS, version='models=2'), ['3tpp_A', '4kju_C'])
+
+    def test_changed_or_missing_output_is_rerun(self):
+        self.run_tool(RECORDS)
+        with open(os.path.join(self.output_dir, '3tpp_A.out'), 'a') as output:
+            output.write('edited\n')
+        os.remove(os.path.join(self.output_dir, '4kju_C.out'))
+        self.assertEqual(self.run_tool(RECORDS), ['3tpp_A', '4kju_C'])
+
+    def test_no_outputs_is_never_done(self):
+        seq_hash = sequence_hash(RECORDS['3tpp_A'])
+        record_done(self.manifest, self.output_dir, '3tpp_A', seq_hash, VERSION, [])
+        self.assertFalse(is_done(self.manifest, self.output_dir, '3tpp_A', seq_hash, VERSION, []))
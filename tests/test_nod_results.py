@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from nod_results import iter_nod_records, iter_nod_results, parse_nod_record
+from run_predictors import split_nod_output
+
+NOD_OUTPUT = os.path.join(os.path.dirname(__file__), '..', 'data', 'output', 'NOD')
+RECORDS = ['4oqb_A', '3tpp_A', '3k2o_A']
+
+
+def read_lines(name):
+    with open(os.path.join(NOD_OUTPUT, '{}.nod'.format(name))) as infile:
+        return infile.readlines()
+
+
+class NodFixture(TestCase):
+    """
+    Multi-record NOD output made of the stored single-record outputs.
+    """
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix='nod_')
+        self.lines = dict((name, read_lines(name)) for name in RECORDS)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def write_nod(self, *records):
+        """
+        Writes a NOD output of stored records (by name) and raw lines.
+        """
+
+        nod_file = os.path.join(self.output_dir, 'chunk.nod')
+        with open(nod_file, 'w') as output:
+            for record in records:
+                output.writelines(self.lines[record] if isinstance(record, str) else record)
+        return nod_file
+
+
+class TestParseNodResults(NodFixture):
+
+    def test_multi_record(self):
+        nod_file = self.write_nod(*RECORDS)
+        records = list(iter_nod_records(nod_file))
+        self.assertEqual([identifier for identifier, _, _ in records], RECORDS)
+        self.assertEqual([start for _, start, _ in records], [1, 211, 214])
+        for identifier, _, lines in records:
+            self.assertEqual(lines, self.lines[identifier])
+
+        results = list(iter_nod_results(nod_file))
+        self.assertEqual([result.identifier for result in results], RECORDS)
+        self.assertEqual([len(result.sequence) for result in results], [222, 0, 330])
+        self.assertEqual([len(result.scores) for result in results], [202, 0, 310])
+        self.assertEqual(results[0].segment_ranges.tolist(), [[203, 222]])
+        self.assertEqual(results[0].segments, ['REISYLKKLKVKKQDRIFPP'])
+        self.assertEqual(results[1].segment_ranges.shape, (0, 2))
+        self.assertEqual(results[2].segment_ranges.tolist(), [[1, 23], [81, 106], [290, 320]])
+        self.assertEqual(len(results[2].segments), 3)
+        self.assertAlmostEqual(float(results[2].scores[0]), 0.89, places=6)
+
+    def test_empty_record(self):
+        nod_file = self.write_nod('4oqb_A', ['>empty_A\n'], '3tpp_A')
+        records = list(iter_nod_records(nod_file))
+        self.assertEqual([identifier for identifier, _, _ in records], ['4oqb_A', 'empty_A', '3tpp_A'])
+        self.assertEqual(records[1][2], ['>empty_A\n'])
+        with self.assertRaisesRegex(ValueError, 'empty_A .*empty or truncated'):
+            parse_nod_record(*records[1])
+
+    def test_truncated_record(self):
+        # cut in the sequence, before the result lines
+        lines = self.lines['3k2o_A']
+        nod_file = self.write_nod('4oqb_A', lines[:3])
+        results = iter_nod_results(nod_file)
+        self.assertEqual(next(results).identifier, '4oqb_A')
+        with self.assertRaisesRegex(ValueError, '3k2o_A .*empty or truncated'):
+            next(results)
+
+        # cut in the segment positions
+        cut = lines[:7] + [lines[7][:len('NOLS_segments_positions: 1-23, 81-')] + '\n']
+        with self.assertRaisesRegex(ValueError, 'line 8 '):
+            list(iter_nod_results(self.write_nod(cut)))
+
+        # cut before the segment sequences
+        with self.assertRaisesRegex(ValueError, '3 segments but 3 positions and 0 sequences'):
+            list(iter_nod_results(self.write_nod(lines[:8])))
+
+    def test_no_header(self):
+        with self.assertRaisesRegex(ValueError, 'no FASTA header before line 2'):
+            list(iter_nod_records(self.write_nod(['\n', '0.5\n'] + self.lines['3tpp_A'])))
+
+
+class TestSplitNodOutput(NodFixture):
+
+    def setUp(self):
+        NodFixture.setUp(self)
+        self.split_dir = tempfile.mkdtemp(prefix='nod_split_')
+
+    def tearDown(self):
+        NodFixture.tearDown(self)
+        shutil.rmtree(self.split_dir)
+
+    def split(self, *records):
+        return split_nod_output(self.write_nod(*records), self.split_dir)
+
+    def test_multi_record(self):
+        self.assertEqual(self.split(*RECORDS), RECORDS)
+        self.assertEqual(sorted(os.listdir(self.split_dir)), sorted('{}.nod'.format(name) for name in RECORDS))
+        for name in RECORDS:
+            with open(os.path.join(self.split_dir, '{}.nod'.format(name))) as infile:
+                self.assertEqual(infile.readlines(), self.lines[name])
+
+    def test_empty_record(self):
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(self.split('4oqb_A', ['>empty_A\n'], '3tpp_A'), ['4oqb_A', '3tpp_A'])
+        self.assertIn('empty_A', logs.output[0])
+        self.assertEqual(sorted(os.listdir(self.split_dir)), ['3tpp_A.nod', '4oqb_A.nod'])
+
+    def test_truncated_record(self):
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(self.split('3tpp_A', '4oqb_A', self.lines['3k2o_A'][:4]), ['3tpp_A', '4oqb_A'])
+        self.assertIn('3k2o_A', logs.output[0])
+        self.assertEqual(sorted(os.listdir(self.split_dir)), ['3tpp_A.nod', '4oqb_A.nod'])
+
+    def test_rewrites_records(self):
+        self.split('3tpp_A')
+        self.assertEqual(self.split('3k2o_A', '3tpp_A'), ['3k2o_A', '3tpp_A'])
+        with open(os.path.join(self.split_dir, '3tpp_A.nod')) as infile:
+            self.assertEqual(infile.readlines(), self.lines['3tpp_A'])
+        self.assertEqual(sorted(os.listdir(self.split_dir)), ['3k2o_A.nod', '3tpp_A.nod'])
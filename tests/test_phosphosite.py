@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib', '1433pred'))
+import methods
+
+# PhosphoSitePlus Phosphorylation_site_dataset (current MOD_RSD format)
+DATASET = """PROTEIN\tACC_ID\tGENE\tHU_CHR_LOC\tORGANISM\tMOD_RSD\tSITE_GRP_ID
+14-3-3 beta\tP31946\tYWHAB\t20q13.12\thuman\tS60-p\t447695
+14-3-3 beta\tP31946\tYWHAB\t20q13.12\thuman\tT84-p\t447696
+14-3-3 beta\tP31946\tYWHAB\t20q13.12\thuman\tY106-p\t447697
+14-3-3 beta\tP31946\tYWHAB\t20q13.12\thuman\tS186-p\t447698
+Csk\tP41240\tCSK\t15q24.1\thuman\tS364-p\t447699
+"""
+
+
+class TestPhosphoSite(TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp(prefix='phosphosite_')
+        self.saved = (os.getcwd(), methods.PHOSPHOSITE_TXT, methods.PHOSPHOSITE_DB, methods.phosphosite_cache)
+        methods.PHOSPHOSITE_TXT = os.path.join(self.workspace, 'PhosphoSite.txt')
+        methods.PHOSPHOSITE_DB = os.path.join(self.workspace, 'PhosphoSite.db')
+        methods.phosphosite_cache = None
+        os.chdir(self.workspace)
+
+    def tearDown(self):
+        if methods.phosphosite_cache is not None:
+            methods.phosphosite_cache[1].close()
+        cwd, methods.PHOSPHOSITE_TXT, methods.PHOSPHOSITE_DB, methods.phosphosite_cache = self.saved
+        os.chdir(cwd)
+        shutil.rmtree(self.workspace)
+
+    def test_run_keeps_the_dataset_format(self):
+        with open('Phosphorylation_site_dataset', 'w') as output:
+            output.write(DATASET)
+        methods.run()
+
+        # header and Ser/Thr sites as in the original PhosphoSite.txt (with the -p suffix)
+        with open(methods.PHOSPHOSITE_TXT) as infile:
+            self.assertEqual(infile.read(), 'ACC_ID\tMOD_RSD\nP31946\t60-p\nP31946\t84-p\nP31946\t186-p\nP41240\t364-p\n')
+        self.assertEqual(methods.get_phosphosite_sites(['P31946', 'P41240', 'P00000']),
+                         {'P31946': ['60', '84', '186'], 'P41240': ['364'], 'P00000': []})
+
+    def test_index_reads_both_formats(self):
+        with open(methods.PHOSPHOSITE_TXT, 'w') as output:
+            output.write('ACC_ID\tMOD_RSD\nP31946\t60\nP31946\t84-p\nP41240\t364-p\n')
+        self.assertEqual(list(methods.iter_phosphosite_txt(methods.PHOSPHOSITE_TXT)),
+                         [('P31946', 60), ('P31946', 84), ('P41240', 364)])
+        self.assertEqual(methods.get_phosphosite_sites(['P31946'])['P31946'], ['60', '84'])
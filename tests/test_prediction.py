@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+from unittest import TestCase
+
+from click.testing import CliRunner
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib', '1433pred'))
+import prediction
+from run_predictors import main
+
+
+class TestFormats(TestCase):
+
+    def test_selection(self):
+        self.assertEqual(prediction.get_formats(), prediction.legacy_formats)
+        self.assertEqual(prediction.get_formats(['json', ' CSV']), ['csv', 'json'])
+        self.assertEqual(prediction.get_formats(['none']), [])
+
+    def test_unknown_format(self):
+        for formats in (['cvs'], ['csv', 'xml'], ['none', 'csv'], ['']):
+            with self.assertRaisesRegex(ValueError, 'Unknown format'):
+                prediction.get_formats(formats)
+
+    def test_command_line(self):
+        result = CliRunner().invoke(main, ['1433pred', '--formats', 'csv,cvs', os.devnull])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("Unknown format 'cvs'", result.output)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import random
+import subprocess
+from unittest import TestCase, skipUnless
+
+from Bio import AlignIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib', '1433pred'))
+import predictor
+
+PSSM_FILES = ('PSSM_POS.fasta', 'PSSM_NEG.fasta', 'PSSM_BACK.fasta')
+ANN_BINARY = os.path.join(predictor.PATH, 'ANN')
+
+def random_peptides(alphabet, count=500, length=10, seed=0):
+    """
+    Fixed set of random peptides over an alphabet.
+    """
+
+    generator = random.Random(seed)
+    return [''.join(generator.choice(alphabet) for _ in range(length)) for _ in range(count)]
+
+
+def legacy_pssm_matrix(input_fasta):
+    """
+    Frequency matrix of the original 14-3-3-Pred (column counts with a
+    pseudo-count of 0.5), as lists.
+    """
+
+    motifs = [str(record.seq) for record in AlignIO.read(os.path.join(predictor.PATH, input_fasta), 'fasta')]
+    columns = [''.join(motif[p] for motif in motifs) for p in range(len(motifs[0]))]
+    return [[(column.count(aa) * 1.0 + 0.5) / (len(column) + 0.5) for column in columns]
+            for aa in predictor.aa_valid_gap]
+
+
+def legacy_pssm_scoring(peptide, positives, negatives, background):
+    """
+    Per-peptide PSSM score of the original 14-3-3-Pred.
+    """
+
+    score = 0.0
+    position = -1
+    for aa in peptide:
+        if aa in predictor.aa_valid_gap:
+            position += 1
+            matched = predictor.aa_valid_gap.index(aa)
+            score += (positives[matched][position] - negatives[matched][position]) * 1.0 / \
+                background[matched][position]
+    return score / len(peptide)
+
+
+def legacy_ann_prediction(peptides):
+    """
+    Scores peptides with the compiled snns2c network (./ANN) as the original
+    14-3-3-Pred did: orthogonal encoding, 20 inputs per residue (all zeros
+    for anything but aa_valid) and one output per line.
+    """
+
+    rows = []
+    for peptide in peptides:
+        encoding = []
+        for aa in peptide.upper():
+            encoding.extend('1' if aa == valid else '0' for valid in predictor.aa_valid)
+        rows.append(' '.join(encoding) + ' \n')
+
+    process = subprocess.Popen([ANN_BINARY, str(20 * len(peptides[0])), str(len(peptides))],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = process.communicate(''.join(rows).encode('ascii'))
+    if process.returncode != 0:
+        raise RuntimeError('ANN exited with status %i' % process.returncode)
+    return [float(line) for line in output.decode('ascii').split()]
+
+
+def ann_binary_runs():
+    try:
+        return len(legacy_ann_prediction(['AAAAAAAAAA'])) == 1
+    except (OSError, RuntimeError, ValueError):
+        return False
+
+
+class TestEncodePeptides(TestCase):
+
+    def test_standard_residues(self):
+        encoded = predictor.encode_peptides(['ARNDCQEGHI', 'LKMFPSTWYV'])
+        self.assertEqual(encoded.dtype.name, 'uint8')
+        self.assertEqual(encoded.tolist(), [list(range(10)), list(range(10, 20))])
+
+    def test_gap_and_ambiguous_residues(self):
+        encoded = predictor.encode_peptides(['-BJOUXZ---'])[0].tolist()
+        alphabet = predictor.peptide_alphabet
+        self.assertEqual(encoded[0], alphabet.index('-'))
+        self.assertEqual(encoded[1:7], [alphabet.index(aa) for aa in 'BJOUXZ'])
+        self.assertEqual(encoded[1:7], list(range(len(predictor.aa_valid_gap), len(alphabet))))
+
+    def test_lowercase_as_uppercase(self):
+        encoded = predictor.encode_peptides(['arndcqeghi', 'ARNDCQEGHI', '-bjouxz---', '-BJOUXZ---'])
+        self.assertEqual(encoded[0].tolist(), encoded[1].tolist())
+        self.assertEqual(encoded[2].tolist(), encoded[3].tolist())
+
+    def test_other_symbols(self):
+        encoded = predictor.encode_peptides(['*1?. AAAAA'])[0].tolist()
+        self.assertEqual(encoded[:5], [len(predictor.peptide_alphabet)] * 5)
+        self.assertEqual(encoded[5:], [0] * 5)
+
+    def test_shapes(self):
+        self.assertEqual(predictor.encode_peptides([]).shape, (0, 0))
+        self.assertEqual(predictor.encode_peptides(['AAAAAAAAAA'] * 3).shape, (3, 10))
+        with self.assertRaises(ValueError):
+            predictor.encode_peptides(['AAAAAAAAAA', 'AAAAAAAAA'])
+
+
+class TestPSSM(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.legacy = [legacy_pssm_matrix(name) for name in PSSM_FILES]
+        cls.matrices = [predictor.pssm_matrix_from_fasta(name) for name in PSSM_FILES]
+        positives, negatives, background = cls.matrices
+        cls.scoring = (positives - negatives) * 1.0 / background
+
+    def test_matrices(self):
+        for legacy, matrix in zip(self.legacy, self.matrices):
+            self.assertEqual(matrix.shape, (len(predictor.aa_valid_gap), len(legacy[0])))
+            for row, legacy_row in zip(matrix.tolist(), legacy):
+                for value, legacy_value in zip(row, legacy_row):
+                    self.assertAlmostEqual(value, legacy_value, places=12)
+
+    def test_batch_scores_match_legacy(self):
+        peptides = random_peptides(predictor.aa_valid_gap) + ['----RGFVEM', 'DNLRGKGQGY', 'LTPREL----']
+        scores = predictor.pssm_batch_scores(predictor.encode_peptides(peptides), self.scoring)
+        self.assertEqual(len(scores), len(peptides))
+        for peptide, score in zip(peptides, scores.tolist()):
+            self.assertAlmostEqual(score, legacy_pssm_scoring(peptide, *self.legacy), places=12)
+
+    def test_ambiguous_residues_score_zero_in_place(self):
+        # unlike the original (which skipped them and shifted the following
+        # residues) ambiguous residues score 0 and keep the positions
+        peptides = ['DNLRGXGQGY', 'BNLRGKGQGZ', 'DNLUGKGQGY']
+        scores = predictor.pssm_batch_scores(predictor.encode_peptides(peptides), self.scoring)
+        for peptide, score in zip(peptides, scores.tolist()):
+            expected = sum(self.scoring[predictor.aa_valid_gap.index(aa), position]
+                           for position, aa in enumerate(peptide) if aa in predictor.aa_valid_gap)
+            self.assertAlmostEqual(score, expected / len(peptide), places=12)
+
+    def test_empty_batch(self):
+        self.assertEqual(predictor.pssm_batch_scores(predictor.encode_peptides([]), self.scoring).shape, (0,))
+
+
+class TestANN(TestCase):
+
+    def test_network(self):
+        hidden_weights, hidden_biases, output_weights, output_biases = predictor.ann_load_network()
+        self.assertEqual(hidden_weights.shape, (len(hidden_biases), 10 * len(predictor.aa_valid)))
+        self.assertEqual(output_weights.shape, (1, len(hidden_biases)))
+        self.assertEqual(output_biases.shape, (1,))
+
+    @skipUnless(ann_binary_runs(), 'the compiled ANN does not run on this platform')
+    def test_forward_matches_compiled_network(self):
+        # the compiled network prints 6 decimal places
+        peptides = (random_peptides(predictor.aa_valid) +
+                    random_peptides(predictor.peptide_alphabet + ['*'], seed=1) +
+                    ['----RGFVEM', 'dnlrgkgqgy', 'LTPREL----'])
+        scores = predictor.ann_forward(predictor.encode_peptides(peptides)).tolist()
+        legacy = legacy_ann_prediction(peptides)
+        self.assertEqual(len(scores), len(legacy))
+        for peptide, score, legacy_score in zip(peptides, scores, legacy):
+            self.assertLessEqual(abs(score - legacy_score), 1e-6, peptide)
+
+    def test_gap_and_ambiguous_residues_have_no_input(self):
+        scores = predictor.ann_forward(predictor.encode_peptides(['DNLRG-GQGY', 'DNLRGXGQGY', 'DNLRGBGQGY',
+                                                                  'DNLRG*GQGY', 'DNLRGzGQGY'])).tolist()
+        for score in scores[1:]:
+            self.assertEqual(score, scores[0])
+
+    def test_wrong_length(self):
+        with self.assertRaises(ValueError):
+            predictor.ann_forward(predictor.encode_peptides(['AAAAAAAAA']))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib', '1433pred'))
+import methods
+
+ENTRY_TXT = """ID   1433B_HUMAN             Reviewed;         246 AA.
+FT   MOD_RES         2
+FT                   /note="N-acetylthreonine"
+FT   MOD_RES         60
+FT                   /note="Phosphoserine"
+FT   MOD_RES         84
+FT                   /note="Phosphothreonine"
+//
+"""
+
+
+class UniProtStub(BaseHTTPRequestHandler):
+    """
+    Stand-in for UniProt: P31946 exists, P00000 does not (404) and P50000
+    is unavailable (503). Requests are counted per path.
+    """
+
+    hits = {}
+
+    def do_GET(self):
+        UniProtStub.hits[self.path] = UniProtStub.hits.get(self.path, 0) + 1
+        accession, extension = self.path.rsplit('/', 1)[-1].split('.')
+        if accession == 'P31946':
+            body = '>sp|P31946|1433B_HUMAN\nMTMDKSELVQKAKLAEQAERYDDMAA\n' if extension == 'fasta' else ENTRY_TXT
+            self.send_response(200)
+        elif accession == 'P50000':
+            body = 'Service Unavailable'
+            self.send_response(503)
+        else:
+            body = 'Not Found'
+            self.send_response(404)
+        body = body.encode('utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUniProtCache(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), UniProtStub)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        UniProtStub.hits = {}
+
+        self.cache = tempfile.mkdtemp(prefix='uniprot_')
+        self.saved = (methods.UNIPROT_URL, methods.UNIPROT_DB, methods.uniprot_cache, methods.uniprot_failed)
+        methods.UNIPROT_URL = 'http://127.0.0.1:%i/uniprot' % self.server.server_address[1]
+        methods.UNIPROT_DB = os.path.join(self.cache, 'UniProt.db')
+        methods.uniprot_cache = None
+        methods.uniprot_failed = set()
+
+    def tearDown(self):
+        if methods.uniprot_cache is not None:
+            methods.uniprot_cache[1].close()
+        methods.UNIPROT_URL, methods.UNIPROT_DB, methods.uniprot_cache, methods.uniprot_failed = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache)
+
+    def test_fetch_statuses(self):
+        self.assertEqual(methods.fetch_uniprot_entry('P31946')[2:], (['60', '84'], 200))
+        self.assertEqual(methods.fetch_uniprot_entry('P00000'), ('P00000', '', [], 404))
+        self.assertEqual(methods.fetch_uniprot_entry('P50000'), ('P50000', None, None, None))
+
+    def test_prefetch_caches_200_and_404_only(self):
+        methods.prefetch_uniprot(['P31946', 'P00000', 'P50000'])
+        entries = methods.load_uniprot_entries(['P31946', 'P00000', 'P50000'])
+        self.assertEqual(sorted(entries), ['P00000', 'P31946'])
+        self.assertTrue(entries['P31946'][0].startswith('>sp|P31946|'))
+        self.assertEqual(entries['P31946'][1], ['60', '84'])
+        self.assertEqual(entries['P00000'][:2], ('', []))
+
+    def test_failed_entries_are_fetched_once_per_run(self):
+        methods.prefetch_uniprot(['P31946', 'P00000', 'P50000'])
+        self.assertEqual(methods.get_uniprot_entry('P50000'), ('', []))
+        methods.prefetch_uniprot(['P31946', 'P00000', 'P50000'])
+
+        # neither the cached entries nor the unavailable one are downloaded again
+        self.assertEqual(UniProtStub.hits['/uniprot/P31946.fasta'], 1)
+        self.assertEqual(UniProtStub.hits['/uniprot/P00000.fasta'], 1)
+        self.assertEqual(UniProtStub.hits['/uniprot/P50000.fasta'], 1)
+        self.assertEqual(methods.uniprot_failed, set(['P50000']))
+
+    def test_failed_entries_are_fetched_again_next_run(self):
+        methods.prefetch_uniprot(['P31946', 'P50000'])
+        methods.uniprot_failed = set()
+        methods.prefetch_uniprot(['P31946', 'P50000'])
+        self.assertEqual(UniProtStub.hits['/uniprot/P31946.fasta'], 1)
+        self.assertEqual(UniProtStub.hits['/uniprot/P50000.fasta'], 2)
+
+
+class TestUniProtSession(TestCase):
+
+    def setUp(self):
+        self.saved = methods.uniprot_session
+        methods.uniprot_session = None
+
+    def tearDown(self):
+        if methods.uniprot_session is not None:
+            methods.uniprot_session[2].close()
+        methods.uniprot_session = self.saved
+
+    def pool_size(self, session):
+        return session.get_adapter('http://www.uniprot.org')._pool_maxsize
+
+    def test_sized_by_jobs(self):
+        session = methods.get_uniprot_session(2)
+        self.assertEqual(self.pool_size(session), 2)
+        self.assertIs(methods.get_uniprot_session(2), session)
+        self.assertIs(methods.get_uniprot_session(), session)
+
+        resized = methods.get_uniprot_session(16)
+        self.assertIsNot(resized, session)
+        self.assertEqual(self.pool_size(resized), 16)
+        self.assertIs(methods.get_uniprot_session(), resized)
+
+    def test_default_size(self):
+        self.assertEqual(self.pool_size(methods.get_uniprot_session()), 8)